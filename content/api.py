@@ -0,0 +1,116 @@
+"""Streaming scoring API, mounted on the FastAPI app of NiceGUI.
+
+POST /api/score with a JSON body such as
+
+    {"protospacer": "GACGCATAAAGATGAGACGCTGG",
+     "off_targets": ["GACGCATAAAGATGAGACGCAGG", ...],
+     "context": "invitro",
+     "parameter_set": "sequence_params"}
+
+returns newline-delimited JSON (application/x-ndjson) with one object
+per off-target, in input order, as soon as its chunk has been scored:
+
+    {"index": 0, "sequence": "GACG...", "p_clv": ..., "u_eff": ...,
+     "k_clv": ..., "kd": ...}
+
+Non-finite values (e.g. a k_clv that underflows) are written as null,
+which keeps every line valid JSON.
+"""
+
+import asyncio
+import json
+import math
+from collections import deque
+from typing import Literal
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from nicegui import app
+from pydantic import BaseModel
+
+from .input import chunk_size, workers, run_scoring
+from .batch import CONTEXTS, PARAMETER_SETS, SCORE_FUNCS, score_chunk
+from .sequences import get_sequence_error, find_sequence_error
+
+
+class ScoreRequest(BaseModel):
+    protospacer: str
+    off_targets: list[str]
+    context: Literal[CONTEXTS] = 'invitro'
+    parameter_set: Literal[PARAMETER_SETS] = 'sequence_params'
+    metrics: list[Literal[tuple(SCORE_FUNCS)]] = list(SCORE_FUNCS)
+
+
+async def stream_scores(protospacer, off_targets, context, parameter_set,
+                        metrics):
+    """Score the off-targets in chunks and yield them as NDJSON lines.
+    Up to one chunk per worker is scored ahead of the output."""
+    tasks = deque()
+    try:
+        for start in range(0, len(off_targets), chunk_size):
+            chunk = off_targets[start:start + chunk_size]
+            tasks.append((start, chunk, asyncio.ensure_future(
+                run_scoring(
+                    score_chunk,
+                    protospacer=protospacer,
+                    off_targets=chunk,
+                    context=context,
+                    parameter_set=parameter_set,
+                    metrics=metrics,
+                )
+            )))
+            if len(tasks) < max(workers, 1):
+                continue
+            lines = await get_lines(*tasks.popleft(), metrics)
+            if lines is None:  # app is shutting down
+                return
+            yield lines
+
+        while tasks:
+            lines = await get_lines(*tasks.popleft(), metrics)
+            if lines is None:
+                return
+            yield lines
+    finally:
+        for _, _, task in tasks:
+            task.cancel()
+
+
+def get_json_value(value):
+    """Metric value as a JSON number, or None (null) if it is not
+    finite; NaN and Infinity are not valid JSON."""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+async def get_lines(start, chunk, task, metrics):
+    values = await task
+    if values is None:
+        return None
+    return ''.join(
+        json.dumps({'index': start + i, 'sequence': seq,
+                    **{m: get_json_value(values[m][i]) for m in metrics}},
+                   allow_nan=False) + '\n'
+        for i, seq in enumerate(chunk)
+    )
+
+
+@app.post('/api/score')
+async def score(request: ScoreRequest):
+    protospacer = request.protospacer.strip().upper()
+    off_targets = [seq.strip().upper() for seq in request.off_targets]
+
+    err_msg = get_sequence_error(protospacer)
+    if err_msg:
+        raise HTTPException(422, f"Target sequence error: {err_msg}")
+    error = find_sequence_error(off_targets)
+    if error:
+        i, err_msg = error
+        raise HTTPException(422, f"Off-target sequence error: "
+                                 f"{err_msg} (target #{i + 1})")
+
+    return StreamingResponse(
+        stream_scores(protospacer, off_targets, request.context,
+                      request.parameter_set, request.metrics),
+        media_type='application/x-ndjson',
+    )
@@ -0,0 +1,80 @@
+"""Scoring of off-target chunks on all metrics of the tool, shared by
+the command-line entry point and the scoring API."""
+
+import numpy as np
+
+from .scoring import (make_stc_list, load_protein, get_k_on_off,
+                      get_pattern_table, get_all_cleavage_probs,
+                      get_all_cleavage_rates, get_all_effective_stabs,
+                      get_all_binding_const, AVERAGE_PARAMETER_SETS)
+from .engine import score_landscapes
+from .landscapes import get_sequence_landscapes
+from .sequences import encode_sequences, pack_sequences, get_mismatch_keys
+
+CONTEXTS = ('invitro', 'ecoli', 'mammal')
+PARAMETER_SETS = ('sequence_params',) + AVERAGE_PARAMETER_SETS
+SCORE_FUNCS = {
+    'p_clv': get_all_cleavage_probs,
+    'k_clv': get_all_cleavage_rates,
+    'u_eff': get_all_effective_stabs,
+    'kd': get_all_binding_const,
+}
+
+
+def score_chunk(protospacer, off_targets, context, parameter_set,
+                metrics=tuple(SCORE_FUNCS)):
+    """Score a chunk of off-targets, returning a dict with the values of
+    each metric (excluding the on-target).
+
+    SearcherTargetComplexes are only formed (once, shared between them)
+    for the cleavage rate and the dissociation constant; the cleavage
+    probability and effective stability are evaluated on landscapes that
+    are built in batch, or looked up in the PatternTable.
+    """
+    protein_sequence_complexes = None
+    if {'k_clv', 'kd'} & set(metrics):
+        protein_sequence_complexes = make_stc_list(
+            protospacer=protospacer,
+            off_targets=off_targets,
+            context=context,
+            parameter_set=parameter_set,
+        )
+    return {metric: SCORE_FUNCS[metric](
+        protospacer=protospacer,
+        off_targets=off_targets,
+        context=context,
+        parameter_set=parameter_set,
+        protein_sequence_complexes=(protein_sequence_complexes
+                                    if metric in ('k_clv', 'kd') else None),
+    )[1:] for metric in metrics}
+
+
+def score_matrix(protospacers, targets, context, parameter_set):
+    """Score several guides on the same targets in one batch.
+
+    The landscapes of all (guide, target) combinations are built (see
+    landscapes.py) and stacked into one (guides, targets, 21) array, and
+    evaluated at once; for
+    sequence-average models, the mismatch patterns of all combinations
+    are looked up in the shared PatternTable. Returns a dict with the
+    (guides, targets) array of each metric (see engine.score_landscapes).
+    """
+    if parameter_set in AVERAGE_PARAMETER_SETS:
+        packed_guides = pack_sequences(encode_sequences(list(protospacers)))
+        packed_targets = pack_sequences(encode_sequences(list(targets)))
+        keys = get_mismatch_keys(packed_guides[:, np.newaxis], packed_targets)
+        values = get_pattern_table(parameter_set, context).lookup(keys)
+    else:
+        target_codes = encode_sequences(list(targets))
+        landscapes = np.stack([get_sequence_landscapes(
+            load_protein(parameter_set, context, protospacer),
+            protospacer,
+            target_codes,
+        ) for protospacer in protospacers])
+        k_on, _ = get_k_on_off(context)
+        values = score_landscapes(
+            landscapes,
+            load_protein(parameter_set, context).internal_rates,
+            k_on
+        )
+    return {metric: values[metric] for metric in SCORE_FUNCS}
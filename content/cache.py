@@ -0,0 +1,202 @@
+"""Persistent cache with the metrics of scored guide/target pairs.
+
+Results are stored in an SQLite database, keyed by protospacer, target,
+context, parameter set and a version key. The version key combines the
+crisprzip version, a hash of the parameter set file and CACHE_VERSION, so
+that updated landscapes (or calculations) never return stale results.
+Least recently used entries are evicted when the cache exceeds its size;
+the number of entries is tracked in a separate table. Lookups only read
+the database: their timestamps are collected in memory and written with
+the next store (or once enough have been collected).
+"""
+
+import hashlib
+import importlib.resources
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from importlib.metadata import version
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+CACHE_VERSION = 1  # increase when the calculation of any metric changes
+METRICS = ('p_clv', 'u_eff', 'k_clv', 'kd')
+
+
+@lru_cache(maxsize=None)
+def get_version_key(parameter_set):
+    """Version key of the results of a parameter set."""
+    params_file = (importlib.resources.files('crisprzip.landscape_params')
+                   .joinpath(f'{parameter_set}.json'))
+    params_hash = hashlib.sha1(params_file.read_bytes()).hexdigest()[:12]
+    return f"{version('crisprzip')}-{params_hash}-{CACHE_VERSION}"
+
+
+class ResultCache:
+    """Metrics of guide/target pairs, stored in an SQLite database.
+
+    Parameters
+    ----------
+    path : `str` or `Path`
+        Location of the database file, which is created if necessary.
+    max_entries : `int`, optional
+        Number of guide/target pairs above which the least recently used
+        entries are evicted.
+    max_pending : `int`, optional
+        Number of looked-up entries whose timestamps are kept in memory
+        before they are written to the database.
+    """
+
+    def __init__(self, path, max_entries=1_000_000, max_pending=10_000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+        self._lock = Lock()
+        self._connection = None
+        self._pid = None
+        self._last_used = {}  # timestamps of looked-up entries, by key
+
+    def _connect(self):
+        # connections cannot be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30.,
+                                               check_same_thread=False)
+            self._pid = os.getpid()
+            self._last_used = {}  # flushed by the parent process
+            with self._connection:
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS results ('
+                    'protospacer TEXT, target TEXT, context TEXT, '
+                    'parameter_set TEXT, version TEXT, '
+                    + ''.join(f'{m} REAL, ' for m in METRICS) +
+                    'last_used REAL, '
+                    'UNIQUE (protospacer, target, context, parameter_set, '
+                    'version))'
+                )
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS results_last_used '
+                    'ON results (last_used)'
+                )
+                # number of entries, kept up to date by triggers so that
+                # stores do not have to count the table
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS entries (count INTEGER)'
+                )
+                self._connection.execute(
+                    'INSERT INTO entries SELECT COUNT(*) FROM results '
+                    'WHERE NOT EXISTS (SELECT 1 FROM entries)'
+                )
+                self._connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS results_insert '
+                    'AFTER INSERT ON results '
+                    'BEGIN UPDATE entries SET count = count + 1; END'
+                )
+                self._connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS results_delete '
+                    'AFTER DELETE ON results '
+                    'BEGIN UPDATE entries SET count = count - 1; END'
+                )
+        return self._connection
+
+    def _flush_last_used(self, connection):
+        # update the timestamps of the entries that have been looked up
+        if self._last_used:
+            connection.executemany(
+                'UPDATE results SET last_used = ? '
+                'WHERE protospacer = ? AND target = ? AND context = ? '
+                'AND parameter_set = ? AND version = ?',
+                [(last_used,) + key
+                 for key, last_used in self._last_used.items()]
+            )
+            self._last_used = {}
+
+    def lookup(self, metric, protospacer, targets, context, parameter_set):
+        """Get the cached values of metric for all targets, as an array
+        that is NaN for targets that are not in the cache."""
+        if metric not in METRICS:
+            raise ValueError(f"Unrecognized metric '{metric}'.")
+        key = (protospacer, context, parameter_set,
+               get_version_key(parameter_set))
+        unique_targets = list(dict.fromkeys(targets))
+
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                f'SELECT target, {metric} FROM results '
+                f'WHERE protospacer = ? AND context = ? '
+                f'AND parameter_set = ? AND version = ? '
+                f'AND {metric} IS NOT NULL '
+                f'AND target IN ({",".join("?" * len(unique_targets))})',
+                key + tuple(unique_targets)
+            ).fetchall()
+            last_used = time.time()
+            for target, _ in rows:
+                self._last_used[(protospacer, target) + key[1:]] = last_used
+            if len(self._last_used) >= self.max_pending:
+                with connection:
+                    self._flush_last_used(connection)
+
+        cached = dict(rows)
+        return np.array([cached.get(target, np.nan) for target in targets],
+                        dtype=float)
+
+    def store(self, metric, protospacer, targets, values, context,
+              parameter_set):
+        """Add the values of metric for the targets to the cache."""
+        if metric not in METRICS:
+            raise ValueError(f"Unrecognized metric '{metric}'.")
+        version_key = get_version_key(parameter_set)
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._flush_last_used(connection)
+                connection.executemany(
+                    f'INSERT INTO results (protospacer, target, context, '
+                    f'parameter_set, version, {metric}, last_used) '
+                    f'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    f'ON CONFLICT (protospacer, target, context, '
+                    f'parameter_set, version) '
+                    f'DO UPDATE SET {metric} = excluded.{metric}, '
+                    f'last_used = excluded.last_used',
+                    [(protospacer, target, context, parameter_set,
+                      version_key, float(value), time.time())
+                     for target, value in zip(targets, values)]
+                )
+                excess = (connection.execute('SELECT count FROM entries')
+                          .fetchone()[0] - self.max_entries)
+                if excess > 0:
+                    connection.execute(
+                        'DELETE FROM results WHERE rowid IN (SELECT rowid '
+                        'FROM results ORDER BY last_used LIMIT ?)',
+                        (excess,)
+                    )
+
+
+def score_with_cache(cache, metric, score_func, protospacer, off_targets,
+                     context, parameter_set):
+    """Look up the values of metric for [protospacer] + off_targets in
+    the cache, and score only the missing targets with score_func."""
+    targets = [protospacer] + off_targets
+    values = cache.lookup(metric, protospacer, targets, context,
+                          parameter_set)
+    missing = np.isnan(values)
+    if np.any(missing):
+        missing_off_targets = [seq for seq, m in zip(off_targets, missing[1:])
+                               if m]
+        new_values = np.asarray(score_func(
+            protospacer=protospacer,
+            off_targets=missing_off_targets,
+            context=context,
+            parameter_set=parameter_set,
+        ), dtype=float)
+        values[0] = new_values[0]
+        values[1:][missing[1:]] = new_values[1:]
+        cache.store(metric, protospacer, [protospacer] + missing_off_targets,
+                    new_values, context, parameter_set)
+    return values
@@ -0,0 +1,284 @@
+"""Guide comparison: score several guides on the same targets.
+
+All guides are scored on the union of their own targets and the
+off-targets as one (guides, targets) job, and the result is shown as a
+sortable matrix and a heatmap.
+"""
+
+import numpy as np
+import pandas as pd
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from nicegui import ui
+
+from .input import run_scoring, parse_off_targets
+from .sequences import decode_sequences
+from .batch import score_matrix
+
+METRIC_LABELS = {
+    'p_clv': 'cleavage probability',
+    'k_clv': 'cleavage rate (1/s)',
+    'u_eff': 'effective stability (kT)',
+    'kd': 'dissociation constant (nM)',
+}
+LOG_METRICS = ('p_clv', 'k_clv', 'kd')
+
+
+def get_targets(protospacers, off_targets):
+    """The union of the guides' own targets and the off-targets, in order
+    of appearance."""
+    return list(dict.fromkeys(list(protospacers) + list(off_targets)))
+
+
+def show_compare_input():
+
+    def sequence_validation(in_str):
+        errors = parse_off_targets(in_str).errors
+        if errors:
+            i, _, err_msg = errors[0]
+            return f"{err_msg} (sequence #{i + 1})"
+
+    wc1 = 250  # column width
+    fsz = 10   # font size (in pt)
+    fsi = 12   # font size for information bubble (in pt)
+    fsb = 10   # font size for text in the information bubble (in pt)
+
+    with ui.column().classes(f'w-[{wc1}px] p-0 gap-1'):
+
+        # GUIDES
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Protospacers**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'Target sequences (5\'-to-3\', 20 nts + PAM) of the guides '
+                    'to compare, separated by commas or newlines.'
+                ).style(f'font-size: {fsb}pt')
+        guides_input = ui.textarea(
+            placeholder='GACGCATAAAGATGAGACGCTGG,\nTTGCACTGGAGGCTATTGAGAGG',
+            validation=sequence_validation,
+        ).props('rows=5 dense').classes('w-full font-mono').style(
+            f'font-size: {fsz}pt')
+
+        # OFF-TARGETS
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Off-target sequences**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'Off-targets (5\'-to-3\', 20 nts + PAM) that all guides are '
+                    'scored against, next to the targets of the guides '
+                    'themselves.'
+                ).style(f'font-size: {fsb}pt')
+        off_targets_input = ui.textarea(
+            placeholder='GACGCATAAAGATGAGACGCAGG,\n...',
+            validation=sequence_validation,
+        ).props('rows=5 dense').classes('w-full font-mono').style(
+            f'font-size: {fsz}pt')
+        ui.element().classes("h-3")
+
+        # CONTEXT AND PARAMETERS
+        ui.markdown('**Context**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        context_dropdown = ui.select(
+            options={'invitro': 'cell-free (in vitro)',
+                     'ecoli': 'E. coli',
+                     'mammal': 'mammal', },
+            value='invitro',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.markdown('**Landscape parameters**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        model_dropdown = ui.select(
+            options={
+                'sequence_params': 'sequence (default)',
+                'average_params': 'average',
+                'average_params_legacy': 'average (legacy)'
+            },
+            value='sequence_params',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.element().classes("h-6")
+
+        submit_button = (
+            ui.button('Submit')
+            .props('icon=send')
+            .classes('w-full')
+            .style(f'font-size: {fsz}pt')
+        )
+
+    def get_input_values():
+        err_msg = sequence_validation(guides_input.value)
+        if err_msg:
+            ui.notify(f"Protospacer error: {err_msg}", type='negative')
+            return
+        protospacers = list(dict.fromkeys(decode_sequences(
+            parse_off_targets(guides_input.value).codes)))
+        if not protospacers:
+            ui.notify("Protospacer error: No sequences", type='negative')
+            return
+
+        err_msg = sequence_validation(off_targets_input.value)
+        if err_msg:
+            ui.notify(f"Off-target sequence error: {err_msg}", type='negative')
+            return
+
+        return {
+            'protospacers': protospacers,
+            'off_targets': decode_sequences(
+                parse_off_targets(off_targets_input.value).codes),
+            'context': context_dropdown.value,
+            'parameter_set': model_dropdown.value,
+        }
+
+    return submit_button, get_input_values
+
+
+async def show_output(output_container, get_input_values: callable):
+
+    input_values = get_input_values()
+    if input_values is None:
+        return
+    protospacers, off_targets, context, parameter_set = input_values.values()
+    targets = get_targets(protospacers, off_targets)
+
+    output_container.clear()
+    with output_container:
+        with ui.row(align_items='center') as progress_row:
+            ui.spinner(size='lg')
+            ui.label(f"Scoring {len(protospacers)} guides on "
+                     f"{len(targets)} targets...")
+
+    # SCORING (one job for all guides)
+    try:
+        values = await run_scoring(
+            score_matrix,
+            protospacers=protospacers,
+            targets=targets,
+            context=context,
+            parameter_set=parameter_set,
+        )
+    except Exception as e:
+        ui.notify(f'Error scoring guides: {str(e)}', type='negative')
+        return
+    finally:
+        replaced = progress_row.is_deleted
+        if not replaced:
+            progress_row.delete()
+    if values is None or replaced:
+        return  # app is shutting down, or output was replaced
+
+    # VISUALIZATION
+    mpl.style.use('seaborn-v0_8')
+    guide_names = [f"guide {i + 1}" for i in range(len(protospacers))]
+    target_names = [guide_names[protospacers.index(seq)]
+                    if seq in protospacers else 'off-target'
+                    for seq in targets]
+
+    with output_container:
+        metric_toggle = ui.toggle(METRIC_LABELS,
+                                  value='p_clv').props('no-caps dense')
+
+        # Heatmap
+        dpi = plt.rcParams['figure.dpi']  # pixel in inches
+        cell = 20  # pixels per matrix cell
+        plotwidth = max(500, min(cell * len(targets) + 150, 20000))
+        plotheight = cell * len(protospacers) + 120
+        with ui.scroll_area().classes(f'w-[1000px] h-[{plotheight + 20}px]'):
+            heatmap = ui.matplotlib(
+                figsize=(plotwidth / dpi, plotheight / dpi)
+            ).classes(f'w-[{plotwidth}px] h-[{plotheight}px]')
+
+        # Matrix
+        ui.add_head_html('''
+        <style>
+            .ag-cell.monospace-column {
+                font-family: monospace !important;
+                font-size: 13px;
+            }
+        </style>
+        ''')
+        column_defs = [
+            {'headerName': '#', 'field': 'index', 'width': 50},
+            {'headerName': 'target', 'field': 'target', 'width': 90},
+            {'headerName': 'sequence', 'field': 'sequence', 'width': 220,
+             'cellClass': 'monospace-column'},
+        ] + [
+            {'headerName': name, 'field': f'g{i}', 'width': 100,
+             'headerTooltip': protospacers[i]}
+            for i, name in enumerate(guide_names)
+        ]
+        grid = ui.aggrid({
+            'columnDefs': [dict(cd, suppressMovable=True, sortable=True,
+                                resizable=False) for cd in column_defs],
+            'rowData': [],
+        }).classes('w-[1000px] h-[400px]')
+
+        with ui.row(align_items='center'):
+            ui.label("Rows are targets, columns are guides; click a column "
+                     "header to sort.")
+            download_button = ui.button().props('icon=download no-caps outline').classes('w-[1em] h-[1em]')
+
+    def show_metric(metric):
+        matrix = values[metric]
+        value_format = ('params => params.value.toExponential(2)'
+                        if metric in LOG_METRICS else
+                        'params => params.value.toFixed(2)')
+        for column_def in grid.options['columnDefs'][3:]:
+            column_def[':valueFormatter'] = value_format
+        grid.options['rowData'] = [
+            {'index': j, 'target': target_names[j], 'sequence': targets[j],
+             **{f'g{i}': float(matrix[i, j])
+                for i in range(len(protospacers))}}
+            for j in range(len(targets))
+        ]
+        grid.update()
+
+        with heatmap.figure as fig:
+            fig.clear()
+            ax = fig.gca()
+            if metric in LOG_METRICS:
+                image = ax.imshow(np.log10(matrix), aspect='auto',
+                                  cmap='viridis')
+                label = f"log10 {metric}"
+            else:
+                image = ax.imshow(matrix, aspect='auto', cmap='viridis')
+                label = metric
+            ax.grid(False)
+            ax.set_yticks(range(len(protospacers)), guide_names)
+            ax.set_xticks(range(len(targets)),
+                          [f"{j}" if name == 'off-target' else name
+                           for j, name in enumerate(target_names)],
+                          rotation=90, fontsize='small')
+            ax.set_xlabel('target')
+            fig.colorbar(image, ax=ax, label=label, pad=.01,
+                         fraction=min(.05, 150 / plotwidth))
+            fig.subplots_adjust(left=70 / plotwidth, right=.98,
+                                bottom=80 / plotheight, top=.97)
+
+    metric_toggle.on_value_change(lambda e: show_metric(e.value))
+    show_metric(metric_toggle.value)
+
+    def download_grid():
+        df = pd.DataFrame({
+            'target': target_names,
+            'sequence': targets,
+            **{f"{metric} ({name})": values[metric][i]
+               for metric in METRIC_LABELS
+               for i, name in enumerate(guide_names)}
+        })
+        ui.download.content(df.to_csv(index=True), 'crisprzip_matrix.csv')
+
+    download_button.on_click(download_grid)
+
+
+def show_contents():
+    with ui.row().classes('w-full h-full no-wrap'):
+
+        # INPUT
+        with ui.card().classes('p-4 m-2'):
+            submit_button, get_input_values = show_compare_input()
+
+        # OUTPUT
+        output_container = ui.column().classes('w-full h-full no-wrap m-2')
+        submit_button.on_click(
+            lambda: show_output(output_container, get_input_values)
+        )
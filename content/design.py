@@ -0,0 +1,392 @@
+"""Guide design: score every NGG protospacer in a target region.
+
+Each candidate guide is scored on its own target (on-target efficiency)
+and on a shared off-target set and/or its off-target sites in an indexed
+genome (aggregate off-target risk). The genome index is loaded (or
+built) once, and candidates are scored in batches, as separate jobs in
+the process pool, and ranked by their specificity.
+"""
+
+import asyncio
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from nicegui import ui, run
+
+from .input import (run_scoring, search_pam_index, parse_off_targets,
+                    load_protein, get_pattern_table, workers,
+                    AVERAGE_PARAMETER_SETS)
+from .sequences import decode_sequences, unpack_sequences
+from .genome import (find_pam_sites, load_pam_index, get_index_dir,
+                     TARGET_LENGTH)
+from .patterns import get_pattern_keys
+from .landscapes import get_sequence_landscapes
+from .engine import get_cleavage_probs, get_cleavage_rates
+
+guides_per_job = 16  # candidate guides that are scored as one batch
+
+
+def find_protospacers(region):
+    """Find all NGG protospacers on both strands of a region, as a data
+    frame with their start (0-based, on the forward strand), strand and
+    sequence."""
+    starts, strands, targets = find_pam_sites(region.upper().encode())
+    guides = pd.DataFrame({
+        'start': starts,
+        'strand': np.where(strands == 1, '+', '-'),
+        'protospacer': decode_sequences(unpack_sequences(targets,
+                                                         TARGET_LENGTH)),
+    })
+    return guides.sort_values(['start', 'strand'], ignore_index=True)
+
+
+def score_guides(protospacers, off_targets, context, parameter_set,
+                 index_dir=None, max_mismatches=3):
+    """Score candidate guides on their targets and off-targets.
+
+    The off-targets of each guide are the shared off_targets and, if
+    index_dir (the directory of a PamIndex, see genome.load_pam_index)
+    is given, all its sites with up to max_mismatches mismatches, except
+    for one perfect match: the target itself. The targets of all guides
+    are scored as one batch of landscapes (or mismatch patterns, for
+    sequence-average models).
+    Returns a list with a dict per guide with the on-target cleavage
+    probability and rate, the number of off-targets, the maximum and sum
+    of their cleavage probabilities, and the specificity
+    p_on / (p_on + sum(p_off)).
+    """
+    target_lists = []
+    for protospacer in protospacers:
+        targets = [protospacer] + list(off_targets)
+        if index_dir is not None:
+            hits = search_pam_index(index_dir, protospacer, max_mismatches)
+            sites = hits['sequence'].tolist()
+            perfect = np.flatnonzero(hits['mismatches'] == 0)
+            if perfect.size > 0:
+                del sites[perfect[0]]
+            targets += sites
+        target_lists.append(targets)
+    # rows of the on-targets in the batch
+    on_rows = np.cumsum([0] + [len(targets) for targets in target_lists])
+
+    if parameter_set in AVERAGE_PARAMETER_SETS:
+        keys = np.concatenate([get_pattern_keys(protospacer, targets)
+                               for protospacer, targets
+                               in zip(protospacers, target_lists)])
+        values = get_pattern_table(parameter_set, context).lookup(keys)
+        p_clv, k_clv = values['p_clv'], values['k_clv'][on_rows[:-1]]
+    else:
+        landscapes = np.concatenate([get_sequence_landscapes(
+            load_protein(parameter_set, context, protospacer),
+            protospacer,
+            targets,
+        ) for protospacer, targets in zip(protospacers, target_lists)])
+        internal_rates = load_protein(parameter_set, context).internal_rates
+        p_clv = get_cleavage_probs(landscapes, internal_rates)
+        k_clv = get_cleavage_rates(landscapes[on_rows[:-1]], internal_rates,
+                                   1.)
+
+    results = []
+    for i in range(len(protospacers)):
+        p_on = p_clv[on_rows[i]]
+        p_off = p_clv[on_rows[i] + 1:on_rows[i + 1]]
+        results.append({
+            'p_clv': float(p_on),
+            'k_clv': float(k_clv[i]),
+            'off_targets': len(p_off),
+            'p_clv_max_off': float(p_off.max(initial=0.)),
+            'p_clv_sum_off': float(p_off.sum()),
+            'specificity': float(p_on / (p_on + p_off.sum())),
+        })
+    return results
+
+
+def show_design_input():
+
+    def region_validation(in_str):
+        if in_str and not re.fullmatch(r'[ACGTNacgtn\s]*', get_region(in_str)):
+            return "Only ACGTN nucleotides"
+
+    def get_region(in_str):
+        # sequence or FASTA-formatted text
+        return ''.join(line.strip() for line in (in_str or '').splitlines()
+                       if not line.startswith('>'))
+
+    def offtarget_validation(in_str):
+        errors = parse_off_targets(in_str).errors
+        if errors:
+            i, _, err_msg = errors[0]
+            return f"{err_msg} (target #{i + 1})"
+
+    wc1 = 250  # column width
+    fsz = 10   # font size (in pt)
+    fsi = 12   # font size for information bubble (in pt)
+    fsb = 10   # font size for text in the information bubble (in pt)
+
+    with ui.column().classes(f'w-[{wc1}px] p-0 gap-1'):
+
+        # TARGET REGION
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Target region**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'DNA sequence (5\'-to-3\', optionally FASTA-formatted) in '
+                    'which all protospacers with an NGG PAM, on both strands, '
+                    'are scored as candidate guides.'
+                ).style(f'font-size: {fsb}pt')
+        region_input = ui.textarea(
+            placeholder='GACGCATAAAGATGAGACGCTGGAACT...',
+            validation=region_validation,
+        ).props('rows=5 dense').classes('w-full font-mono').style(
+            f'font-size: {fsz}pt')
+
+        # OFF-TARGETS
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Off-target sequences**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'Off-targets (5\'-to-3\', 20 nts + PAM) that every candidate '
+                    'guide is scored against. Optional.'
+                ).style(f'font-size: {fsb}pt')
+        off_targets_input = ui.textarea(
+            placeholder='GACGCATAAAGATGAGACGCTGG,\n...',
+            validation=offtarget_validation,
+        ).props('rows=3 dense').classes('w-full font-mono').style(
+            f'font-size: {fsz}pt')
+
+        # GENOME
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Genome**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'Local FASTA-file in which the off-target sites of each '
+                    'candidate guide are searched, apart from its perfect match. '
+                    'Optional.'
+                ).style(f'font-size: {fsb}pt')
+        genome_path_input = ui.input(
+            placeholder='/path/to/genome.fa',
+            validation=lambda x: (None if not x or Path(x).expanduser().is_file()
+                                  else "File not found"),
+        ).props('dense').classes('w-full font-mono').style(f'font-size: {fsz}pt')
+        max_mismatches_select = (
+            ui.select({k: f'up to {k} mismatches' for k in range(6)}, value=3)
+            .props('dense').classes('w-full').style(f'font-size: {fsz}pt')
+        )
+        ui.element().classes("h-3")
+
+        # CONTEXT AND PARAMETERS
+        ui.markdown('**Context**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        context_dropdown = ui.select(
+            options={'invitro': 'cell-free (in vitro)',
+                     'ecoli': 'E. coli',
+                     'mammal': 'mammal', },
+            value='invitro',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.markdown('**Landscape parameters**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        model_dropdown = ui.select(
+            options={
+                'sequence_params': 'sequence (default)',
+                'average_params': 'average',
+                'average_params_legacy': 'average (legacy)'
+            },
+            value='sequence_params',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.element().classes("h-6")
+
+        submit_button = (
+            ui.button('Submit')
+            .props('icon=send')
+            .classes('w-full')
+            .style(f'font-size: {fsz}pt')
+        )
+
+    def get_input_values():
+
+        err_msg = region_validation(region_input.value)
+        if err_msg:
+            ui.notify(f"Target region error: {err_msg}", type='negative')
+            return
+        region = get_region(region_input.value)
+        if not region:
+            ui.notify("Target region error: No sequence", type='negative')
+            return
+
+        err_msg = offtarget_validation(off_targets_input.value)
+        if err_msg:
+            ui.notify(f"Off-target sequence error: {err_msg}", type='negative')
+            return
+
+        genome = None
+        if genome_path_input.value:
+            genome = Path(genome_path_input.value).expanduser()
+            if not genome.is_file():
+                ui.notify("Genome error: FASTA-file not found", type='negative')
+                return
+            genome = str(genome)
+
+        return {
+            'region': region,
+            'off_targets': decode_sequences(
+                parse_off_targets(off_targets_input.value).codes),
+            'genome': genome,
+            'max_mismatches': max_mismatches_select.value,
+            'context': context_dropdown.value,
+            'parameter_set': model_dropdown.value,
+        }
+
+    return submit_button, get_input_values
+
+
+async def show_output(output_container, get_input_values: callable):
+
+    input_values = get_input_values()
+    if input_values is None:
+        return
+    (region, off_targets, genome, max_mismatches, context,
+     parameter_set) = input_values.values()
+
+    guides = find_protospacers(region)
+    if guides.empty:
+        ui.notify("No protospacers with an NGG PAM in the target region.",
+                  type='warning')
+        return
+
+    output_container.clear()
+    with output_container:
+        with ui.row(align_items='center').classes('w-full') as progress_row:
+            progress_bar = ui.linear_progress(value=0, show_value=False).classes('w-[380px]')
+            progress_label = ui.label(f"0/{len(guides)}")
+            cancel_button = ui.button('cancel').props('outline no-caps')
+
+        ui.add_head_html('''
+        <style>
+            .ag-cell.monospace-column {
+                font-family: monospace !important;
+                font-size: 13px;
+            }
+        </style>
+        ''')
+        sci_format = 'params => params.value.toExponential(2)'
+        column_defs = [
+            {'headerName': '#', 'field': 'rank', 'width': 50},
+            {'headerName': 'start', 'field': 'start', 'width': 70},
+            {'headerName': 'strand', 'field': 'strand', 'width': 60},
+            {'headerName': 'protospacer', 'field': 'protospacer',
+             'width': 220, 'cellClass': 'monospace-column'},
+            {'headerName': 'p_clv', 'field': 'p_clv', 'width': 90,
+             ':valueFormatter': sci_format},
+            {'headerName': 'k_clv (1/s)', 'field': 'k_clv', 'width': 90,
+             ':valueFormatter': sci_format},
+            {'headerName': 'off-targets', 'field': 'off_targets', 'width': 90},
+            {'headerName': 'max p_clv (off)', 'field': 'p_clv_max_off',
+             'width': 110, ':valueFormatter': sci_format},
+            {'headerName': 'sum p_clv (off)', 'field': 'p_clv_sum_off',
+             'width': 110, ':valueFormatter': sci_format},
+            {'headerName': 'specificity', 'field': 'specificity',
+             'width': 90, ':valueFormatter': 'params => params.value.toFixed(3)'},
+        ]
+        grid = ui.aggrid({
+            'columnDefs': [dict(cd, suppressMovable=True, sortable=True,
+                                resizable=False) for cd in column_defs],
+            'rowData': [],  # filled while scoring
+        }).classes('w-[1000px] h-[500px]')
+
+        with ui.row(align_items='center'):
+            ui.label("Candidate guides are ranked by their specificity, "
+                     "p_clv / (p_clv + sum p_clv (off)).")
+            download_button = ui.button().props('icon=download no-caps outline').classes('w-[1em] h-[1em]')
+
+    # SCORING
+    cancelled = False
+
+    def cancel_scoring():
+        nonlocal cancelled
+        cancelled = True
+
+    cancel_button.on_click(cancel_scoring)
+
+    index_dir = None
+    if genome is not None:
+        # load (or build) the index here, rather than in every worker
+        try:
+            await run.io_bound(load_pam_index, genome)
+        except Exception as e:
+            ui.notify(f'Error indexing genome: {str(e)}', type='negative')
+            progress_row.delete()
+            return
+        index_dir = str(get_index_dir(genome))
+
+    # at most one batch per worker in flight, so that the batches of a
+    # large region do not hold up the scoring of other clients
+    jobs = asyncio.Semaphore(max(workers, 1))
+
+    async def score(start):
+        protospacers = guides['protospacer'][start:start + guides_per_job]
+        async with jobs:
+            return start, await run_scoring(
+                score_guides,
+                protospacers=protospacers.tolist(),
+                off_targets=off_targets,
+                context=context,
+                parameter_set=parameter_set,
+                index_dir=index_dir,
+                max_mismatches=max_mismatches,
+            )
+
+    rows = []
+    tasks = [asyncio.ensure_future(score(start))
+             for start in range(0, len(guides), guides_per_job)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            start, results = await next_result
+            if results is None or progress_row.is_deleted:
+                return  # app is shutting down, or output was replaced
+            rows += [{'start': int(guides['start'][i]),
+                      'strand': guides['strand'][i],
+                      'protospacer': guides['protospacer'][i],
+                      **result}
+                     for i, result in enumerate(results, start)]
+            rows.sort(key=lambda row: (-row['specificity'], -row['p_clv']))
+            grid.options['rowData'] = [dict(row, rank=rank + 1)
+                                       for rank, row in enumerate(rows)]
+            grid.update()
+            progress_bar.set_value(len(rows) / len(guides))
+            progress_label.set_text(f"{len(rows)}/{len(guides)}")
+            if cancelled:
+                ui.notify(f"Scoring cancelled after {len(rows)} of "
+                          f"{len(guides)} guides.", type='warning')
+                break
+    except Exception as e:
+        ui.notify(f'Error scoring guides: {str(e)}', type='negative')
+    finally:
+        for task in tasks:
+            task.cancel()
+        if not progress_row.is_deleted:
+            progress_row.delete()
+
+    def download_grid():
+        df = pd.DataFrame(grid.options['rowData']).set_index('rank')
+        ui.download.content(df.to_csv(), 'crisprzip_guides.csv')
+
+    download_button.on_click(download_grid)
+
+
+def show_contents():
+    with ui.row().classes('w-full h-full no-wrap'):
+
+        # INPUT
+        with ui.card().classes('p-4 m-2'):
+            submit_button, get_input_values = show_design_input()
+
+        # OUTPUT
+        output_container = ui.column().classes('w-full h-full no-wrap m-2')
+        submit_button.on_click(
+            lambda: show_output(output_container, get_input_values)
+        )
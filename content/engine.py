@@ -0,0 +1,332 @@
+"""Vectorized evaluation of CRISPRzip metrics on batches of targets.
+
+The functions in this module work on stacked hybridization landscapes,
+arrays of shape (..., 21) that contain the free energy of the PAM state
+(always 0) followed by the 20 R-loop states of every target. This
+avoids the per-complex overhead of the SearcherTargetComplex methods
+when scoring large off-target panels.
+"""
+
+import numpy as np
+
+from .kernels import cleavage_probs, effective_stabs
+
+
+def get_landscape_matrix(protein_sequence_complexes):
+    """Stack the off-target landscapes of SearcherTargetComplexes,
+    preceded by the PAM state, into an (N, 21) array."""
+    off_target_landscapes = np.array([stc.off_target_landscape for stc
+                                      in protein_sequence_complexes])
+    return np.pad(off_target_landscapes, ((0, 0), (1, 0)))
+
+
+def get_rate_arrays(landscapes, internal_rates, binding_rate=0.,
+                    dead=False):
+    """Forward and backward rate arrays for a stack of landscapes.
+
+    Follows the conventions of SearcherTargetComplex: both arrays have
+    shape (..., 23), covering the solution state, the PAM state, 20
+    R-loop states and the cleaved state. The leading dimensions of
+    ``landscapes``, ``binding_rate`` and the internal rates (which can be
+    arrays too, e.g. for parameter ensembles) are broadcast against each
+    other.
+    """
+    landscapes = np.asarray(landscapes, dtype=float)
+    k_f = np.asarray(internal_rates['k_f'])
+    shape = np.broadcast_shapes(landscapes.shape[:-1], np.shape(binding_rate),
+                                *(np.shape(internal_rates[k]) for k in
+                                  ('k_off', 'k_f', 'k_clv')))
+    landscapes = np.broadcast_to(landscapes, shape + landscapes.shape[-1:])
+
+    forward_rates = np.empty(shape + (23,))
+    forward_rates[..., 0] = binding_rate
+    forward_rates[..., 1:-2] = k_f[..., np.newaxis]
+    forward_rates[..., -2] = 0. if dead else internal_rates['k_clv']
+    forward_rates[..., -1] = 0.
+
+    backward_rates = np.empty(shape + (23,))
+    backward_rates[..., 0] = 0.
+    backward_rates[..., 1] = internal_rates['k_off']
+    backward_rates[..., 2:-1] = (k_f[..., np.newaxis] *
+                                 np.exp(np.diff(landscapes, axis=-1)))
+    backward_rates[..., -1] = 0.
+    return forward_rates, backward_rates
+
+
+def get_cleavage_probs(landscapes, internal_rates):
+    """Calculate the probability that each target is cleaved
+    after it has been PAM-associated (evaluated by a fused kernel, see
+    kernels.py)."""
+    return cleavage_probs(landscapes, internal_rates['k_off'],
+                          internal_rates['k_f'], internal_rates['k_clv'])
+
+
+def get_passage_time_coeffs(landscapes, internal_rates):
+    """Coefficients of the mean first-passage time to cleavage.
+
+    The R-loop model is a linear chain from the solution state to the
+    (absorbing) cleaved state, so the mean first-passage time has a
+    closed form in terms of the stationary weights of the transient
+    states. The binding rate k only enters through the weights of the
+    bound states, which are all proportional to it, so that the passage
+    time equals A / k + B. Returns log(A) and log(B), of shape (...,).
+    Sums are evaluated in log-space to handle deep landscapes.
+    """
+    forward_rates, backward_rates = get_rate_arrays(landscapes,
+                                                    internal_rates)
+    log_forward = np.log(forward_rates[..., 1:-1])
+    log_backward = np.log(backward_rates[..., 1:-1])
+
+    # stationary weights of the bound states, relative to solution and
+    # divided by the binding rate
+    log_weights = (np.cumsum(log_forward, axis=-1) - log_forward -
+                   np.cumsum(log_backward, axis=-1))
+
+    log_exit_times = -log_forward - log_weights
+    log_a = np.logaddexp(0., np.logaddexp.reduce(log_exit_times, axis=-1))
+    log_b = np.logaddexp.reduce(
+        np.logaddexp.accumulate(log_weights, axis=-1) + log_exit_times,
+        axis=-1
+    )
+    return log_a, log_b
+
+
+def get_cleavage_rates(landscapes, internal_rates, binding_rate):
+    """Calculate the effective cleavage rate of each target, the
+    inverse of the mean first-passage time to cleavage.
+
+    The leading dimensions of ``landscapes`` and ``binding_rate`` are
+    broadcast against each other.
+    """
+    log_a, log_b = get_passage_time_coeffs(landscapes, internal_rates)
+    with np.errstate(divide='ignore'):  # zero binding rate: no cleavage
+        log_binding_rate = np.log(binding_rate)
+    return np.exp(-np.logaddexp(log_a - log_binding_rate, log_b))
+
+
+def get_cleavage_rate_sweep(landscapes, internal_rates, binding_rates):
+    """Calculate the effective cleavage rate of each target at each of
+    the ``binding_rates`` (e.g. for a range of concentrations).
+
+    Returns an array of shape landscapes.shape[:-1] + binding_rates.shape.
+    The passage-time coefficients are computed once per target and
+    shared by all binding rates.
+    """
+    binding_rates = np.asarray(binding_rates, dtype=float)
+    log_a, log_b = get_passage_time_coeffs(landscapes, internal_rates)
+    log_a = log_a.reshape(log_a.shape + (1,) * binding_rates.ndim)
+    log_b = log_b.reshape(log_b.shape + (1,) * binding_rates.ndim)
+    with np.errstate(divide='ignore'):
+        log_binding_rates = np.log(binding_rates)
+    return np.exp(-np.logaddexp(log_a - log_binding_rates, log_b))
+
+
+def _get_generator_factor(forward_rates, backward_rates):
+    """Bidiagonal factor B of the symmetrized rate matrix of the transient
+    states (all but the cleaved state), which equals -B^T B, together
+    with the log-weights that transform it back. The rate matrix is
+    similar to this symmetric form because the R-loop model obeys
+    detailed balance. Row e of B holds the square roots of the rates
+    over transition e; working with B rather than with -B^T B keeps the
+    small eigenvalues (the slow relaxation modes) to high relative
+    accuracy, even next to very fast transitions."""
+    size = forward_rates.shape[-1] - 1
+    factor = np.zeros(forward_rates.shape[:-1] + (size, size))
+    factor[..., np.arange(size), np.arange(size)] = np.sqrt(
+        forward_rates[..., :-1])
+    factor[..., np.arange(size - 1), np.arange(1, size)] = -np.sqrt(
+        backward_rates[..., 1:-1])
+
+    with np.errstate(divide='ignore'):  # zero binding rate
+        log_weights = np.zeros(forward_rates.shape[:-1] + (size,))
+        log_weights[..., 1:] = np.cumsum(
+            np.log(forward_rates[..., :-2]) - np.log(backward_rates[..., 1:-1]),
+            axis=-1
+        )
+    return factor, log_weights
+
+
+def _get_relaxation_modes(forward_rates, backward_rates):
+    """Eigenvalues (in ascending order) and orthonormal eigenvectors of
+    the symmetrized rate matrix, from the singular value decomposition
+    of its bidiagonal factor (see _get_generator_factor)."""
+    factor, log_weights = _get_generator_factor(forward_rates,
+                                                backward_rates)
+    _, singular_values, vh = np.linalg.svd(factor)
+    return -singular_values ** 2, np.swapaxes(vh, -1, -2), log_weights
+
+
+def get_occupancy_modes(landscapes, internal_rates, binding_rate,
+                        dead=False):
+    """Decompose the master equation of a stack of landscapes into its
+    relaxation modes, for a searcher that starts in solution.
+
+    Returns the eigenvalues, of shape (..., 22), and the amplitudes, of
+    shape (..., 22, 22), such that the occupancy of transient state j at
+    time t is sum_k amplitudes[..., j, k] * exp(eigenvalues[..., k] * t).
+    A single (batched) decomposition of the symmetrized generator serves
+    every time point.
+    """
+    forward_rates, backward_rates = get_rate_arrays(
+        landscapes, internal_rates,
+        binding_rate=binding_rate,
+        dead=dead
+    )
+    eigenvalues, eigenvectors, log_weights = _get_relaxation_modes(
+        forward_rates, backward_rates
+    )
+    # The generator has a stationary mode if the searcher is dead.
+    # Pinning its eigenvalue avoids spurious decay (through round-off)
+    # over long times.
+    if dead:
+        eigenvalues[..., -1] = 0.
+    amplitudes = (np.exp(log_weights / 2)[..., np.newaxis] * eigenvectors *
+                  eigenvectors[..., :1, :])
+    return eigenvalues, amplitudes
+
+
+def _evaluate_modes(eigenvalues, amplitudes, time):
+    """Evaluate sum_k amplitudes[..., k] * exp(eigenvalues[..., k] * t)
+    at every t in ``time``, giving an array of shape (...,) + time.shape."""
+    time = np.asarray(time, dtype=float)
+    decay = np.exp(eigenvalues[..., np.newaxis, :] * time.reshape(-1, 1))
+    values = np.matmul(decay, amplitudes[..., np.newaxis])[..., 0]
+    return values.reshape(values.shape[:-1] + time.shape)
+
+
+def get_bound_fractions(landscapes, internal_rates, binding_rate, time,
+                        pam_inclusion=1.):
+    """Calculate the fraction of bound targets at every time in ``time``,
+    assuming that the searcher is catalytically dead and starts in
+    solution.
+
+    The leading dimensions of ``landscapes`` and ``binding_rate`` are
+    broadcast against each other; the dimensions of ``time`` are
+    appended to the result.
+    """
+    eigenvalues, amplitudes = get_occupancy_modes(
+        landscapes, internal_rates, binding_rate, dead=True
+    )
+    solution_occ = _evaluate_modes(eigenvalues, amplitudes[..., 0, :], time)
+    pam_occ = _evaluate_modes(eigenvalues, amplitudes[..., 1, :], time)
+    return np.clip(1 - solution_occ - pam_occ * (1 - pam_inclusion), 0., 1.)
+
+
+def get_cleaved_fractions(landscapes, internal_rates, binding_rate, time):
+    """Calculate the fraction of cleaved targets at every time in
+    ``time``, for a searcher that starts in solution.
+
+    The leading dimensions of ``landscapes`` and ``binding_rate`` are
+    broadcast against each other; the dimensions of ``time`` are
+    appended to the result.
+    """
+    eigenvalues, amplitudes = get_occupancy_modes(
+        landscapes, internal_rates, binding_rate
+    )
+    transient_occ = _evaluate_modes(eigenvalues,
+                                    np.sum(amplitudes, axis=-2), time)
+    return np.clip(1 - transient_occ, 0., 1.)
+
+
+def _expand_for_sweep(landscapes, binding_rates):
+    """Insert a dimension in the stack of landscapes for every dimension
+    of ``binding_rates``, so that the two broadcast to an outer product."""
+    landscapes = np.asarray(landscapes, dtype=float)
+    binding_rates = np.asarray(binding_rates, dtype=float)
+    return landscapes.reshape(landscapes.shape[:-1] +
+                              (1,) * binding_rates.ndim +
+                              landscapes.shape[-1:]), binding_rates
+
+
+def get_bound_fraction_sweep(landscapes, internal_rates, binding_rates,
+                             time, pam_inclusion=1.):
+    """Calculate the fraction of bound targets for each target at each
+    of the ``binding_rates`` (e.g. for a range of concentrations) and
+    each time in ``time``.
+
+    Returns an array of shape landscapes.shape[:-1] + binding_rates.shape
+    + time.shape. All (target, binding rate) pairs are decomposed in a
+    single batched call, and every time point is evaluated from that
+    decomposition.
+    """
+    landscapes, binding_rates = _expand_for_sweep(landscapes, binding_rates)
+    return get_bound_fractions(landscapes, internal_rates, binding_rates,
+                               time, pam_inclusion)
+
+
+def get_cleaved_fraction_sweep(landscapes, internal_rates, binding_rates,
+                               time):
+    """Calculate the fraction of cleaved targets for each target at each
+    of the ``binding_rates`` and each time in ``time``, like
+    get_bound_fraction_sweep."""
+    landscapes, binding_rates = _expand_for_sweep(landscapes, binding_rates)
+    return get_cleaved_fractions(landscapes, internal_rates, binding_rates,
+                                 time)
+
+
+def get_binding_consts(landscapes, internal_rates, k_on, time=3600.,
+                       iterations=40):
+    """Calculate the apparent dissociation constant (in nM) of each
+    target after binding for ``time``.
+
+    Targets that equilibrate within ``time`` obey a Langmuir isotherm,
+    so their dissociation constant follows from the partition function
+    of the bound states. For the other (slowly relaxing) targets, the
+    concentration of half-saturation is found by bisection on the
+    finite-time bound fraction.
+    """
+    landscapes = np.asarray(landscapes, dtype=float)
+    shape = landscapes.shape[:-1]
+    landscapes = landscapes.reshape(-1, landscapes.shape[-1])
+
+    k_off = internal_rates['k_off']
+    kd = np.exp(np.log(k_off / k_on) -
+                np.logaddexp.reduce(-landscapes, axis=-1))
+
+    # targets whose slowest relaxation mode (at c=Kd) outlasts ``time``
+    eigenvalues, _, _ = _get_relaxation_modes(*get_rate_arrays(
+        landscapes, internal_rates,
+        binding_rate=k_on * kd,
+        dead=True
+    ))
+    relaxation_rates = -eigenvalues[..., -2]
+    slow = relaxation_rates * time < 10.
+    if np.any(slow):
+        # The bound fraction from a solution start never exceeds its
+        # equilibrium value, nor falls below that of PAM-only binding.
+        log_c_min = np.log(np.maximum(kd[slow], np.log(2) / (k_on * time)))
+        log_c_max = np.full(log_c_min.shape,
+                            np.log(max(k_off / k_on, np.log(2) / (k_on * time))))
+        for _ in range(iterations):
+            log_c = (log_c_min + log_c_max) / 2
+            saturated = get_bound_fractions(landscapes[slow], internal_rates,
+                                            k_on * np.exp(log_c), time) > .5
+            log_c_max = np.where(saturated, log_c, log_c_max)
+            log_c_min = np.where(saturated, log_c_min, log_c)
+        kd[slow] = np.exp((log_c_min + log_c_max) / 2)
+
+    return kd.reshape(shape)
+
+
+def get_effective_stabs(landscapes):
+    """Calculate the Boltzmann-weighted average free energy of the R-loop
+    states of each target (evaluated by a fused kernel, see kernels.py).
+    The weights are normalized to the lowest state before they are
+    exponentiated, so that deep landscapes do not overflow."""
+    return effective_stabs(landscapes)
+
+
+def score_landscapes(landscapes, internal_rates, k_on, binding_rate=1.):
+    """Evaluate all metrics of the tool on a stack of landscapes.
+
+    Returns a dictionary with the cleavage probability ('p_clv'), the
+    effective stability ('u_eff'), the cleavage rate at
+    ``binding_rate`` ('k_clv') and the dissociation constant for
+    PAM-binding rate ``k_on`` ('kd').
+    """
+    return {
+        'p_clv': get_cleavage_probs(landscapes, internal_rates),
+        'u_eff': get_effective_stabs(landscapes),
+        'k_clv': get_cleavage_rates(landscapes, internal_rates, binding_rate),
+        'kd': get_binding_consts(landscapes, internal_rates, k_on),
+    }
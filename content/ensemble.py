@@ -0,0 +1,122 @@
+"""Parameter-uncertainty ensembles.
+
+The landscape parameters (on-target landscape and mismatch penalties),
+the internal rates and the unbinding rate of the context are perturbed
+around their point estimates, and p_clv and ΔU_eff (the effective
+stability relative to the on-target) are evaluated on stacked
+(members, targets, 21) landscape arrays, chunk by chunk, to obtain
+confidence intervals for every target.
+"""
+
+import numpy as np
+
+from .scoring import load_protein, AVERAGE_PARAMETER_SETS
+from .sequences import encode_sequences
+from .landscapes import get_mismatches, get_hybridization_energies
+from .engine import get_cleavage_probs, get_effective_stabs
+
+ENSEMBLE_SIZE = 200
+ENERGY_SD = .5  # standard deviation of the energies (in kBT)
+RATE_SD = .2  # standard deviation of the rates (in log10 units)
+PERTURBATIONS = {
+    'landscape': 'on-target landscape and mismatch penalties',
+    'rates': 'internal rates (k_f, k_clv)',
+    'context': 'unbinding rate of the context (k_off)',
+}
+CHUNK_ROWS = 100_000  # (member, target) combinations per pass
+
+
+def sample_parameters(protein, size=ENSEMBLE_SIZE,
+                      energy_sd=ENERGY_SD, rate_sd=RATE_SD,
+                      perturb=tuple(PERTURBATIONS), seed=0):
+    """Draw an ensemble of parameters around those of a Searcher (with
+    the unbinding rate of its context). Energies are perturbed with
+    normally distributed deviations (standard deviation energy_sd, in
+    kBT), rates with log-normally distributed factors (standard deviation
+    rate_sd, in log10 units).
+
+    Returns a dict with the (size, 20) on-target landscapes and mismatch
+    penalties, and the (size,) rates k_off, k_f and k_clv (p_clv and
+    ΔU_eff do not depend on the PAM-binding rate k_on).
+    """
+    rng = np.random.default_rng(seed)
+    guide_length = len(protein.on_target_landscape)
+
+    def get_energies(values, group):
+        sd = energy_sd if group in perturb else 0.
+        return values + rng.normal(0., sd, (size, guide_length))
+
+    def get_rates(value, group):
+        sd = rate_sd if group in perturb else 0.
+        return value * 10 ** rng.normal(0., sd, size)
+
+    return {
+        'on_target_landscape': get_energies(protein.on_target_landscape,
+                                            'landscape'),
+        'mismatch_penalties': get_energies(protein.mismatch_penalties,
+                                           'landscape'),
+        'k_off': get_rates(protein.internal_rates['k_off'], 'context'),
+        'k_f': get_rates(protein.internal_rates['k_f'], 'rates'),
+        'k_clv': get_rates(protein.internal_rates['k_clv'], 'rates'),
+    }
+
+
+def get_ensemble_landscapes(params, mismatches, offsets):
+    """Stack the (members, N, 21) landscapes (including the PAM state) of
+    an ensemble on targets with (N, 20) mismatch patterns, plus (N, 20)
+    sequence-specific offsets (the hybridization energies)."""
+    landscapes = (
+        params['on_target_landscape'][:, np.newaxis, :] +
+        np.cumsum(mismatches * params['mismatch_penalties'][:, np.newaxis, :],
+                  axis=-1) +
+        offsets
+    )
+    return np.pad(landscapes, ((0, 0), (0, 0), (1, 0)))
+
+
+def score_ensemble(protospacer, off_targets, context, parameter_set,
+                   size=ENSEMBLE_SIZE, energy_sd=ENERGY_SD, rate_sd=RATE_SD,
+                   perturb=tuple(PERTURBATIONS), confidence=.95, seed=0):
+    """Confidence intervals of p_clv and ΔU_eff for the on-target and
+    off-targets over a parameter ensemble (see sample_parameters).
+
+    Returns a dict with (N, 3) arrays of the lower bound, median and
+    upper bound of 'p_clv' and 'du_eff' of each target.
+    """
+    guide = encode_sequences([protospacer])[0]
+    codes = encode_sequences([protospacer] + list(off_targets))
+    mismatches = get_mismatches(guide, codes)
+
+    if parameter_set in AVERAGE_PARAMETER_SETS:
+        protein = load_protein(parameter_set, context)
+        offsets = np.zeros(mismatches.shape)
+    else:
+        protein = load_protein(parameter_set, context, protospacer)
+        offsets = get_hybridization_energies(guide, codes,
+                                             protein.weight)[:, 1:]
+
+    params = sample_parameters(protein, size, energy_sd, rate_sd, perturb,
+                               seed)
+    internal_rates = {k: params[k][:, np.newaxis]
+                      for k in ('k_off', 'k_f', 'k_clv')}
+    u_eff_on = get_effective_stabs(
+        get_ensemble_landscapes(params, mismatches[:1], offsets[:1])
+    )
+
+    quantiles = [(1 - confidence) / 2, .5, (1 + confidence) / 2]
+    p_clv = np.empty((len(codes), 3))
+    du_eff = np.empty((len(codes), 3))
+    chunk_size = max(1, CHUNK_ROWS // size)
+    for start in range(0, len(codes), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        landscapes = get_ensemble_landscapes(params, mismatches[chunk],
+                                             offsets[chunk])
+        p_clv[chunk] = np.quantile(
+            get_cleavage_probs(landscapes, internal_rates),
+            quantiles, axis=0
+        ).T
+        du_eff[chunk] = np.quantile(
+            get_effective_stabs(landscapes) - u_eff_on,
+            quantiles, axis=0
+        ).T
+    return {'p_clv': p_clv, 'du_eff': du_eff}
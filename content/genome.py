@@ -0,0 +1,343 @@
+"""Search of off-target candidates in a FASTA-file (genome or plasmid).
+
+All NGG PAM sites on both strands are indexed with their packed 23-nt
+target sequences (see sequences.py). The protospacer of each site is
+split into SEED_NUM seeds of SEED_LENGTH nucleotides, and the sites are
+bucketed by the value of each seed. A site with up to SEED_NUM - 1
+mismatches against the guide matches it exactly on at least one seed
+(pigeonhole principle), so only the sites in the matching buckets need
+to be compared.
+
+Indices are stored in index_dir as a directory of .npy-files with a
+manifest, which records the checksum of the FASTA-file. The arrays are
+memory-mapped when loaded, so that all processes and sessions that
+search the same genome share a single copy in the page cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .sequences import (NUCLEOTIDES, encode_sequences, pack_sequences,
+                        get_mismatch_keys, count_mismatches, decode_sequences,
+                        unpack_sequences)
+
+SEED_LENGTH = 4  # nts per seed
+SEED_NUM = 5  # seeds per protospacer
+TARGET_LENGTH = 23
+INDEX_VERSION = 1  # increase when the index format changes
+INDEX_ARRAYS = ('records', 'starts', 'strands', 'targets', 'seed_orders',
+                'seed_offsets')
+BLOCK_SIZE = 1 << 24  # nts that are scanned at once
+LOAD_ATTEMPTS = 10  # attempts to load an index that is being swapped
+# location of the PAM/seed indices of FASTA-files
+index_dir = Path(os.environ.get(
+    'CRISPRZIP_INDEX_DIR',
+    Path.home() / '.cache' / 'crisprzip-tool' / 'genomes'
+))
+
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _nt in enumerate(NUCLEOTIDES):
+    _CODES[ord(_nt)] = _CODES[ord(_nt.lower())] = _code
+
+
+def iter_fasta(path):
+    """Generate the names and sequences (as bytes) of the records of a
+    FASTA-file."""
+    name, lines = None, []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(lines)
+                name, lines = line[1:].strip().decode(), []
+            elif line:
+                if name is None:
+                    raise ValueError(f"'{path}' is not a valid FASTA-file.")
+                lines.append(line)
+    if name is not None:
+        yield name, b''.join(lines)
+
+
+def read_fasta(path):
+    """Read the names and sequences of a FASTA-file."""
+    names, sequences = [], []
+    for name, seq in iter_fasta(path):
+        names.append(name)
+        sequences.append(seq.decode())
+    return names, sequences
+
+
+def find_pam_sites(seq):
+    """Find the NGG PAM sites on both strands of a sequence (bytes).
+    Returns the start of each 23-nt site on the forward strand, its
+    strand (+1 or -1) and its packed target sequence."""
+    codes = _CODES[np.frombuffer(seq, dtype=np.uint8)]
+    windows = np.arange(TARGET_LENGTH)
+    starts, strands, targets = [], [], []
+    for block in range(0, max(len(codes) - TARGET_LENGTH + 1, 0), BLOCK_SIZE):
+        block_codes = codes[block:block + BLOCK_SIZE + TARGET_LENGTH - 1]
+        for strand in (1, -1):
+            n_starts = len(block_codes) - TARGET_LENGTH + 1
+            if strand == 1:  # ...NGG
+                pam = block_codes[21:], block_codes[22:], 2
+            else:  # CCN... on the forward strand
+                pam = block_codes[:-1], block_codes[1:], 1
+            site_starts = np.flatnonzero((pam[0][:n_starts] == pam[2]) &
+                                         (pam[1][:n_starts] == pam[2]))
+            site_codes = block_codes[site_starts[:, np.newaxis] + windows]
+            if strand == -1:  # reverse complement
+                site_codes = 3 - site_codes[:, ::-1]
+            complete = np.all(site_codes < 4, axis=1)  # no Ns
+            starts.append(block + site_starts[complete])
+            strands.append(np.full(complete.sum(), strand, dtype=np.int8))
+            targets.append(pack_sequences(site_codes[complete]))
+    if not starts:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8),
+                np.zeros(0, dtype=np.uint64))
+    return np.concatenate(starts), np.concatenate(strands), \
+        np.concatenate(targets)
+
+
+def get_seeds(targets):
+    """Seed values of packed target sequences, as a (SEED_NUM, N) array."""
+    shifts = 2 * SEED_LENGTH * np.arange(SEED_NUM, dtype=np.uint64)
+    mask = np.uint64((1 << 2 * SEED_LENGTH) - 1)
+    return ((np.asarray(targets, dtype=np.uint64) >> shifts[:, np.newaxis])
+            & mask).astype(np.int64)
+
+
+class PamIndex:
+    """NGG PAM sites of a FASTA-file, bucketed by their seeds.
+
+    Parameters
+    ----------
+    names : `list` of `str`
+        Names of the FASTA records.
+    records, starts, strands, targets : `np.ndarray`
+        Record number, start (0-based, on the forward strand), strand
+        (+1 or -1) and packed 23-nt target sequence of each site.
+    seed_orders, seed_offsets : `np.ndarray`, optional
+        Site numbers sorted by the value of each seed, and the offsets of
+        each seed value in these arrays. Calculated if not provided.
+    """
+
+    def __init__(self, names, records, starts, strands, targets,
+                 seed_orders=None, seed_offsets=None):
+        self.names = list(names)
+        self.records = records
+        self.starts = starts
+        self.strands = strands
+        self.targets = targets
+        if seed_orders is None:
+            seeds = get_seeds(targets)
+            seed_orders = np.argsort(seeds, axis=1, kind='stable').astype(
+                np.uint32 if len(targets) < 2 ** 32 else np.int64)
+            counts = np.stack([np.bincount(s, minlength=4 ** SEED_LENGTH)
+                               for s in seeds])
+            seed_offsets = np.pad(np.cumsum(counts, axis=1), [(0, 0), (1, 0)])
+        self.seed_orders = seed_orders
+        self.seed_offsets = seed_offsets
+
+    def __len__(self):
+        return len(self.targets)
+
+    @classmethod
+    def from_fasta(cls, path):
+        """Scan all records of a FASTA-file for PAM sites."""
+        names, records, starts, strands, targets = [], [], [], [], []
+        for i, (name, seq) in enumerate(iter_fasta(path)):
+            record_sites = find_pam_sites(seq)
+            names.append(name.split(maxsplit=1)[0] if name else name)  # ID
+            records.append(np.full(len(record_sites[0]), i, dtype=np.int32))
+            starts.append(record_sites[0])
+            strands.append(record_sites[1])
+            targets.append(record_sites[2])
+        if not names:
+            raise ValueError(f"'{path}' does not contain any sequences.")
+        return cls(names, np.concatenate(records), np.concatenate(starts),
+                   np.concatenate(strands), np.concatenate(targets))
+
+    def save(self, directory, source=None):
+        """Store the index as .npy-files in a directory, with a manifest
+        that describes the source (see get_source_info)."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(directory / f'{name}.npy', getattr(self, name))
+        manifest = {
+            'version': INDEX_VERSION,
+            'seed_length': SEED_LENGTH,
+            'seed_num': SEED_NUM,
+            'sites': len(self),
+            'names': self.names,
+            'source': source,
+        }
+        # the manifest is written last, and marks the index as complete
+        with open(directory / 'manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load an index from a directory, memory-mapping its arrays
+        (unless mmap_mode is None)."""
+        directory = Path(directory)
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise ValueError(f"'{directory}' does not contain a valid index.")
+        arrays = [np.load(directory / f'{name}.npy',
+                          mmap_mode=mmap_mode if manifest['sites'] else None)
+                  for name in INDEX_ARRAYS]
+        return cls(manifest['names'], *arrays)
+
+    def find_sites(self, protospacer, max_mismatches=3):
+        """Find the sites with at most max_mismatches mismatches between
+        their protospacer and that of the guide. Returns their site
+        numbers and mismatch patterns (as integer keys)."""
+        guide = pack_sequences(encode_sequences([protospacer]))[0]
+        if max_mismatches < SEED_NUM:
+            # every hit matches at least one seed exactly
+            candidates = np.unique(np.concatenate([
+                self.seed_orders[i, self.seed_offsets[i, seed]:
+                                    self.seed_offsets[i, seed + 1]]
+                for i, seed in enumerate(get_seeds([guide])[:, 0])
+            ]))
+        else:
+            candidates = np.arange(len(self))
+        keys = get_mismatch_keys(guide, self.targets[candidates])
+        hits = count_mismatches(keys) <= max_mismatches
+        return candidates[hits], keys[hits]
+
+    def search(self, protospacer, max_mismatches=3):
+        """Find the off-target candidates of a guide, as a data frame with
+        the record, start, strand, sequence and number of mismatches of
+        each site, sorted by the number of mismatches."""
+        sites, keys = self.find_sites(protospacer, max_mismatches)
+        hits = pd.DataFrame({
+            'record': np.array(self.names, dtype=object)[self.records[sites]],
+            'start': self.starts[sites],
+            'strand': np.where(self.strands[sites] == 1, '+', '-'),
+            'sequence': decode_sequences(unpack_sequences(
+                self.targets[sites], TARGET_LENGTH)),
+            'mismatches': count_mismatches(keys),
+        })
+        return hits.sort_values(['mismatches', 'record', 'start'],
+                                kind='stable', ignore_index=True)
+
+
+def get_file_checksum(path):
+    """SHA-256 checksum of a file."""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(1 << 20):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def get_source_info(fasta_path, checksum=None):
+    """Description of a FASTA-file for the manifest of its index."""
+    fasta_path = Path(fasta_path).resolve()
+    stat = fasta_path.stat()
+    return {
+        'path': str(fasta_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': checksum or get_file_checksum(fasta_path),
+    }
+
+
+def read_manifest(directory):
+    """Manifest of an index directory, or None if there is no complete
+    index of the current version."""
+    try:
+        with open(Path(directory) / 'manifest.json') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get('version') != INDEX_VERSION or
+            manifest.get('seed_length') != SEED_LENGTH or
+            manifest.get('seed_num') != SEED_NUM):
+        return None
+    return manifest
+
+
+def get_index_dir(fasta_path):
+    """Location of the index of a FASTA-file in index_dir."""
+    fasta_path = Path(fasta_path).resolve()
+    digest = hashlib.sha1(str(fasta_path).encode()).hexdigest()[:16]
+    return index_dir / f"{fasta_path.stem}-{digest}"
+
+
+def load_pam_index(fasta_path):
+    """Load the PamIndex of a FASTA-file, which is built and stored in
+    index_dir if necessary.
+
+    The index is reused if the size and modification time of the file
+    match its manifest, or otherwise if its checksum does.
+    """
+    directory = get_index_dir(fasta_path)
+    stat = Path(fasta_path).stat()
+    manifest = read_manifest(directory)
+    checksum = None
+    if manifest is not None:
+        source = manifest['source']
+        if (source['size'], source['mtime_ns']) == (stat.st_size,
+                                                    stat.st_mtime_ns):
+            return load_swapped_index(directory)
+        checksum = get_file_checksum(fasta_path)
+        if source['sha256'] == checksum:  # e.g. the file was touched
+            manifest['source'] = get_source_info(fasta_path, checksum)
+            tmp_path = directory / f'manifest.{os.getpid()}.json'
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=1)
+            tmp_path.replace(directory / 'manifest.json')
+            return load_swapped_index(directory)
+
+    source = get_source_info(fasta_path, checksum)
+    index = PamIndex.from_fasta(fasta_path)
+    tmp_dir = directory.with_name(f'{directory.name}.{os.getpid()}.'
+                                  f'{time.time_ns()}.tmp')
+    index.save(tmp_dir, source)
+    swap_index(tmp_dir, directory)
+    return load_swapped_index(directory)
+
+
+def swap_index(tmp_dir, directory):
+    """Move a newly built index into place, replacing an outdated one.
+
+    The outdated index is first renamed aside and only deleted after
+    the new one has been renamed into place (both renames are atomic),
+    so that a concurrent build never deletes an index that has just been
+    swapped in. If a concurrent build swaps in its index first, that one
+    is kept.
+    """
+    old_dir = directory.with_name(f'{directory.name}.{os.getpid()}.'
+                                  f'{time.time_ns()}.old')
+    try:
+        directory.rename(old_dir)
+    except FileNotFoundError:
+        pass
+    try:
+        tmp_dir.rename(directory)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_swapped_index(directory, attempts=LOAD_ATTEMPTS):
+    """Load an index with PamIndex.load, retrying for a moment if it is
+    missing, e.g. while a concurrent build swaps in a new index."""
+    for attempt in range(attempts):
+        try:
+            return PamIndex.load(directory)
+        except (ValueError, OSError):
+            if attempt == attempts - 1:
+                raise
+            time.sleep(.1 * (attempt + 1))
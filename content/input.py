@@ -1,7 +1,13 @@
+import asyncio
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache, partial
 from io import StringIO
+from pathlib import Path
 
-from nicegui import ui, events
+from nicegui import ui, events, run, app
 import pandas as pd
 import matplotlib as mpl
 from matplotlib import pyplot as plt
@@ -9,7 +15,22 @@ from matplotlib import pyplot as plt
 from crisprzip import *
 from crisprzip.kinetics import *
 
+from .patterns import AVERAGE_PARAMETER_SETS
+from .scoring import (chunk_size, workers, get_k_on_off, load_protein,
+                      get_pattern_table, get_pattern_metrics, make_stc_list,
+                      _init_worker)
+from .cache import ResultCache, score_with_cache
+from .sequences import (parse_sequences, get_sequence_error,
+                        decode_sequences, get_line_number)
+from .genome import load_pam_index, load_swapped_index
+
 initial_input = False  # auto-fills upon load - useful when developing
+# location and size (in guide/target pairs) of the result cache ('': no cache)
+cache_path = os.environ.get(
+    'CRISPRZIP_CACHE',
+    str(Path.home() / '.cache' / 'crisprzip-tool' / 'results.sqlite')
+)
+cache_size = int(os.environ.get('CRISPRZIP_CACHE_SIZE', 1_000_000))
 
 
 def show_input():
@@ -33,47 +54,40 @@ def show_input():
             if e.name.lower().endswith('.csv'):
                 with StringIO(content) as f:
                     df = pd.read_csv(f)
-                    sequences = df.iloc[:, 0].tolist()
-                    formatted_sequences = ',\n'.join(sequences)
-                    off_targets_input.value = formatted_sequences
+                    sequences = df.iloc[:, 0].astype(str).tolist()
+                    content = ',\n'.join(sequences)
+
+            # the parsed content is reused by the validation of the textarea
+            errors = parse_off_targets(content).errors
+            off_targets_input.value = content
+
+            if errors:
+                i, position, err_msg = errors[0]
+                ui.notify(f'File uploaded, but {len(errors)} sequence(s) are '
+                          f'invalid: {err_msg} (target #{i + 1}, line '
+                          f'{get_line_number(content, position)})',
+                          type='warning')
             else:
-                # otherwise juts use the content then from the off-target box
-                off_targets_input.value = content
-
-            ui.notify('File uploaded successfully', type='positive')
+                ui.notify('File uploaded successfully', type='positive')
         except Exception as e:
             ui.notify(f'Error processing file: {str(e)}', type='negative')
 
     def process_ontarget_input(inputvalue, inputtype):
         if inputtype == "protospacer":
-            return inputvalue
+            return inputvalue.strip().upper()
         elif inputtype == "guide RNA":
             return inputvalue.replace("U", "T") + "NGG"
         else:
             raise ValueError(f"Unrecognized input type \'{inputtype}\'.")
 
     def process_offtarget_input(inputvalue):
-        off_targets = []
-        for seq in inputvalue.split(","):
-            if seq.strip() != "":
-                off_targets.append(seq.strip())
-        return off_targets
+        return decode_sequences(parse_off_targets(inputvalue).codes)
 
     def sequence_validation(in_str, input_type=None) -> str:
 
         if input_type == "protospacer":
-            length = 23
-            pattern = r'^[ACGTacgt\,\n\s]*$'
-            if not (re.fullmatch(pattern, in_str)):
-                return "Only ACGT nucleotides"
-            if length is not None and len(in_str.strip()) > 0:
-                input_length = len(in_str.strip())
-                if input_length < length:
-                    return f"Too short: {input_length}/{length}"
-                elif input_length > length:
-                    return f"Too long: {input_length}/{length}"
-                if in_str[-2:] != "GG":
-                    return f"Only canonical PAMs \'NGG\'"
+            if in_str and in_str.strip():
+                return get_sequence_error(in_str)
 
         elif input_type == "guide RNA":
             length = 20
@@ -88,11 +102,10 @@ def show_input():
                     return f"Too long ({input_length}/{length})"
 
         elif input_type == "offtargets":
-            off_targets = process_offtarget_input(in_str)
-            for i, seq in enumerate(off_targets):
-                output = sequence_validation(seq, "protospacer")
-                if output is not None:
-                    return f"{output} (target #{i + 1})"
+            errors = parse_off_targets(in_str).errors
+            if errors:
+                i, _, err_msg = errors[0]
+                return f"{err_msg} (target #{i + 1})"
 
     wc1 = 250  # column 1 width
     wc2 = 100  # column 2 width
@@ -170,12 +183,17 @@ def show_input():
             )
 
             ui.element().classes('w-[15px]')
-            (ui.button('upload',
-                       on_click=lambda: (upload_component.reset(),
-                                         upload_component.run_method('pickFiles')))
-             .props('outline no-caps')
-             .style(f'font-size: {fsz}pt')
-             .classes('w-[65px]'))
+            with ui.column().classes('p-0 gap-1'):
+                (ui.button('upload',
+                           on_click=lambda: (upload_component.reset(),
+                                             upload_component.run_method('pickFiles')))
+                 .props('outline no-caps')
+                 .style(f'font-size: {fsz}pt')
+                 .classes('w-[65px]'))
+                (ui.button('search', on_click=lambda: genome_popup.open())
+                 .props('outline no-caps')
+                 .style(f'font-size: {fsz}pt')
+                 .classes('w-[65px]'))
 
 
         with ui.row(align_items='start').classes(f'w-[{wc1}px] p-0 m-0 gap-0 no-wrap'):
@@ -274,13 +292,77 @@ def show_input():
             ''', extras=['latex']
             )
 
+    # GENOME SEARCH
+    with ui.dialog() as genome_popup, ui.card().classes('w-[500px] p-4'):
+        with ui.row(align_items='center').classes('w-full p-0'):
+            ui.markdown('**Search off-targets in a genome**').style(
+                f'font-size: {fsz}pt')
+            ui.space()
+            (ui.button(icon='close', on_click=genome_popup.close)
+             .props('outline').classes('w-[40px] h-[40px] m-0'))
+        ui.label(
+            'Finds all sites with an NGG PAM on both strands of a local '
+            'FASTA-file (genome or plasmid) that have at most the given number '
+            'of mismatches with the target sequence. The first search of a '
+            'file builds an index, which is reused afterwards.'
+        ).style(f'font-size: {fsz}pt')
+        genome_path_input = (
+            ui.input('FASTA-file',
+                     placeholder='/path/to/genome.fa',
+                     validation=lambda x: (None if not x or Path(x).expanduser().is_file()
+                                           else "File not found"))
+            .props('dense').classes('w-full font-mono').style(f'font-size: {fsz}pt')
+        )
+        with ui.row(align_items='center').classes('w-full p-0'):
+            max_mismatches_select = (
+                ui.select({k: f'up to {k} mismatches' for k in range(6)}, value=3)
+                .props('dense').classes('w-[200px]').style(f'font-size: {fsz}pt')
+            )
+            ui.space()
+            search_spinner = ui.spinner()
+            search_spinner.set_visibility(False)
+            search_button = ui.button('search').props('icon=search no-caps')
+
+    async def search_genome_handler():
+        err_msg = sequence_validation(in_str=target_sequence_input.value,
+                                      input_type=target_input_select.value)
+        if err_msg or not target_sequence_input.value:
+            ui.notify(f"Target sequence error: {err_msg or 'No sequence'}",
+                      type='negative')
+            return
+        protospacer = process_ontarget_input(target_sequence_input.value,
+                                             target_input_select.value)
+        fasta_path = Path(genome_path_input.value or '').expanduser()
+        if not fasta_path.is_file():
+            ui.notify("FASTA-file not found", type='negative')
+            return
+
+        search_button.disable()
+        search_spinner.set_visibility(True)
+        try:
+            hits = await run.io_bound(search_genome, str(fasta_path),
+                                      protospacer, max_mismatches_select.value)
+        except Exception as e:
+            ui.notify(f'Error searching genome: {str(e)}', type='negative')
+            return
+        finally:
+            search_button.enable()
+            search_spinner.set_visibility(False)
+
+        off_targets_input.value = ',\n'.join(hits['sequence'])
+        ui.notify(f"Found {len(hits)} sites with up to "
+                  f"{max_mismatches_select.value} mismatches", type='positive')
+        genome_popup.close()
+
+    search_button.on_click(search_genome_handler)
+
     mpl.style.use('seaborn-v0_8')
 
     def plot_parameter_values():
         plot_size = (800, 250)  # in px
         dpi = plt.rcParams['figure.dpi']  # pixel in inches
 
-        protein = crisprzip.kinetics.load_landscape(model_dropdown.value)
+        protein = load_protein(model_dropdown.value, context_dropdown.value)
         k_on, k_off = get_k_on_off(context_dropdown.value)
 
         with (ui.matplotlib(figsize=(plot_size[0] / dpi,
@@ -385,57 +467,135 @@ def show_input():
     return submit_button, get_input_values, model_dropdown
 
 
-def get_k_on_off(context):
-    if context == 'invitro':
-        k_on = 0.1
-        k_off = 1.0
-    elif context == 'ecoli':
-        # E. coli volume:      1 µm³ = 1 fL
-        # no. of PAMs:         1E6 (500k / genome, 2 genomes)
-        # PAM-binding rate:   60 s⁻¹
-        # PAM-unbinding rate: 40 s⁻¹
-        k_on = 6.02E23 * 1E-9 * 1E-15 / 1E6 / (1 / 60 + 1 / 40)
-        k_off = 40
-    elif context == 'mammal':
-        # mammal nuclear volume: 500 µm³ = 500 fL
-        # no. of PAMs:          13E6 (320 mln / genome, 2 genomes, 2% available)
-        # PAM-binding rate:     1.33 s⁻¹
-        # PAM-unbinding rate:     40 s⁻¹
-        k_on = 6.02E23 * 1E-9 * 500E-15 / 13E6 / (1 / 1.33 + 1 / 40)
-        k_off = 40
-    else:
-        raise ValueError(f"Unknown context '{context}'")
-    return k_on, k_off
-
-
-def make_stc_list(protospacer, off_targets, context, parameter_set):
-    """Generate SearcherTargetComplexes."""
-
-    k_on, k_off = get_k_on_off(context)
-
-    if parameter_set == 'sequence_params':
-        bare_protein = crisprzip.kinetics.load_landscape(parameter_set)
-        bare_protein.internal_rates['k_off'] = k_off
-        guided_protein = bare_protein.bind_guide_rna(protospacer=protospacer)
-
-        targets = [protospacer] + off_targets
-        protein_sequence_complexes = [guided_protein.probe_sequence(target_seq)
-                                      for target_seq in targets]
-        return protein_sequence_complexes
-
-    elif (parameter_set == 'average_params') or (
-            parameter_set == 'average_params_legacy'):
-        protein = crisprzip.kinetics.load_landscape(parameter_set)
-        protein.internal_rates['k_off'] = k_off
-
-        targets = [protospacer] + off_targets
-        protein_sequence_complexes = []
-        for target_seq in targets:
-            mm_pattern = (GuideTargetHybrid
-                          .from_cas9_offtarget(target_seq, protospacer)
-                          .get_mismatch_pattern())
-            protein_sequence_complexes += [protein.probe_target(mm_pattern)]
-        return protein_sequence_complexes
-    else:
-        raise ValueError(f"Unrecognized parameter set '{parameter_set}'.")
+def suspend_grid_updates(grid):
+    """Context in which changes to the options of an AG Grid are not sent
+    to the client, which would re-create the grid (losing its scroll
+    position, selection and sort). Use it to keep the options in line
+    with changes that are applied through the grid API. Options are only
+    observed from NiceGUI 3 on."""
+    props = grid._props
+    if hasattr(props, 'suspend_updates'):
+        return props.suspend_updates()
+    return nullcontext()
+
+
+@lru_cache(maxsize=4)
+def parse_off_targets(text):
+    """Parse the off-target textarea; shared by the validation on every
+    keystroke, file uploads and the submit."""
+    return parse_sequences(text or '')
+
+
+@lru_cache(maxsize=8)
+def _get_pam_index(fasta_path, size, mtime_ns):
+    return load_pam_index(fasta_path)
+
+
+def search_genome(fasta_path, protospacer, max_mismatches):
+    """Find the off-target candidates of a protospacer in a FASTA-file.
+    Its (memory-mapped) PamIndex is kept open between searches."""
+    fasta_path = Path(fasta_path).resolve()
+    stat = fasta_path.stat()
+    index = _get_pam_index(str(fasta_path), stat.st_size, stat.st_mtime_ns)
+    return index.search(protospacer, max_mismatches)
+
+
+@lru_cache(maxsize=8)
+def _open_pam_index(directory, mtime_ns):
+    return load_swapped_index(Path(directory))
+
+
+def search_pam_index(directory, protospacer, max_mismatches):
+    """Find the off-target candidates of a protospacer in the PamIndex
+    in directory, which has been built by load_pam_index (e.g. in the
+    main process, so that workers do not build it concurrently). The
+    index is kept open between searches until it is rebuilt."""
+    try:
+        mtime_ns = (Path(directory) / 'manifest.json').stat().st_mtime_ns
+    except FileNotFoundError:  # a concurrent build is swapping the index
+        mtime_ns = None
+    index = _open_pam_index(str(directory), mtime_ns)
+    return index.search(protospacer, max_mismatches)
+
 
+_process_pool = None
+
+
+def get_process_pool():
+    """Process pool that is shared by all clients, started on first use."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=workers,
+                                            initializer=_init_worker)
+    return _process_pool
+
+
+def shutdown_process_pool():
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app.on_shutdown(shutdown_process_pool)
+
+
+async def run_scoring(func: callable, **kwargs):
+    """Run func in the process pool (or on a thread if workers is
+    0). Like run.cpu_bound, returns None if the app is shutting down."""
+    if workers == 0:
+        return await run.io_bound(func, **kwargs)
+    if app.is_stopping:
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            get_process_pool(), partial(func, **kwargs)
+        )
+    except RuntimeError as e:
+        if 'cannot schedule new futures after shutdown' not in str(e):
+            raise
+    except asyncio.CancelledError:
+        pass
+    return None
+
+
+@lru_cache(maxsize=1)
+def get_result_cache():
+    """ResultCache at cache_path, or None if caching is disabled."""
+    return ResultCache(cache_path, cache_size) if cache_path else None
+
+
+def score_cached(score_func: callable, metric, protospacer, off_targets,
+                 context, parameter_set):
+    """Score the targets with score_func, taking the values of metric
+    from the result cache where possible."""
+    cache = get_result_cache()
+    if cache is None or metric is None:
+        return score_func(protospacer=protospacer, off_targets=off_targets,
+                          context=context, parameter_set=parameter_set)
+    return score_with_cache(cache, metric, score_func, protospacer,
+                            off_targets, context, parameter_set)
+
+
+async def score_in_chunks(score_func: callable, protospacer, off_targets,
+                          context, parameter_set, metric=None):
+    """Score the on-target and off-targets chunk by chunk.
+
+    Each chunk is scored with score_func (e.g. get_all_cleavage_probs)
+    in the process pool, so that the event loop stays responsive and
+    concurrent submits are spread over the worker processes. If metric
+    (e.g. 'p_clv') is given, cached values are used for targets that
+    have been scored before.
+    Yields the values of consecutive targets in [protospacer] + off_targets.
+    """
+    for start in range(0, max(len(off_targets), 1), chunk_size):
+        values = await run_scoring(
+            score_cached,
+            score_func=score_func,
+            metric=metric,
+            protospacer=protospacer,
+            off_targets=off_targets[start:start + chunk_size],
+            context=context,
+            parameter_set=parameter_set,
+        )
+        if values is None:  # app is shutting down
+            return
+        yield values if start == 0 else values[1:]
@@ -0,0 +1,111 @@
+"""Fused kernels for the per-target metrics of the engine.
+
+The cleavage probability and the effective stability reduce every
+landscape to a single number, and are evaluated on every target of
+every batch. The kernels below compute them in one pass over the
+landscapes, without building the (..., 23) rate arrays of
+get_rate_arrays: the cumulative products of the backward-to-forward
+rate ratios telescope into exp(landscape) times a rate ratio. The
+Boltzmann weights of the effective stability are taken relative to the
+lowest R-loop state (as in a log-sum-exp), so that deep landscapes do
+not overflow.
+
+Large stacks are evaluated as fused NumPy expressions. Small stacks
+are dominated by the overhead of the NumPy calls, so if Numba is
+installed, they are evaluated by compiled loops instead (NumPy's
+vectorized exp is faster beyond about 150 targets). Set the
+CRISPRZIP_KERNELS environment variable to 'numpy' to never use Numba.
+"""
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+backend = ('numba' if numba is not None and
+           os.environ.get('CRISPRZIP_KERNELS', 'numba') != 'numpy'
+           else 'numpy')
+max_loop_rows = 128  # largest stack that is evaluated by the Numba loops
+
+
+def _cleavage_probs_numpy(landscapes, k_off, k_f, k_clv):
+    boltzmann = np.exp(landscapes - landscapes[..., :1])
+    return 1 / (1 + k_off / k_f * np.sum(boltzmann[..., :-1], axis=-1) +
+                k_off / k_clv * boltzmann[..., -1])
+
+
+def _effective_stabs_numpy(landscapes):
+    landscapes = landscapes[..., 1:]
+    boltzmann = np.exp(np.min(landscapes, axis=-1, keepdims=True) -
+                       landscapes)
+    return (np.sum(landscapes * boltzmann, axis=-1) /
+            np.sum(boltzmann, axis=-1))
+
+
+def _cleavage_probs_loop(landscapes, k_off, k_f, k_clv):
+    n, size = landscapes.shape
+    probs = np.empty(n)
+    for i in range(n):
+        total = 0.
+        for j in range(size - 1):
+            total += np.exp(landscapes[i, j] - landscapes[i, 0])
+        total = (k_off / k_f * total + k_off / k_clv *
+                 np.exp(landscapes[i, size - 1] - landscapes[i, 0]))
+        probs[i] = 1 / (1 + total)
+    return probs
+
+
+def _effective_stabs_loop(landscapes):
+    n, size = landscapes.shape
+    stabs = np.empty(n)
+    for i in range(n):
+        lowest = landscapes[i, 1]
+        for j in range(2, size):
+            lowest = min(lowest, landscapes[i, j])
+        weighted_sum = 0.
+        partition_sum = 0.
+        for j in range(1, size):
+            boltzmann = np.exp(lowest - landscapes[i, j])
+            weighted_sum += landscapes[i, j] * boltzmann
+            partition_sum += boltzmann
+        stabs[i] = weighted_sum / partition_sum
+    return stabs
+
+
+if numba is not None:
+    _cleavage_probs_loop = numba.njit(nogil=True)(_cleavage_probs_loop)
+    _effective_stabs_loop = numba.njit(nogil=True)(_effective_stabs_loop)
+
+
+def _use_loop(landscapes):
+    return (backend == 'numba' and
+            landscapes.size <= max_loop_rows * landscapes.shape[-1])
+
+
+def cleavage_probs(landscapes, k_off, k_f, k_clv):
+    """Cleavage probability of each (..., 21) landscape after
+    PAM-association, for internal rates that broadcast against its
+    leading dimensions (see engine.get_cleavage_probs)."""
+    landscapes = np.asarray(landscapes, dtype=float)
+    if (_use_loop(landscapes) and
+            all(np.ndim(k) == 0 for k in (k_off, k_f, k_clv))):
+        return _cleavage_probs_loop(
+            np.ascontiguousarray(landscapes).reshape(-1, landscapes.shape[-1]),
+            float(k_off), float(k_f), float(k_clv)
+        ).reshape(landscapes.shape[:-1])
+    return _cleavage_probs_numpy(landscapes, k_off, k_f, k_clv)
+
+
+def effective_stabs(landscapes):
+    """Boltzmann-weighted average free energy of the R-loop states of
+    each (..., 21) landscape (see engine.get_effective_stabs)."""
+    landscapes = np.asarray(landscapes, dtype=float)
+    if _use_loop(landscapes):
+        return _effective_stabs_loop(
+            np.ascontiguousarray(landscapes).reshape(-1, landscapes.shape[-1])
+        ).reshape(landscapes.shape[:-1])
+    return _effective_stabs_numpy(landscapes)
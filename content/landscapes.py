@@ -0,0 +1,208 @@
+"""Vectorized construction of sequence-specific hybridization landscapes.
+
+SearcherSequenceComplex objects compute the nearest-neighbor energies of
+every target in Python loops over the R-loop states. Here, the same
+energies (crisprzip.nucleic_acid.NearestNeighborModel) are evaluated
+for a whole batch of targets at once: the parameter tables are indexed
+by nucleotide codes, and the energies of all R-loop lengths follow from
+cumulative sums. Targets are (N, 23) code arrays (see sequences.py), in
+5'-to-3' order with the PAM; arrays below are in R-loop order (position
+1 next to the PAM first).
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from crisprzip.nucleic_acid import NearestNeighborModel
+
+from .sequences import NUCLEOTIDES, encode_sequences
+
+GUIDE_LENGTH = 20
+RNA_NUCLEOTIDES = 'ACGU'
+TEMPERATURE = 20  # in deg Celsius, as in crisprzip's sequence landscapes
+GAS_CONSTANT = 1.9872E-3  # in kcal / (K mol)
+
+
+def _get_table(params, key_format, size):
+    """Array with the value of each parameter key in params, indexed by
+    the codes of its nucleotides (NaN for combinations without a key)."""
+    table = np.full((4,) * size, np.nan)
+    for index in np.ndindex(table.shape):
+        key = key_format(*index)
+        if key in params:
+            table[index] = params[key]
+    return table
+
+
+@lru_cache(maxsize=1)
+def get_nearest_neighbor_tables():
+    """Parameter tables of the nearest-neighbor model, in kBT (at
+    TEMPERATURE; the unit and temperature settings of the model are left
+    as they are)."""
+    model = NearestNeighborModel
+    model.load_data()
+
+    rna, dna = RNA_NUCLEOTIDES, NUCLEOTIDES
+    dna_stacks = model.dna_dna_params['stacking energies']
+    rna_stacks = model.rna_dna_params['stacking energies']
+    tables = {
+        # NTS dinucleotide (5'-to-3') and its complement
+        'dna_stack': _get_table(
+            dna_stacks, lambda a, b: f"d{dna[a]}{dna[b]}/d{dna[3 - a]}"
+                                     f"{dna[3 - b]}", 2),
+        # guide RNA and target strand DNA, in R-loop order reversed
+        'rna_stack': _get_table(
+            rna_stacks['2mer'], lambda a, b, c, d: f"r{rna[a]}{rna[b]}/"
+                                                   f"d{dna[c]}{dna[d]}", 4),
+        'rna_stack3': _get_table(
+            rna_stacks['3mer'], lambda a, b, c, d, e, f:
+            f"r{rna[a]}{rna[b]}{rna[c]}/d{dna[d]}{dna[e]}{dna[f]}", 6),
+        'rna_stack4': _get_table(
+            rna_stacks['4mer'], lambda a, b, c, d, e, f, g, h:
+            f"r{rna[a]}{rna[b]}{rna[c]}{rna[d]}/"
+            f"d{dna[e]}{dna[f]}{dna[g]}{dna[h]}", 8),
+        # basepairs of the guide RNA with its complement
+        'terminal': np.array([
+            model.rna_dna_params['terminal penalties'][f"r{rna[a]}-d{dna[3 - a]}"]
+            for a in range(4)
+        ]),
+    }
+    loop_energies = model.rna_dna_params['loop energies']
+    tables['loop'] = np.array([
+        loop_energies.get(f"{2 * length} nt", 4.5) for length in range(21)
+    ])
+    kbt = GAS_CONSTANT * (TEMPERATURE + 273.15)  # in kcal/mol
+    return {name: table / kbt for name, table in tables.items()}
+
+
+def get_dna_opening_energies(targets):
+    """Energy to open the DNA duplex of each (N, 23) target for each
+    R-loop length 0-20 (in kBT, see NearestNeighborModel.dna_opening_energy)."""
+    stack = get_nearest_neighbor_tables()['dna_stack']
+    nts = targets[:, GUIDE_LENGTH - 1::-1]  # R-loop order
+    downstream = targets[:, GUIDE_LENGTH]  # the N of the PAM
+
+    energies = np.zeros((len(targets), GUIDE_LENGTH + 1))
+    middle = np.cumsum(stack[nts[:, 1:], nts[:, :-1]], axis=1)
+    energies[:, 1:] -= stack[nts[:, 0], downstream][:, np.newaxis]
+    energies[:, 1:-1] -= middle
+    energies[:, -1] -= middle[:, -1]
+    # unknown upstream basepair: average over its four options
+    energies[:, -1] -= stack[:, nts[:, -1]].mean(axis=0)
+    return energies
+
+
+def get_rna_duplex_energies(guide, targets):
+    """Energy to form the RNA:DNA hybrid of the guide of an (23,)
+    protospacer with each (N, 23) target for each R-loop length 0-20 (in
+    kBT, see NearestNeighborModel.rna_duplex_energy)."""
+    tables = get_nearest_neighbor_tables()
+    n = len(targets)
+    positions = np.arange(GUIDE_LENGTH)
+    rg = np.broadcast_to(guide[GUIDE_LENGTH - 1::-1], (n, GUIDE_LENGTH))
+    rt = 3 - targets[:, GUIDE_LENGTH - 1::-1]  # target strand
+    match = rg == 3 - rt
+    rows = np.arange(n)[:, np.newaxis]
+
+    energies = np.zeros((n, GUIDE_LENGTH + 1))
+
+    # basestacks between neighboring basepairs, from R-loop length 2
+    stacks = np.where(match[:, 1:] & match[:, :-1],
+                      tables['rna_stack'][rg[:, 1:], rg[:, :-1],
+                                          rt[:, 1:], rt[:, :-1]], 0.)
+    energies[:, 2:] += np.cumsum(stacks, axis=1)
+
+    # internal loops, from the R-loop length that includes the closing
+    # basepair on their PAM-distal side
+    edges = np.diff(np.pad(~match, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    loop_rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]  # closing basepair
+    closed = (starts > 0) & (ends < GUIDE_LENGTH)
+    loop_rows, starts, ends = loop_rows[closed], starts[closed], ends[closed]
+    lengths = ends - starts
+
+    def get_loop_params(table, offsets):
+        # nucleotides around the start of each loop (clipped at the end
+        # of the guide for loops that do not use them)
+        idx = np.minimum(starts[:, np.newaxis] + offsets, GUIDE_LENGTH - 1)
+        return table[(*rg[loop_rows[:, np.newaxis], idx].T,
+                      *rt[loop_rows[:, np.newaxis], idx].T)]
+
+    def get_stack_params(left, right):
+        return tables['rna_stack'][rg[loop_rows, left], rg[loop_rows, right],
+                                   rt[loop_rows, left], rt[loop_rows, right]]
+
+    loops = np.select(
+        [lengths == 1, lengths == 2],
+        [get_loop_params(tables['rna_stack3'], np.array([1, 0, -1])),
+         get_loop_params(tables['rna_stack4'], np.array([2, 1, 0, -1]))],
+        get_stack_params(ends, ends - 1) + get_stack_params(starts, starts - 1) +
+        tables['loop'][lengths]
+    )
+    loop_energies = np.zeros((n, GUIDE_LENGTH + 1))
+    np.add.at(loop_energies, (loop_rows, ends + 1), loops)
+    energies += np.cumsum(loop_energies, axis=1)
+
+    # terminal basepairs: the first and the last basepair of the R-loop
+    last = np.maximum.accumulate(np.where(match, positions, -1), axis=1)
+    first = np.argmax(match, axis=1)[:, np.newaxis]
+    terminal = tables['terminal']
+    energies[:, 1:] += np.where(
+        last >= 0,
+        terminal[rg[rows, first]] + terminal[rg[rows, np.maximum(last, 0)]],
+        0.
+    )
+    return energies
+
+
+def get_mismatches(guide, targets):
+    """(N, 20) mismatch patterns of (N, 23) targets against the (23,)
+    protospacer codes of the guide, in R-loop order."""
+    return (targets[:, GUIDE_LENGTH - 1::-1] !=
+            guide[GUIDE_LENGTH - 1::-1])
+
+
+def get_hybridization_energies(guide, targets, weight=None):
+    """R-loop cost of each (N, 23) target for R-loop lengths 0-20, with
+    the optional weight of the DNA and RNA energies (see
+    crisprzip.nucleic_acid.get_hybridization_energy)."""
+    dna_energies = get_dna_opening_energies(targets)
+    rna_energies = get_rna_duplex_energies(guide, targets)
+    if weight is None:
+        return dna_energies + rna_energies
+    elif isinstance(weight, tuple):
+        return weight[0] * dna_energies + weight[1] * rna_energies
+    return weight * (dna_energies + rna_energies)
+
+
+def get_sequence_landscapes(protein, protospacer, targets):
+    """Stack the landscapes (including the PAM state) of a sequence-
+    specific Searcher with the guide of protospacer on the targets, like
+    the off_target_landscape of SearcherSequenceComplexes.
+
+    Parameters
+    ----------
+    protein : `BareSearcher` or `GuidedSearcher`
+        Searcher with the protein contributions to the landscape.
+    protospacer : `str`
+        On-target sequence (20 nts + PAM).
+    targets : `list` [`str`] or `numpy.ndarray`
+        Target sequences (20 nts + PAM), or their (N, 23) codes.
+
+    Returns
+    -------
+    landscapes : `numpy.ndarray`
+        (N, 21) array with the free energy of the PAM state (0) and the
+        20 R-loop states of each target.
+    """
+    guide = encode_sequences([protospacer])[0]
+    if not isinstance(targets, np.ndarray):
+        targets = encode_sequences(list(targets))
+    targets = targets.reshape(-1, guide.size)
+    landscapes = (
+        protein.on_target_landscape +
+        np.cumsum(get_mismatches(guide, targets) * protein.mismatch_penalties,
+                  axis=1) +
+        get_hybridization_energies(guide, targets, protein.weight)[:, 1:]
+    )
+    return np.pad(landscapes, ((0, 0), (1, 0)))
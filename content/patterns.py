@@ -0,0 +1,108 @@
+"""Memoized metrics of mismatch patterns for the sequence-average models.
+
+With the 'average_params' and 'average_params_legacy' parameter sets, the
+landscape of a target only depends on its mismatch pattern. Patterns are
+packed into integer keys (bit b set for a mismatch at R-loop position
+b+1) and their metrics are kept in a lookup table.
+"""
+
+from itertools import combinations
+from threading import Lock
+
+import numpy as np
+
+from .engine import score_landscapes
+from .sequences import encode_sequences, pack_sequences, get_mismatch_keys
+
+AVERAGE_PARAMETER_SETS = ('average_params', 'average_params_legacy')
+METRICS = ('p_clv', 'u_eff', 'k_clv', 'kd')
+
+
+def pack_patterns(patterns):
+    """Pack (..., N) boolean mismatch patterns into integer keys."""
+    patterns = np.asarray(patterns, dtype=np.int64)
+    return patterns @ (1 << np.arange(patterns.shape[-1], dtype=np.int64))
+
+
+def unpack_patterns(keys, guide_length=20):
+    """Unpack integer keys into (..., guide_length) boolean patterns."""
+    keys = np.asarray(keys, dtype=np.int64)[..., np.newaxis]
+    return (keys >> np.arange(guide_length)) & 1 == 1
+
+
+def enumerate_patterns(max_mismatches, guide_length=20):
+    """Keys of all patterns with at most ``max_mismatches`` mismatches."""
+    keys = [sum(1 << b for b in mm_pos)
+            for mm_num in range(max_mismatches + 1)
+            for mm_pos in combinations(range(guide_length), mm_num)]
+    return np.array(keys, dtype=np.int64)
+
+
+def get_pattern_keys(protospacer, targets):
+    """Find the packed mismatch pattern of each target sequence."""
+    packed = pack_sequences(encode_sequences([protospacer] + list(targets)))
+    return get_mismatch_keys(packed[0], packed[1:])
+
+
+def get_pattern_landscapes(protein, keys):
+    """Stack the landscapes (including the PAM state) of a Searcher on
+    the targets with mismatch patterns ``keys``."""
+    patterns = unpack_patterns(keys, protein.guide_length)
+    landscapes = (protein.on_target_landscape +
+                  np.cumsum(patterns * protein.mismatch_penalties, axis=-1))
+    return np.pad(landscapes, [(0, 0)] * (landscapes.ndim - 1) + [(1, 0)])
+
+
+class PatternTable:
+    """Lookup table with the metrics of mismatch patterns.
+
+    The table is precomputed for all patterns with up to
+    ``max_mismatches`` mismatches. Other patterns are scored when they
+    are first looked up and added to the table.
+
+    Parameters
+    ----------
+    protein : `Searcher`
+        Sequence-average Searcher, with the unbinding rate of the context.
+    k_on : `float`
+        PAM-binding rate at 1 nM of the context (in nM⁻¹ s⁻¹).
+    max_mismatches : `int`, optional
+        Number of mismatches up to which all patterns are precomputed.
+    """
+
+    def __init__(self, protein, k_on, max_mismatches=3):
+        self.protein = protein
+        self.k_on = k_on
+        self._lock = Lock()
+
+        self.keys = enumerate_patterns(max_mismatches, protein.guide_length)
+        self.keys.sort()
+        self.metrics = self._score(self.keys)
+
+    def _score(self, keys):
+        return score_landscapes(
+            get_pattern_landscapes(self.protein, keys),
+            self.protein.internal_rates,
+            self.k_on
+        )
+
+    def lookup(self, keys):
+        """Get the metrics of the patterns ``keys``, as a dictionary of
+        arrays with the same shape as ``keys``."""
+        keys = np.asarray(keys, dtype=np.int64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+        with self._lock:
+            missing = unique_keys[~np.isin(unique_keys, self.keys)]
+            if missing.size > 0:
+                new_metrics = self._score(missing)
+                order = np.argsort(np.concatenate((self.keys, missing)))
+                self.keys = np.concatenate((self.keys, missing))[order]
+                self.metrics = {
+                    m: np.concatenate((self.metrics[m], new_metrics[m]))[order]
+                    for m in METRICS
+                }
+            rows = np.searchsorted(self.keys, unique_keys)
+            return {m: self.metrics[m][rows][inverse].reshape(keys.shape)
+                    for m in METRICS}
+
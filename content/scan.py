@@ -0,0 +1,297 @@
+"""Mismatch scan: score all single- and double-mismatch variants of a target.
+
+The variants are scored in one batch: for sequence-average models as
+mismatch patterns in the shared PatternTable, and for the sequence model
+with the vectorized landscape builder of landscapes.py. The results are
+shown as position-resolved heatmaps of p_clv and the change in effective
+stability, ΔU_eff.
+"""
+
+from itertools import combinations, product
+
+import numpy as np
+import pandas as pd
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from nicegui import ui
+
+from .input import (run_scoring, load_protein, get_pattern_table,
+                    AVERAGE_PARAMETER_SETS)
+from .sequences import (NUCLEOTIDES, encode_sequences, decode_sequences,
+                        get_sequence_error, pack_sequences, get_mismatch_keys)
+from .engine import get_cleavage_probs, get_effective_stabs
+from .landscapes import get_sequence_landscapes, GUIDE_LENGTH
+
+
+def get_mismatch_variants(protospacer, mismatch_num):
+    """All variants of a protospacer with mismatch_num mismatches.
+
+    Returns the (N, 23) codes of the variants and the (N, mismatch_num)
+    R-loop positions of their mismatches (1 being next to the PAM).
+    """
+    guide = encode_sequences([protospacer])[0]
+    positions = np.array(list(combinations(range(1, GUIDE_LENGTH + 1),
+                                           mismatch_num)), dtype=int)
+    positions = positions.reshape(-1, mismatch_num)
+    shifts = np.array(list(product((1, 2, 3), repeat=mismatch_num)),
+                      dtype=np.uint8).reshape(-1, mismatch_num)
+    positions = np.repeat(positions, len(shifts), axis=0)
+    shifts = np.tile(shifts, (len(positions) // len(shifts), 1))
+
+    codes = np.tile(guide, (len(positions), 1))
+    rows = np.arange(len(positions))[:, np.newaxis]
+    indices = GUIDE_LENGTH - positions
+    codes[rows, indices] = (codes[rows, indices] + shifts) % 4
+    return codes, positions
+
+
+def score_mismatch_scan(protospacer, context, parameter_set):
+    """Score the on-target and all of its single- and double-mismatch
+    variants, as a data frame with their sequence, mismatch positions and
+    nucleotides, p_clv, u_eff and du_eff (the change from the on-target)."""
+    guide = encode_sequences([protospacer])
+    variants = [get_mismatch_variants(protospacer, k) for k in (1, 2)]
+    codes = np.concatenate([guide] + [v[0] for v in variants])
+
+    if parameter_set in AVERAGE_PARAMETER_SETS:
+        packed = pack_sequences(codes)
+        metrics = get_pattern_table(parameter_set, context).lookup(
+            get_mismatch_keys(packed[0], packed)
+        )
+        p_clv, u_eff = metrics['p_clv'], metrics['u_eff']
+    else:
+        protein = load_protein(parameter_set, context, protospacer)
+        landscapes = get_sequence_landscapes(protein, protospacer, codes)
+        p_clv = get_cleavage_probs(landscapes, protein.internal_rates)
+        u_eff = get_effective_stabs(landscapes)
+
+    positions = np.zeros((len(codes), 2), dtype=int)
+    positions[1:len(variants[0][1]) + 1, :1] = variants[0][1]
+    positions[len(variants[0][1]) + 1:] = variants[1][1]
+    rows = np.arange(len(codes))[:, np.newaxis]
+    nts = np.array(list(NUCLEOTIDES))[
+        codes[rows, GUIDE_LENGTH - np.maximum(positions, 1)]]
+    nts[positions == 0] = ''
+    return pd.DataFrame({
+        'sequence': decode_sequences(codes),
+        'mismatches': (positions > 0).sum(axis=1),
+        'position_1': positions[:, 0],
+        'nt_1': nts[:, 0],
+        'position_2': positions[:, 1],
+        'nt_2': nts[:, 1],
+        'p_clv': p_clv,
+        'u_eff': u_eff,
+        'du_eff': u_eff - u_eff[0],
+    })
+
+
+def get_scan_matrices(scan, metric):
+    """Position-resolved matrices of a metric: (4, 20) values of the
+    single-mismatch variants by target nucleotide and position (with the
+    on-target value at the on-target nucleotide), and the (20, 20) mean
+    over the nucleotides of the double-mismatch variants by position pair
+    (with the mean over single mismatches on the diagonal)."""
+    values = np.log10(scan[metric]) if metric == 'p_clv' else scan[metric]
+    guide = encode_sequences([scan['sequence'][0]])[0]
+
+    singles = np.empty((4, GUIDE_LENGTH))
+    singles[guide[GUIDE_LENGTH - 1::-1], np.arange(GUIDE_LENGTH)] = values[0]
+    single = scan['mismatches'] == 1
+    singles[[NUCLEOTIDES.index(nt) for nt in scan['nt_1'][single]],
+            scan['position_1'][single] - 1] = values[single]
+
+    doubles = np.zeros((GUIDE_LENGTH, GUIDE_LENGTH))
+    double = scan['mismatches'] == 2
+    means = (pd.DataFrame({'i': scan['position_1'][double] - 1,
+                           'j': scan['position_2'][double] - 1,
+                           'value': values[double]})
+             .groupby(['i', 'j'])['value'].mean())
+    i, j = (means.index.get_level_values(k).to_numpy() for k in (0, 1))
+    doubles[i, j] = doubles[j, i] = means.to_numpy()
+    single_means = pd.Series(values[single]).groupby(
+        scan['position_1'][single].to_numpy()).mean()
+    doubles[np.diag_indices(GUIDE_LENGTH)] = single_means.to_numpy()
+    return singles, doubles
+
+
+def show_scan_input():
+    fsz = 10   # font size (in pt)
+    fsi = 12   # font size for information bubble (in pt)
+    fsb = 10   # font size for text in the information bubble (in pt)
+
+    with ui.column().classes('w-[250px] p-0 gap-1'):
+        with ui.row(align_items='center').classes('p-0'):
+            ui.markdown('**Protospacer**').classes(
+                'p-0 leading-[0.7]').style(f'font-size: {fsz}pt')
+            with ui.icon('info').style(f'font-size: {fsi}pt'):
+                ui.tooltip(
+                    'On-target sequence (5\'-to-3\', 20 nts + PAM). All its '
+                    'variants with one or two mismatches are scored.'
+                ).style(f'font-size: {fsb}pt')
+        protospacer_input = ui.input(
+            placeholder='GACGCATAAAGATGAGACGCTGG',
+            validation=lambda x: get_sequence_error(x) if x else None,
+        ).props('dense').classes('w-full font-mono').style(f'font-size: {fsz}pt')
+        ui.element().classes("h-3")
+
+        ui.markdown('**Context**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        context_dropdown = ui.select(
+            options={'invitro': 'cell-free (in vitro)',
+                     'ecoli': 'E. coli',
+                     'mammal': 'mammal', },
+            value='invitro',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.markdown('**Landscape parameters**').classes('leading-[0]').style(
+            f'font-size: {fsz}pt')
+        model_dropdown = ui.select(
+            options={
+                'sequence_params': 'sequence (default)',
+                'average_params': 'average',
+                'average_params_legacy': 'average (legacy)'
+            },
+            value='sequence_params',
+        ).props('dense').classes('w-full p-0 m-0').style(f'font-size: {fsz}pt')
+        ui.element().classes("h-6")
+
+        submit_button = (
+            ui.button('Submit')
+            .props('icon=send')
+            .classes('w-full')
+            .style(f'font-size: {fsz}pt')
+        )
+
+    def get_input_values():
+        protospacer = (protospacer_input.value or '').strip().upper()
+        err_msg = get_sequence_error(protospacer)
+        if err_msg:
+            ui.notify(f"Protospacer error: {err_msg}", type='negative')
+            return
+        return {
+            'protospacer': protospacer,
+            'context': context_dropdown.value,
+            'parameter_set': model_dropdown.value,
+        }
+
+    return submit_button, get_input_values
+
+
+async def show_output(output_container, get_input_values: callable):
+
+    input_values = get_input_values()
+    if input_values is None:
+        return
+
+    output_container.clear()
+    with output_container:
+        with ui.row(align_items='center') as progress_row:
+            ui.spinner(size='lg')
+            ui.label("Scoring all single- and double-mismatch variants...")
+
+    try:
+        scan = await run_scoring(score_mismatch_scan, **input_values)
+    except Exception as e:
+        ui.notify(f'Error scoring mismatch variants: {str(e)}',
+                  type='negative')
+        return
+    finally:
+        replaced = progress_row.is_deleted
+        if not replaced:
+            progress_row.delete()
+    if scan is None or replaced:
+        return  # app is shutting down, or output was replaced
+
+    # VISUALIZATION
+    mpl.style.use('seaborn-v0_8')
+    dpi = plt.rcParams['figure.dpi']  # pixel in inches
+    positions = np.arange(1, GUIDE_LENGTH + 1)
+
+    with output_container:
+        with ui.matplotlib(figsize=(900 / dpi, 640 / dpi)).classes(
+                'w-[900px] h-[640px]').figure as fig:
+            fig.set_layout_engine('constrained')
+            axs = fig.subplots(2, 2, height_ratios=[1, 3])
+            for k, (metric, label, cmap) in enumerate([
+                    ('p_clv', r"log$_{10}$ $p_{clv}$", 'viridis'),
+                    ('du_eff', r"$\Delta U_{eff}$ ($k_BT$)", 'magma')]):
+                singles, doubles = get_scan_matrices(scan, metric)
+                vmin = min(singles.min(), doubles.min())
+                vmax = max(singles.max(), doubles.max())
+
+                ax = axs[0, k]
+                ax.imshow(singles, aspect='auto', cmap=cmap, vmin=vmin,
+                          vmax=vmax, extent=(.5, GUIDE_LENGTH + .5, 3.5, -.5))
+                ax.set_yticks(range(4), list(NUCLEOTIDES))
+                ax.set_xticks(positions[::2])
+                ax.grid(False)
+                ax.set_title(f"single mismatches: {label}")
+
+                ax = axs[1, k]
+                image = ax.imshow(doubles, cmap=cmap, vmin=vmin, vmax=vmax,
+                                  extent=(.5, GUIDE_LENGTH + .5,
+                                          GUIDE_LENGTH + .5, .5))
+                ax.set_xticks(positions[::2])
+                ax.set_yticks(positions[::2])
+                ax.grid(False)
+                ax.set_xlabel('mismatch position (from PAM)')
+                ax.set_title('double mismatches (mean)')
+                fig.colorbar(image, ax=axs[:, k], label=label, shrink=.8)
+            axs[0, 0].set_ylabel('target nt')
+            axs[1, 0].set_ylabel('mismatch position (from PAM)')
+
+        # Table
+        ui.add_head_html('''
+        <style>
+            .ag-cell.monospace-column {
+                font-family: monospace !important;
+                font-size: 13px;
+            }
+        </style>
+        ''')
+        sci_format = 'params => params.value.toExponential(2)'
+        fixed_format = 'params => params.value.toFixed(2)'
+        column_defs = [
+            {'headerName': 'sequence', 'field': 'sequence', 'width': 220,
+             'cellClass': 'monospace-column'},
+            {'headerName': 'mismatches', 'field': 'mismatches', 'width': 100},
+            {'headerName': 'position 1', 'field': 'position_1', 'width': 90},
+            {'headerName': 'nt 1', 'field': 'nt_1', 'width': 60},
+            {'headerName': 'position 2', 'field': 'position_2', 'width': 90},
+            {'headerName': 'nt 2', 'field': 'nt_2', 'width': 60},
+            {'headerName': 'p_clv', 'field': 'p_clv', 'width': 90,
+             ':valueFormatter': sci_format},
+            {'headerName': 'u_eff (kT)', 'field': 'u_eff', 'width': 90,
+             ':valueFormatter': fixed_format},
+            {'headerName': 'Δu_eff (kT)', 'field': 'du_eff', 'width': 90,
+             ':valueFormatter': fixed_format},
+        ]
+        ui.aggrid({
+            'columnDefs': [dict(cd, suppressMovable=True, sortable=True,
+                                resizable=False) for cd in column_defs],
+            'rowData': scan.to_dict('records'),
+        }).classes('w-[900px] h-[400px]')
+
+        with ui.row(align_items='center'):
+            ui.label(f"{len(scan) - 1} variants; mismatch positions are "
+                     f"counted from the PAM.")
+            download_button = ui.button().props('icon=download no-caps outline').classes('w-[1em] h-[1em]')
+
+    def download_grid():
+        ui.download.content(scan.to_csv(index=False),
+                            'crisprzip_mismatch_scan.csv')
+
+    download_button.on_click(download_grid)
+
+
+def show_contents():
+    with ui.row().classes('w-full h-full no-wrap'):
+
+        # INPUT
+        with ui.card().classes('p-4 m-2'):
+            submit_button, get_input_values = show_scan_input()
+
+        # OUTPUT
+        output_container = ui.column().classes('w-full h-full no-wrap m-2')
+        submit_button.on_click(
+            lambda: show_output(output_container, get_input_values)
+        )
@@ -0,0 +1,218 @@
+"""Models and scoring functions of the tool, without UI imports.
+
+The searchers of the parameter sets (with the rates of the application
+context), their SearcherTargetComplexes and the functions that score
+the on-target and off-targets on each metric are shared by the GUI
+(input.py, the cleavage and binding tabs), the scoring API and the
+command-line entry point, which does not load the GUI stack.
+"""
+
+import os
+from copy import copy
+from functools import lru_cache
+
+from crisprzip.kinetics import load_landscape
+from crisprzip.nucleic_acid import MismatchPattern
+
+from .patterns import (AVERAGE_PARAMETER_SETS, PatternTable,
+                       get_pattern_keys, unpack_patterns)
+from .engine import (get_landscape_matrix, get_cleavage_probs,
+                     get_cleavage_rates, get_effective_stabs,
+                     get_binding_consts)
+from .landscapes import get_sequence_landscapes
+
+chunk_size = 250  # number of off-targets that is scored at once
+# number of scoring processes (0: score on a thread of the main process);
+# by default at most 4, leaving a core for the GUI
+workers = int(os.environ.get('CRISPRZIP_WORKERS',
+                             min(4, (os.cpu_count() or 1) - 1)))
+
+
+def get_k_on_off(context):
+    if context == 'invitro':
+        k_on = 0.1
+        k_off = 1.0
+    elif context == 'ecoli':
+        # E. coli volume:      1 µm³ = 1 fL
+        # no. of PAMs:         1E6 (500k / genome, 2 genomes)
+        # PAM-binding rate:   60 s⁻¹
+        # PAM-unbinding rate: 40 s⁻¹
+        k_on = 6.02E23 * 1E-9 * 1E-15 / 1E6 / (1 / 60 + 1 / 40)
+        k_off = 40
+    elif context == 'mammal':
+        # mammal nuclear volume: 500 µm³ = 500 fL
+        # no. of PAMs:          13E6 (320 mln / genome, 2 genomes, 2% available)
+        # PAM-binding rate:     1.33 s⁻¹
+        # PAM-unbinding rate:     40 s⁻¹
+        k_on = 6.02E23 * 1E-9 * 500E-15 / 13E6 / (1 / 1.33 + 1 / 40)
+        k_off = 40
+    else:
+        raise ValueError(f"Unknown context '{context}'")
+    return k_on, k_off
+
+
+@lru_cache(maxsize=8)
+def _load_landscape(parameter_set):
+    return load_landscape(parameter_set)
+
+
+@lru_cache(maxsize=64)
+def load_protein(parameter_set, context, protospacer=None):
+    """Load a Searcher with the unbinding rate of the context, bound to
+    the guide RNA of the protospacer for sequence-specific parameters.
+
+    Results are cached per (parameter_set, context, protospacer); see
+    load_protein.cache_info() for hits and misses. Cached objects are
+    shared between calls and should not be modified.
+    """
+    k_on, k_off = get_k_on_off(context)
+    protein = copy(_load_landscape(parameter_set))
+    protein.internal_rates = dict(protein.internal_rates, k_off=k_off)
+    if protospacer is not None:
+        protein = protein.bind_guide_rna(protospacer=protospacer)
+    return protein
+
+
+@lru_cache(maxsize=16)
+def get_pattern_table(parameter_set, context):
+    """Shared PatternTable of a sequence-average parameter set."""
+    if parameter_set not in AVERAGE_PARAMETER_SETS:
+        raise ValueError(f"Parameter set '{parameter_set}' is not "
+                         f"sequence-average.")
+    k_on, k_off = get_k_on_off(context)
+    return PatternTable(load_protein(parameter_set, context), k_on)
+
+
+def get_pattern_metrics(protospacer, off_targets, context, parameter_set):
+    """Look up the metrics of all targets of a sequence-average model
+    in the PatternTable, without forming SearcherTargetComplexes."""
+    targets = [protospacer] + off_targets
+    return (get_pattern_table(parameter_set, context)
+            .lookup(get_pattern_keys(protospacer, targets)))
+
+
+def make_stc_list(protospacer, off_targets, context, parameter_set):
+    """Generate SearcherTargetComplexes."""
+
+    if parameter_set == 'sequence_params':
+        guided_protein = load_protein(parameter_set, context, protospacer)
+
+        targets = [protospacer] + off_targets
+        protein_sequence_complexes = [guided_protein.probe_sequence(target_seq)
+                                      for target_seq in targets]
+        return protein_sequence_complexes
+
+    elif parameter_set in AVERAGE_PARAMETER_SETS:
+        protein = load_protein(parameter_set, context)
+
+        # targets with the same mismatch pattern share their complex
+        targets = [protospacer] + off_targets
+        pattern_complexes = {}
+        protein_sequence_complexes = []
+        for key in get_pattern_keys(protospacer, targets):
+            if key not in pattern_complexes:
+                pattern_complexes[key] = protein.probe_target(
+                    MismatchPattern(unpack_patterns(key, protein.guide_length))
+                )
+            protein_sequence_complexes += [pattern_complexes[key]]
+        return protein_sequence_complexes
+    else:
+        raise ValueError(f"Unrecognized parameter set '{parameter_set}'.")
+
+
+def _init_worker():
+    """Preload the landscapes of all parameter sets in a worker process."""
+    for parameter_set in ('sequence_params',) + AVERAGE_PARAMETER_SETS:
+        _load_landscape(parameter_set)
+
+
+def get_all_cleavage_probs(protospacer, off_targets,
+                           context, parameter_set,
+                           protein_sequence_complexes=None):
+    """Cleavage probabilities of the on-target and off-targets, evaluated
+    on their stacked landscapes at once. Without complexes, the
+    landscapes of sequence-specific models are built in batch (see
+    landscapes.py)."""
+    if (protein_sequence_complexes is None and
+            parameter_set in AVERAGE_PARAMETER_SETS):
+        return get_pattern_metrics(
+            protospacer, off_targets, context, parameter_set
+        )['p_clv']
+    if protein_sequence_complexes is None:
+        protein = load_protein(parameter_set, context, protospacer)
+        landscapes = get_sequence_landscapes(
+            protein,
+            protospacer,
+            [protospacer] + list(off_targets),
+        )
+        internal_rates = protein.internal_rates
+    else:
+        landscapes = get_landscape_matrix(protein_sequence_complexes)
+        internal_rates = protein_sequence_complexes[0].internal_rates
+    p_clv_values = get_cleavage_probs(landscapes, internal_rates)
+    return p_clv_values
+
+
+def get_all_cleavage_rates(protospacer, off_targets,
+                           context, parameter_set,
+                           protein_sequence_complexes=None):
+    if protein_sequence_complexes is None:
+        protein_sequence_complexes = make_stc_list(
+            protospacer=protospacer,
+            off_targets=off_targets,
+            context=context,
+            parameter_set=parameter_set,
+        )
+    k_on_ref = 1E-2
+    concentration = 100
+    binding_rate = k_on_ref * concentration
+
+    k_fit_values = get_cleavage_rates(
+        get_landscape_matrix(protein_sequence_complexes),
+        protein_sequence_complexes[0].internal_rates,
+        binding_rate,
+    )
+    return k_fit_values
+
+
+def get_all_effective_stabs(protospacer, off_targets,
+                            context, parameter_set,
+                            protein_sequence_complexes=None):
+    """Effective stabilities of the on-target and off-targets, evaluated
+    on their stacked landscapes at once. Without complexes, the
+    landscapes of sequence-specific models are built in batch (see
+    landscapes.py)."""
+    if (protein_sequence_complexes is None and
+            parameter_set in AVERAGE_PARAMETER_SETS):
+        return get_pattern_metrics(
+            protospacer, off_targets, context, parameter_set
+        )['u_eff']
+    if protein_sequence_complexes is None:
+        landscapes = get_sequence_landscapes(
+            load_protein(parameter_set, context, protospacer),
+            protospacer,
+            [protospacer] + list(off_targets),
+        )
+    else:
+        landscapes = get_landscape_matrix(protein_sequence_complexes)
+    u_eff_values = get_effective_stabs(landscapes)
+    return u_eff_values
+
+
+def get_all_binding_const(protospacer, off_targets,
+                          context, parameter_set,
+                          protein_sequence_complexes=None):
+    if protein_sequence_complexes is None:
+        protein_sequence_complexes = make_stc_list(
+            protospacer=protospacer,
+            off_targets=off_targets,
+            context=context,
+            parameter_set=parameter_set,
+        )
+    k_on, k_off = get_k_on_off(context)
+    k_fit_values = get_binding_consts(
+        get_landscape_matrix(protein_sequence_complexes),
+        protein_sequence_complexes[0].internal_rates,
+        k_on,
+    )
+    return k_fit_values
@@ -0,0 +1,219 @@
+"""Single-pass parsing, validation and encoding of target sequences.
+
+Sequences are separated by commas and/or whitespace. The text is
+tokenized and checked for its alphabet, length and PAM in one vectorized
+pass over its bytes, and the valid sequences are returned as an array of
+nucleotide codes (A, C, G, T = 0, 1, 2, 3). The same parser is used for
+the off-target textarea, file uploads, the command line and the API.
+
+Codes can be packed into 64-bit integers with 2 bits per nucleotide. In
+a packed sequence, the nucleotide at R-loop position b (counted from the
+PAM) occupies bits 2(b-1) and 2b-1, and the PAM is stored above the
+protospacer. Mismatch patterns against the guide then follow from an XOR
+of packed sequences, in the same integer format as in patterns.py.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+NUCLEOTIDES = 'ACGT'
+SEPARATORS = b', \t\r\n'
+
+_SEPARATOR = 254
+_INVALID = 255
+
+
+class ParsedSequences(NamedTuple):
+    codes: np.ndarray  # (N, length) uint8 codes, zero for invalid sequences
+    errors: list  # (index, position, message) of each invalid sequence
+
+
+def _get_lookup_table(alphabet):
+    lut = np.full(256, _INVALID, dtype=np.uint8)
+    for code, nt in enumerate(alphabet):
+        lut[ord(nt)] = lut[ord(nt.lower())] = code
+    lut[np.frombuffer(SEPARATORS, dtype=np.uint8)] = _SEPARATOR
+    return lut
+
+
+_lookup_tables = {}
+
+
+def parse_sequences(text, length=23, alphabet=NUCLEOTIDES, pam='GG'):
+    """Tokenize and validate all sequences in text.
+
+    Parameters
+    ----------
+    text : `str` or `bytes`
+        Sequences, separated by commas and/or whitespace.
+    length : `int`, optional
+        Required sequence length (including the PAM).
+    alphabet : `str`, optional
+        Allowed nucleotides (case-insensitive), in the order of their codes.
+    pam : `str` or `None`, optional
+        Required 3'-end of each sequence (default: 'GG', for NGG PAMs).
+
+    Returns
+    -------
+    parsed : `ParsedSequences`
+        The codes of all sequences, and the index, position (offset of
+        the offending character in text) and message of each error.
+    """
+    if isinstance(text, str):
+        # one byte per character, so that positions are character offsets
+        text = text.encode('latin-1', errors='replace')
+    if alphabet not in _lookup_tables:
+        _lookup_tables[alphabet] = _get_lookup_table(alphabet)
+    symbols = _lookup_tables[alphabet][np.frombuffer(text, dtype=np.uint8)]
+
+    # token boundaries
+    in_token = np.concatenate([[False], symbols != _SEPARATOR, [False]])
+    edges = np.flatnonzero(in_token[1:] != in_token[:-1])
+    starts, ends = edges[::2], edges[1::2]
+    lengths = ends - starts
+
+    # first invalid character of each token
+    invalid_positions = np.flatnonzero(symbols == _INVALID)
+    invalid_tokens = np.searchsorted(starts, invalid_positions,
+                                     side='right') - 1
+    invalid_tokens, first = np.unique(invalid_tokens, return_index=True)
+    first_invalid = np.full(len(starts), -1)
+    first_invalid[invalid_tokens] = invalid_positions[first]
+
+    valid = (first_invalid == -1) & (lengths == length)
+    codes = np.zeros((len(starts), length), dtype=np.uint8)
+    codes[valid] = symbols[starts[valid, np.newaxis] + np.arange(length)]
+
+    wrong_pam = np.zeros(len(starts), dtype=bool)
+    if pam:
+        pam_codes = np.array([alphabet.index(nt) for nt in pam],
+                             dtype=np.uint8)
+        wrong_pam[valid] = np.any(codes[valid, -len(pam):] != pam_codes,
+                                  axis=1)
+        codes[wrong_pam] = 0
+
+    errors = []
+    for i in np.flatnonzero(~valid | wrong_pam).tolist():
+        start, size = int(starts[i]), int(lengths[i])
+        if first_invalid[i] != -1:
+            errors.append((i, int(first_invalid[i]),
+                           f"Only {alphabet} nucleotides"))
+        elif size < length:
+            errors.append((i, start, f"Too short: {size}/{length}"))
+        elif size > length:
+            errors.append((i, start, f"Too long: {size}/{length}"))
+        else:
+            errors.append((i, start + size - len(pam),
+                           f"Only canonical PAMs 'N{pam}'"))
+    return ParsedSequences(codes, errors)
+
+
+def get_sequence_error(seq, length=23, alphabet=NUCLEOTIDES, pam='GG'):
+    """Describe why seq is not a single valid sequence (None if it is)."""
+    codes, errors = parse_sequences(seq, length, alphabet, pam)
+    if errors:
+        return errors[0][2]
+    if len(codes) == 0:
+        return f"Too short: 0/{length}"
+    if len(codes) > 1:
+        return f"Too long: {len(seq.strip())}/{length}"
+
+
+def encode_sequences(sequences, alphabet=NUCLEOTIDES):
+    """Convert a list of equal-length sequences to an (N, length) array
+    of codes. Other characters (such as the N of an 'NGG' PAM) are
+    encoded as 0."""
+    if alphabet not in _lookup_tables:
+        _lookup_tables[alphabet] = _get_lookup_table(alphabet)
+    length = len(sequences[0]) if len(sequences) else 0
+    symbols = _lookup_tables[alphabet][np.frombuffer(
+        ''.join(sequences).encode('latin-1', errors='replace'),
+        dtype=np.uint8
+    )].reshape(len(sequences), length)
+    return np.where(symbols < len(alphabet), symbols, 0).astype(np.uint8)
+
+
+def decode_sequences(codes, alphabet=NUCLEOTIDES):
+    """Convert an (N, length) array of codes to a list of strings."""
+    codes = np.asarray(codes, dtype=np.uint8)
+    letters = np.frombuffer(alphabet.encode(), dtype=np.uint8)[codes]
+    return [seq.decode() for seq in
+            letters.view(f'S{codes.shape[-1]}').ravel()]
+
+
+def get_line_number(text, position):
+    """Line number (starting at 1) of a position in text."""
+    return text.count('\n', 0, position) + 1
+
+
+def find_sequence_error(sequences, length=23, alphabet=NUCLEOTIDES,
+                        pam='GG'):
+    """Index and description of the first invalid sequence in a list
+    (None if all sequences are valid)."""
+    codes, errors = parse_sequences('\n'.join(sequences), length,
+                                    alphabet, pam)
+    if len(codes) == len(sequences):
+        return errors[0][::2] if errors else None
+    # some items are empty or contain separators
+    for i, seq in enumerate(sequences):
+        err_msg = get_sequence_error(seq, length, alphabet, pam)
+        if err_msg:
+            return i, err_msg
+
+
+def _get_shifts(length, guide_length):
+    # R-loop position - 1 of each nucleotide, then the PAM
+    positions = np.concatenate([np.arange(guide_length)[::-1],
+                                np.arange(guide_length, length)])
+    return (2 * positions).astype(np.uint64)
+
+
+def pack_sequences(codes, guide_length=20):
+    """Pack (..., length) codes into uint64 integers, 2 bits per
+    nucleotide (length <= 32)."""
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = _get_shifts(codes.shape[-1], guide_length)
+    return np.bitwise_or.reduce(codes << shifts, axis=-1)
+
+
+def unpack_sequences(packed, length=23, guide_length=20):
+    """Unpack uint64 integers into (..., length) codes."""
+    packed = np.asarray(packed, dtype=np.uint64)[..., np.newaxis]
+    shifts = _get_shifts(length, guide_length)
+    return ((packed >> shifts) & np.uint64(3)).astype(np.uint8)
+
+
+_EVEN_BITS = np.uint64(0x5555555555555555)
+# shifts and masks that gather every other bit into the lower 32 bits
+_COMPRESS_STEPS = [(np.uint64(shift), np.uint64(mask)) for shift, mask in [
+    (1, 0x3333333333333333),
+    (2, 0x0F0F0F0F0F0F0F0F),
+    (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF),
+    (16, 0x00000000FFFFFFFF),
+]]
+
+
+def get_mismatch_keys(guide, targets, guide_length=20):
+    """Find the mismatch patterns of packed target sequences against a
+    packed protospacer, as integer keys (bit b set for a mismatch at
+    R-loop position b+1; see patterns.pack_patterns)."""
+    diff = np.bitwise_xor(np.asarray(targets, dtype=np.uint64),
+                          np.uint64(guide))
+    # one bit per differing nucleotide, then keep every other bit
+    keys = (diff | (diff >> np.uint64(1))) & _EVEN_BITS
+    for shift, mask in _COMPRESS_STEPS:
+        keys = (keys | (keys >> shift)) & mask
+    return (keys & np.uint64((1 << guide_length) - 1)).astype(np.int64)
+
+
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)],
+                        dtype=np.int64)
+
+
+def count_mismatches(keys):
+    """Number of mismatches in each integer mismatch pattern (popcount)."""
+    keys = np.ascontiguousarray(keys, dtype=np.int64)
+    return _BYTE_COUNTS[keys.view(np.uint8)].reshape(
+        keys.shape + (8,)).sum(axis=-1)
@@ -5,88 +5,135 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 from crisprzip.kinetics import *
-from .input import show_input, get_k_on_off, make_stc_list
+from .input import (show_input, get_k_on_off, make_stc_list,
+                    score_in_chunks, suspend_grid_updates)
+from .scoring import get_all_effective_stabs, get_all_binding_const
+from .engine import (get_landscape_matrix, get_binding_consts,
+                     get_bound_fractions, get_bound_fraction_sweep,
+                     get_effective_stabs)
 
 
 def get_effective_stab(stc):
-    landscape = stc.off_target_landscape
-    boltzmann = np.exp(-landscape)
-    eff_stab  = np.sum(landscape * boltzmann) / np.sum(boltzmann)
-    return eff_stab
-
-
-def get_all_effective_stabs(protospacer, off_targets,
-                            context, parameter_set):
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    u_eff_values = [get_effective_stab(stc) for stc in
-                    protein_sequence_complexes]
-    return u_eff_values
-
-
-def get_binding_const(stc, k_on_ref):
-    """Calculate cleavage rate."""
+    return get_effective_stabs(get_landscape_matrix([stc]))[0]
+
+
+def get_binding_const(stc, k_on_ref, mode='analytic'):
+    """Calculate the (apparent) dissociation constant after 1 hr.
+
+    If mode is 'analytic' (default), the constant follows from the
+    partition function of the bound states, or from the finite-time
+    bound fraction for targets that do not equilibrate within an hour.
+    If mode is 'fit', a binding isotherm is fitted to the bound fraction
+    over concentrations, which can be used to validate the former.
+    """
+    if mode == 'analytic':
+        return float(get_binding_consts(
+            get_landscape_matrix([stc])[0],
+            stc.internal_rates,
+            k_on_ref,
+        ))
+    elif mode != 'fit':
+        raise ValueError(f"Unrecognized mode '{mode}'.")
+
     dc = np.logspace(-2, 6)
-    f_bnd = stc.get_bound_fraction(time=3600., binding_rate=dc * k_on_ref)
+    f_bnd = stc.get_bound_fraction(time=3600., on_rate=dc * k_on_ref)
     with np.errstate(over='ignore'):  # ignore RuntimeWarning: overflow
         kd = np.exp(curve_fit(
             f=lambda c, logkd: c / (np.exp(logkd) + c),
             xdata=dc,
             ydata=f_bnd,
         )[0][0])
-    return kd
+    return float(kd)
 
 
-def get_all_binding_const(protospacer, off_targets,
-                          context, parameter_set):
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    k_on, k_off = get_k_on_off(context)
-    k_fit_values = [
-        get_binding_const(stc, k_on) for
-        stc in protein_sequence_complexes
-    ]
-    return k_fit_values
+async def show_output(output_container, get_input_values: callable,
+                      session: dict):
+    input_values = get_input_values()
+    if input_values is None:
+        return
+    protospacer, off_targets, context, parameter_set = input_values.values()
+
+    # Values from earlier submits in this session are kept by sequence,
+    # so that only added or changed targets are scored.
+    output_key = (protospacer, context, parameter_set)
+    known_values = session['results'].setdefault(output_key, {})
+    new_targets = [seq for seq in dict.fromkeys(off_targets)
+                   if seq not in known_values]
+    scoring_targets = [protospacer] + new_targets
+    if not new_targets and protospacer in known_values:
+        scoring_targets = []
 
+    targets = [protospacer] + off_targets
 
-def show_output(output_container, get_input_values: callable):
-    protospacer, off_targets, context, parameter_set = get_input_values().values()
+    def get_values():
+        return np.array([known_values.get(seq, np.nan) for seq in targets])
 
-    if len(off_targets) > 250:
-        ui.notify(
-            f"Can't process {len(off_targets)} off-targets at once! (max. 250)",
-            type='warning')
-        return
+    values = get_values()
 
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    effective_stabs = get_all_effective_stabs(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-
-    targets = [protospacer] + off_targets
-    values = effective_stabs
-    indices = np.arange(len(targets))
+    # The output of the same guide and model is updated in place.
+    update_output = session.get('update_output')
+    in_place = (update_output is not None and
+                session.get('output_key') == output_key)
 
     # VISUALIZATION
     mpl.style.use('seaborn-v0_8')
 
-    output_container.clear()
+    if not in_place:
+        session['update_output'] = None
+        output_container.clear()
+    with output_container:
+        with ui.row(align_items='center').classes('w-full') as progress_row:
+            progress_bar = ui.linear_progress(
+                value=0, show_value=False).classes('w-[380px]')
+            progress_label = ui.label(f"0/{len(scoring_targets)}")
+            cancel_button = ui.button('cancel').props('outline no-caps')
+        progress_row.move(target_index=0)
+
+    # SCORING
+    cancelled = False
+
+    def cancel_scoring():
+        nonlocal cancelled
+        cancelled = True
+
+    cancel_button.on_click(cancel_scoring)
+
+    async def score_new_targets(on_chunk_scored=None):
+        """Score the targets that are not in the session index yet.
+        Returns whether all of them were scored."""
+        scored = 0
+        if not scoring_targets:
+            return True
+        async for chunk_values in score_in_chunks(
+                get_all_effective_stabs, protospacer, new_targets,
+                context, parameter_set, metric='u_eff'):
+            if progress_row.is_deleted:  # output replaced by a new submit
+                return False
+            known_values.update(zip(
+                scoring_targets[scored:scored + len(chunk_values)],
+                chunk_values
+            ))
+            scored += len(chunk_values)
+            progress_bar.set_value(scored / len(scoring_targets))
+            progress_label.set_text(f"{scored}/{len(scoring_targets)}")
+            if on_chunk_scored is not None:
+                on_chunk_scored()
+            if cancelled:
+                break
+        return scored == len(scoring_targets)
+
+    if in_place:
+        complete = await score_new_targets()
+        if progress_row.is_deleted:
+            return
+        progress_row.delete()
+        if not complete:
+            ui.notify("Scoring cancelled, the output was not updated.",
+                      type='warning')
+            return
+        await update_output(targets, get_values())
+        return
+
     with output_container:
         with ui.column(align_items='center').classes('w-full'):
             plot_row = ui.row(align_items='start').classes('gap-0')
@@ -118,46 +165,57 @@ def show_output(output_container, get_input_values: callable):
                     {'headerName': 'sequence', 'field': 'sequence',
                      'width': '220', 'cellClass': 'monospace-column'},
                     {'headerName': 'ΔU (kBT)', 'field': 'u_eff',
-                     'width': '90'}
+                     'width': '90'},
+                    # numeric u_eff, for sorting
+                    {'field': 'value', 'hide': True},
                 ]]
 
             grid = ui.aggrid({
                 'columnDefs': column_defs,
-                'rowData': [{'index': i, 'sequence': targets[i],
-                             'u_eff': f"{values[i]:.2f}"}
-                            for i in range(len(targets))],
-                'rowSelection': 'multiple'
+                'rowData': [],  # filled while scoring
+                'rowSelection': 'multiple',
+                ':getRowId': 'params => String(params.data.index)',
             }, html_columns=[3], auto_size_columns=True)
 
+            def make_row(i):
+                return {'index': i, 'sequence': targets[i],
+                        'u_eff': f"{values[i]:.2f}",
+                        'value': float(values[i])}
+
+            def update_rows():
+                """Apply the rows of the current targets to the grid as a
+                transaction of the changed rows only, which keeps its
+                scroll position, selection and sort."""
+                old_rows = {row['index']: row for row in grid.options['rowData']}
+                rows = [make_row(i) for i in range(len(targets))]
+                with suspend_grid_updates(grid):
+                    grid.options['rowData'] = rows
+                grid.run_grid_method('applyTransaction', {
+                    'add': [row for row in rows if row['index'] not in old_rows],
+                    'update': [row for row in rows if row['index'] in old_rows
+                               and row != old_rows[row['index']]],
+                    'remove': [row for i, row in old_rows.items()
+                               if i >= len(targets)],
+                })
+
+            def sort_grid(sort):
+                # the rows are in index order, unless sorted on their value
+                with suspend_grid_updates(grid):
+                    grid.options['columnDefs'][-1]['sort'] = sort
+                grid.run_grid_method('applyColumnState', {
+                    'state': [{'colId': 'value', 'sort': sort}]
+                })
+
             async def get_selected_ids():
                 selection = await grid.get_selected_rows()
                 selected_ids = [r['index'] for r in selection]
                 return sorted(selected_ids)
 
             async def sort_grid_ueff():
-                nonlocal grid
-                selected_ids = await get_selected_ids()
-                grid.options['rowData'] = [
-                    {'index': i, 'sequence': targets[i],
-                     'u_eff': f"{values[i]:.2f}"}
-                    for i in np.argsort(values)
-                ]
-                for i in range(len(values)):
-                    if np.argsort(values)[::-1][i] in selected_ids:
-                        grid.run_row_method(i, 'setSelected', True)
-                grid.update()
+                sort_grid('asc')
 
             async def sort_grid_index():
-                nonlocal grid
-                selected_ids = await get_selected_ids()
-                grid.options['rowData'] = [
-                    {'index': i, 'sequence': targets[i],
-                     'u_eff': f"{values[i]:.2f}"}
-                    for i in range(len(targets))
-                ]
-                for i in selected_ids:
-                    grid.run_row_method(i, 'setSelected', True)
-                grid.update()
+                sort_grid(None)
 
             with ui.row(align_items='center').classes('w-full'):
                 show_button = ui.button("SHOW").classes('w-[100px]')
@@ -177,97 +235,129 @@ def show_output(output_container, get_input_values: callable):
         ui.element().classes('w-[15px]')
 
         # Plot
-        with ui.column(align_items='center').classes('gap-0 p-0'):
-            dpi = plt.rcParams['figure.dpi']  # pixel in inches
-
-            # title
-            with ui.matplotlib(figsize=(365 / dpi, 25 / dpi)).classes(
-                    'w-[365px] h-[25px]').figure as tfig:
-                t_ax = tfig.gca()
-                t_ax.text(.5, .5, r"effective stability $-\Delta U_{eff}$ ($k_BT$)",
-                          va='center', ha='center', fontsize='large')
-                t_ax.set_axis_off()
-
-            with ui.row().classes('gap-0 p-0'):
-
-                # y axis
-                fig0 = ui.matplotlib(figsize=(40 / dpi, 250 / dpi)).classes(
-                    'w-[40px] h-[250px]').figure
-
-                ui.add_css('''
-                    .nicegui-scroll-area .q-scrollarea__content {
-                        padding: 0;
-                    }
-                    ''')
-
-                # plot contents
-                plotwidth = max(325, 25 * len(targets))
-                with ui.scroll_area().classes(f'w-[325px] h-[250px]'):
-                    with ui.matplotlib(
-                            figsize=(plotwidth / dpi, 250 / dpi)).classes(
-                            f'w-[{plotwidth}px] h-[250px]').figure as fig:
-                        ax = fig.gca()
-                        ax.bar(indices, 20 - np.array(values),
-                               bottom=-20, width=.8, align='center',
-                               color="#5898d4", alpha=.8)
-                        ax.set_ylim(
-                            -max(values) - .2 * (max(values) - min(values)),
-                            -min(values) + .2 * (max(values) - min(values)),
-                        )
-                        ax.set_facecolor('#ECF0F1')
-                        ax.grid(axis='x')
-                        ax.set_xticks(indices)
-                        x_margin = (min(15,
-                                        len(targets)) - 1) / 15  # margin of 0-1
-                        ax.set_xlim(-.5 - x_margin,
-                                    indices[-1] + .5 + x_margin)
-                        ax.get_yaxis().set_ticklabels([])
-                        fig.subplots_adjust(left=0., right=1., bottom=.15,
-                                            top=.95)
-
-                with fig0:
-                    ax0 = fig0.gca()
-                    ax0.set_facecolor('None')
-                    ax0.set_yticks(ax.get_yticks())
-                    ax0.set_ylim(*ax.get_ylim())
-                    ax0.get_xaxis().set_visible(False)
-                    fig0.subplots_adjust(left=.99, right=1., bottom=.15,
-                                         top=.95)
-
-            async def grid_selection_handler():
-                selected_ids = await get_selected_ids()
-                if not selected_ids and showing_selection:
-                    show_button.set_text("clear")
+        plot_column = ui.column(align_items='center').classes('gap-0 p-0')
+
+    # rows are shown as soon as all preceding targets are scored
+    shown = 0
+
+    def show_scored_rows():
+        nonlocal values, shown
+        values = get_values()
+        unscored = np.flatnonzero(np.isnan(values))
+        ready = unscored[0] if unscored.size else len(targets)
+        if ready > shown:
+            grid.options['rowData'] += [make_row(i) for i in range(shown, ready)]
+            grid.update()
+            shown = ready
+
+    show_scored_rows()
+    await score_new_targets(show_scored_rows)
+    if progress_row.is_deleted:
+        return
+
+    progress_row.delete()
+    if shown < len(targets):
+        ui.notify(
+            f"Scoring cancelled after {shown} of {len(targets)} targets.",
+            type='warning')
+        targets = targets[:shown]
+        values = values[:shown]
+    indices = np.arange(len(targets))
+
+    with plot_column:
+        dpi = plt.rcParams['figure.dpi']  # pixel in inches
+
+        # title
+        with ui.matplotlib(figsize=(365 / dpi, 25 / dpi)).classes(
+                'w-[365px] h-[25px]').figure as tfig:
+            t_ax = tfig.gca()
+            t_ax.text(.5, .5, r"effective stability $-\Delta U_{eff}$ ($k_BT$)",
+                      va='center', ha='center', fontsize='large')
+            t_ax.set_axis_off()
+
+        with ui.row().classes('gap-0 p-0'):
+
+            # y axis
+            fig0 = ui.matplotlib(figsize=(40 / dpi, 250 / dpi)).classes(
+                'w-[40px] h-[250px]').figure
+
+            ui.add_css('''
+                .nicegui-scroll-area .q-scrollarea__content {
+                    padding: 0;
+                }
+                ''')
+
+            # plot contents
+            plotwidth = max(325, min(25 * len(targets), 20000))
+            tick_step = int(np.ceil(25 * len(targets) / plotwidth))
+            with ui.scroll_area().classes(f'w-[325px] h-[250px]'):
+                fig_element = ui.matplotlib(
+                    figsize=(plotwidth / dpi, 250 / dpi)).classes(
+                    f'w-[{plotwidth}px] h-[250px]')
+                with fig_element.figure as fig:
+                    ax = fig.gca()
+                    ax.bar(indices, 20 - np.array(values),
+                           bottom=-20, width=.8, align='center',
+                           color="#5898d4", alpha=.8)
+                    ax.set_ylim(
+                        -max(values) - .2 * (max(values) - min(values)),
+                        -min(values) + .2 * (max(values) - min(values)),
+                    )
+                    ax.set_facecolor('#ECF0F1')
+                    ax.grid(axis='x')
+                    ax.set_xticks(indices[::tick_step])
+                    x_margin = (min(15,
+                                    len(targets)) - 1) / 15  # margin of 0-1
+                    ax.set_xlim(-.5 - x_margin,
+                                indices[-1] + .5 + x_margin)
+                    ax.get_yaxis().set_ticklabels([])
+                    fig.subplots_adjust(left=0., right=1., bottom=.15,
+                                        top=.95)
+
+            with fig0:
+                ax0 = fig0.gca()
+                ax0.set_facecolor('None')
+                ax0.set_yticks(ax.get_yticks())
+                ax0.set_ylim(*ax.get_ylim())
+                ax0.get_xaxis().set_visible(False)
+                fig0.subplots_adjust(left=.99, right=1., bottom=.15,
+                                     top=.95)
+
+        async def grid_selection_handler():
+            selected_ids = await get_selected_ids()
+            if not selected_ids and showing_selection:
+                show_button.set_text("clear")
+            else:
+                show_button.set_text("show")
+            await highlight_selected_bars()
+
+        async def highlight_selected_bars():
+            selected_ids = await get_selected_ids()
+            with fig:
+                if selected_ids:
+                    for i, bar in enumerate(ax.patches):
+                        bar.set_alpha(.9 if i in selected_ids else .4)
                 else:
-                    show_button.set_text("show")
-                await highlight_selected_bars()
-
-            async def highlight_selected_bars():
-                selected_ids = await get_selected_ids()
-                with fig:
-                    if selected_ids:
-                        for i, bar in enumerate(ax.patches):
-                            bar.set_alpha(.9 if i in selected_ids else .4)
-                    else:
-                        for i, bar in enumerate(ax.patches):
-                            bar.set_alpha(.6)
-
-            def sort_plot_ueff():
-                sorted_positions = np.argsort(values)
-                with fig:
-                    for xpos, i in enumerate(np.argsort(values)):
-                        bar = ax.patches[i]
-                        bar.set_x(xpos - .4)
-                    ax.set_xticks(indices, indices[sorted_positions])
-
-            def sort_plot_index():
-                with fig:
-                    for i in range(len(values)):
-                        bar = ax.patches[i]
-                        bar.set_x(i - .4)
-                    ax.set_xticks(indices, indices)
-
-            grid.on('selectionChanged', grid_selection_handler)
+                    for i, bar in enumerate(ax.patches):
+                        bar.set_alpha(.6)
+
+        def sort_plot_ueff():
+            sorted_positions = np.argsort(values)
+            with fig:
+                for xpos, i in enumerate(sorted_positions):
+                    bar = ax.patches[i]
+                    bar.set_x(xpos - .4)
+                ax.set_xticks(indices[::tick_step],
+                              indices[sorted_positions][::tick_step])
+
+        def sort_plot_index():
+            with fig:
+                for i in range(len(values)):
+                    bar = ax.patches[i]
+                    bar.set_x(i - .4)
+                ax.set_xticks(indices[::tick_step], indices[::tick_step])
+
+        grid.on('selectionChanged', grid_selection_handler)
 
     sorted_ueff = False
 
@@ -328,6 +418,20 @@ def show_output(output_container, get_input_values: callable):
             concentration = 100
             binding_rate = k_on * concentration
 
+            selected_off_targets = [i for i in selected_ids if i > 0]
+            protein_sequence_complexes = dict(zip(
+                [0] + selected_off_targets,
+                make_stc_list(
+                    protospacer=protospacer,
+                    off_targets=[targets[i] for i in selected_off_targets],
+                    context=context,
+                    parameter_set=parameter_set,
+                )
+            ))
+            selected_landscapes = get_landscape_matrix(
+                [protein_sequence_complexes[i] for i in selected_ids]
+            )
+
             # Clear previous output content - [IMPORTANT], otherwise plots will stack below on each request
             selection_container.clear()
 
@@ -376,10 +480,13 @@ def show_output(output_container, get_input_values: callable):
                         # FIGURE 1 - Bound fraction vs time
                         ax1 = fig1.add_subplot(spec0[1, 0])
                         dt = np.logspace(-1, 6)
-                        for i in selected_ids:
-                            stc = protein_sequence_complexes[i]
-                            f_bnd = stc.get_bound_fraction(dt, binding_rate,
-                                                           pam_inclusion=0)
+                        f_bnd_values = get_bound_fractions(
+                            selected_landscapes,
+                            protein_sequence_complexes[0].internal_rates,
+                            binding_rate, dt,
+                            pam_inclusion=0
+                        )
+                        for i, f_bnd in zip(selected_ids, f_bnd_values):
                             ax1.plot(
                                 dt, f_bnd,
                                 label=(
@@ -404,9 +511,13 @@ def show_output(output_container, get_input_values: callable):
                         conc_logmax = 3  # nM
                         dc = np.logspace(conc_logmin, conc_logmax)
 
-                        for i in selected_ids:
-                            stc = protein_sequence_complexes[i]
-                            f_bnd = stc.get_bound_fraction(3600, k_on * dc, pam_inclusion=0)
+                        f_bnd_values = get_bound_fraction_sweep(
+                            selected_landscapes,
+                            protein_sequence_complexes[0].internal_rates,
+                            k_on * dc, 3600,
+                            pam_inclusion=0
+                        )
+                        for i, f_bnd in zip(selected_ids, f_bnd_values):
                             ax2.plot(
                                 dc, f_bnd,
                                 label=f'{"on" if i == 0 else "off"}-target #{i}',
@@ -429,11 +540,95 @@ def show_output(output_container, get_input_values: callable):
                         ax2.set_facecolor('#ECF0F1')
                         ax2.set_title("binding vs concentration (1 hr)")
 
+                    # FIGURE 3 - Bound fraction vs concentration and time
+                    dc_grid = np.logspace(conc_logmin, conc_logmax, 41)
+                    f_bnd_grid = get_bound_fraction_sweep(
+                        selected_landscapes,
+                        protein_sequence_complexes[0].internal_rates,
+                        k_on * dc_grid, dt,
+                        pam_inclusion=0
+                    )
+                    ncols = 3
+                    nrows = -(-len(selected_ids) // ncols)
+                    with ui.matplotlib(figsize=(750 / dpi, 250 * nrows / dpi)).classes(
+                            f'w-[750px] h-[{250 * nrows}px]').figure as fig2:
+                        axs = fig2.subplots(nrows, ncols, squeeze=False)
+                        for ax, i, f_bnd in zip(axs.flat, selected_ids, f_bnd_grid):
+                            mesh = ax.pcolormesh(dt, dc_grid, f_bnd,
+                                                 vmin=0, vmax=1, shading='auto')
+                            ax.set_xscale('log')
+                            ax.set_yscale('log')
+                            ax.set_xlabel('time $t$ (s)')
+                            ax.set_ylabel('$c$ (nM)')
+                            ax.set_title('target (#0)' if i == 0 else f'off-target #{i}')
+                        for ax in axs.flat[len(selected_ids):]:
+                            ax.set_axis_off()
+                        fig2.subplots_adjust(left=.1, right=.85,
+                                             bottom=.2 / nrows,
+                                             top=1 - .25 / nrows,
+                                             wspace=.9, hspace=.9)
+                        fig2.colorbar(mesh, ax=axs, label=r"fraction bound $f_{bnd}$")
+                        fig2.suptitle("binding vs concentration and time")
+
         except Exception as e:
             ui.notify(f'Error: {str(e)}', type='negative')
 
     show_button.on_click(handle_show_click)
 
+    async def update_output(new_targets, new_values):
+        """Show new values in the existing grid and plot, instead of
+        building the output again."""
+        nonlocal targets, values, indices, plotwidth, tick_step
+        nonlocal showing_selection
+        old_length = len(targets)
+        targets, values = new_targets, new_values
+        indices = np.arange(len(targets))
+
+        update_rows()
+
+        selection_container.clear()
+        showing_selection = False
+        show_button.set_text("show")
+
+        old_plotwidth = plotwidth
+        plotwidth = max(325, min(25 * len(targets), 20000))
+        tick_step = int(np.ceil(25 * len(targets) / plotwidth))
+        with fig:
+            for bar in ax.patches[len(targets):]:
+                bar.remove()
+            for i, bar in enumerate(ax.patches):
+                bar.set_x(i - .4)
+                bar.set_height(20 - values[i])
+                bar.set_alpha(.8)
+            if len(targets) > old_length:
+                ax.bar(indices[old_length:], 20 - values[old_length:],
+                       bottom=-20, width=.8, align='center',
+                       color="#5898d4", alpha=.8)
+            fig.set_size_inches(plotwidth / dpi, 250 / dpi)
+            old_ylim = ax.get_ylim()
+            ax.set_ylim(
+                -max(values) - .2 * (max(values) - min(values)),
+                -min(values) + .2 * (max(values) - min(values)),
+            )
+            ax.set_xticks(indices[::tick_step], indices[::tick_step])
+            x_margin = (min(15,
+                            len(targets)) - 1) / 15  # margin of 0-1
+            ax.set_xlim(-.5 - x_margin,
+                        indices[-1] + .5 + x_margin)
+        if plotwidth != old_plotwidth:
+            fig_element.classes(remove=f'w-[{old_plotwidth}px]',
+                                add=f'w-[{plotwidth}px]')
+        if ax.get_ylim() != old_ylim:
+            with fig0:
+                ax0.set_yticks(ax.get_yticks())
+                ax0.set_ylim(*ax.get_ylim())
+        if sorted_ueff:
+            sort_plot_ueff()
+        await highlight_selected_bars()
+
+    session['update_output'] = update_output
+    session['output_key'] = output_key
+
 
 def show_contents():
     with ui.row().classes('w-full h-full no-wrap'):
@@ -443,6 +638,9 @@ def show_contents():
 
         # OUTPUT
         output_container = ui.column().classes('w-full h-full no-wrap m-2')
+        session = {'results': {}}  # scored values of this session
+        # released when the client disconnects (rescored on a reconnect)
+        ui.context.client.on_disconnect(lambda: session['results'].clear())
         submit_button.on_click(
-            lambda: show_output(output_container, get_input_values)
+            lambda: show_output(output_container, get_input_values, session)
         )
@@ -5,7 +5,14 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 from crisprzip.kinetics import *
-from .input import show_input, make_stc_list
+from .input import (show_input, make_stc_list, score_in_chunks,
+                    run_scoring, suspend_grid_updates)
+from .scoring import get_all_cleavage_probs, get_all_cleavage_rates
+from .ensemble import (score_ensemble, ENSEMBLE_SIZE, ENERGY_SD, RATE_SD,
+                       PERTURBATIONS)
+from .engine import (get_landscape_matrix, get_cleavage_rates,
+                     get_cleavage_rate_sweep, get_cleaved_fractions,
+                     get_cleaved_fraction_sweep)
 
 
 def get_cleavage_prob(stc):
@@ -16,20 +23,23 @@ def get_cleavage_prob(stc):
     return 1 / (1 + np.sum(np.cumprod(gamma)))
 
 
-def get_all_cleavage_probs(protospacer, off_targets,
-                           context, parameter_set):
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    p_clv_values = [get_cleavage_prob(stc) for stc in protein_sequence_complexes]
-    return p_clv_values
+def get_cleavage_rate(stc, binding_rate, mode='passage'):
+    """Calculate cleavage rate.
 
+    If mode is 'passage' (default), the rate follows from the mean
+    first-passage time to the cleaved state. If mode is 'fit', a
+    single exponential is fitted to the cleaved fraction over time,
+    which is slower but can be used to validate the former.
+    """
+    if mode == 'passage':
+        return float(get_cleavage_rates(
+            get_landscape_matrix([stc])[0],
+            stc.internal_rates,
+            binding_rate,
+        ))
+    elif mode != 'fit':
+        raise ValueError(f"Unrecognized mode '{mode}'.")
 
-def get_cleavage_rate(stc, binding_rate):
-    """Calculate cleavage rate."""
     dt = np.logspace(-2, 6)
     f_clv = stc.get_cleaved_fraction(dt, binding_rate)
     with np.errstate(over='ignore'):  # ignore RuntimeWarning: overflow
@@ -38,57 +48,96 @@ def get_cleavage_rate(stc, binding_rate):
             xdata=dt,
             ydata=f_clv,
         )[0][0])
-    return k_eff
+    return float(k_eff)
 
 
-def get_all_cleavage_rates(protospacer, off_targets,
-                           context, parameter_set):
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    k_on_ref = 1E-2
-    concentration = 100
-    binding_rate = k_on_ref * concentration
+async def show_output(output_container, get_input_values: callable,
+                      session: dict):
 
-    k_fit_values = [
-        get_cleavage_rate(stc, binding_rate) for
-        stc in protein_sequence_complexes
-    ]
-    return k_fit_values
-
-
-def show_output(output_container, get_input_values: callable):
+    input_values = get_input_values()
+    if input_values is None:
+        return
+    protospacer, off_targets, context, parameter_set = input_values.values()
+
+    # Values from earlier submits in this session are kept by sequence,
+    # so that only added or changed targets are scored.
+    output_key = (protospacer, context, parameter_set)
+    known_values = session['results'].setdefault(output_key, {})
+    new_targets = [seq for seq in dict.fromkeys(off_targets)
+                   if seq not in known_values]
+    scoring_targets = [protospacer] + new_targets
+    if not new_targets and protospacer in known_values:
+        scoring_targets = []
 
-    protospacer, off_targets, context, parameter_set = get_input_values().values()
+    targets = [protospacer] + off_targets
 
-    if len(off_targets) > 250:
-        ui.notify(f"Can't process {len(off_targets)} off-targets at once! (max. 250)", type='warning')
-        return
+    def get_values():
+        return np.array([known_values.get(seq, np.nan) for seq in targets])
 
-    protein_sequence_complexes = make_stc_list(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
-    cleavage_probs = get_all_cleavage_probs(
-        protospacer=protospacer,
-        off_targets=off_targets,
-        context=context,
-        parameter_set=parameter_set,
-    )
+    values = get_values()
 
-    targets = [protospacer] + off_targets
-    values = cleavage_probs
-    indices = np.arange(len(targets))
+    # The output of the same guide and model is updated in place.
+    update_output = session.get('update_output')
+    in_place = (update_output is not None and
+                session.get('output_key') == output_key)
 
     # VISUALIZATION
     mpl.style.use('seaborn-v0_8')
 
-    output_container.clear()
+    if not in_place:
+        session['update_output'] = None
+        output_container.clear()
+    with output_container:
+        with ui.row(align_items='center').classes('w-full') as progress_row:
+            progress_bar = ui.linear_progress(value=0, show_value=False).classes('w-[380px]')
+            progress_label = ui.label(f"0/{len(scoring_targets)}")
+            cancel_button = ui.button('cancel').props('outline no-caps')
+        progress_row.move(target_index=0)
+
+    # SCORING
+    cancelled = False
+
+    def cancel_scoring():
+        nonlocal cancelled
+        cancelled = True
+
+    cancel_button.on_click(cancel_scoring)
+
+    async def score_new_targets(on_chunk_scored=None):
+        """Score the targets that are not in the session index yet.
+        Returns whether all of them were scored."""
+        scored = 0
+        if not scoring_targets:
+            return True
+        async for chunk_values in score_in_chunks(
+                get_all_cleavage_probs, protospacer, new_targets,
+                context, parameter_set, metric='p_clv'):
+            if progress_row.is_deleted:  # output replaced by a new submit
+                return False
+            known_values.update(zip(
+                scoring_targets[scored:scored + len(chunk_values)],
+                chunk_values
+            ))
+            scored += len(chunk_values)
+            progress_bar.set_value(scored / len(scoring_targets))
+            progress_label.set_text(f"{scored}/{len(scoring_targets)}")
+            if on_chunk_scored is not None:
+                on_chunk_scored()
+            if cancelled:
+                break
+        return scored == len(scoring_targets)
+
+    if in_place:
+        complete = await score_new_targets()
+        if progress_row.is_deleted:
+            return
+        progress_row.delete()
+        if not complete:
+            ui.notify("Scoring cancelled, the output was not updated.", type='warning')
+            return
+        await update_output(targets, get_values())
+        return
+
     with output_container:
         with ui.column(align_items='center').classes('w-full'):
             plot_row = ui.row(align_items='start').classes('gap-0')
@@ -125,15 +174,68 @@ def show_output(output_container, get_input_values: callable):
                     {'headerName': 'sequence', 'field': 'sequence',
                      'width': '220', 'cellClass': 'monospace-column'},
                     {'headerName': 'p_clv', 'field': 'p_clv',
-                     'width': '90'}
+                     'width': '90'},
+                    # confidence intervals, shown after an uncertainty run
+                    {'headerName': 'p_clv 95% CI', 'field': 'p_clv_ci',
+                     'width': '190', 'hide': True},
+                    {'headerName': 'ΔΔU_eff vs on-target 95% CI (kT)',
+                     'field': 'du_eff_ci', 'width': '240', 'hide': True},
+                    # numeric p_clv, for sorting
+                    {'field': 'value', 'hide': True},
                 ]]
 
             grid = ui.aggrid({
                 'columnDefs': column_defs,
-                'rowData': [{'index': i, 'sequence': targets[i], 'p_clv': to_sci_html(values[i])}
-                            for i in range(len(targets))],
-                'rowSelection': 'multiple'
-            }, html_columns=[3], auto_size_columns=True)
+                'rowData': [],  # filled while scoring
+                'rowSelection': 'multiple',
+                ':getRowId': 'params => String(params.data.index)',
+            }, html_columns=[3, 4], auto_size_columns=True)
+
+            intervals = None  # from score_ensemble
+
+            def make_row(i):
+                row = {'index': i, 'sequence': targets[i],
+                       'p_clv': to_sci_html(values[i]),
+                       'value': float(values[i])}
+                if intervals is not None:
+                    p_low, _, p_high = intervals['p_clv'][i]
+                    u_low, _, u_high = intervals['du_eff'][i]
+                    row['p_clv_ci'] = (f"{to_sci_html(p_low)} &ndash; "
+                                       f"{to_sci_html(p_high)}")
+                    row['du_eff_ci'] = f"{u_low:.2f} &ndash; {u_high:.2f}"
+                return row
+
+            def update_rows():
+                """Apply the rows of the current targets to the grid as a
+                transaction of the changed rows only, which keeps its
+                scroll position, selection and sort."""
+                old_rows = {row['index']: row for row in grid.options['rowData']}
+                rows = [make_row(i) for i in range(len(targets))]
+                with suspend_grid_updates(grid):
+                    grid.options['rowData'] = rows
+                grid.run_grid_method('applyTransaction', {
+                    'add': [row for row in rows if row['index'] not in old_rows],
+                    'update': [row for row in rows if row['index'] in old_rows
+                               and row != old_rows[row['index']]],
+                    'remove': [row for i, row in old_rows.items()
+                               if i >= len(targets)],
+                })
+
+            def show_interval_columns(show):
+                fields = ['p_clv_ci', 'du_eff_ci']
+                with suspend_grid_updates(grid):
+                    for column_def in grid.options['columnDefs']:
+                        if column_def['field'] in fields:
+                            column_def['hide'] = not show
+                grid.run_grid_method('setColumnsVisible', fields, show)
+
+            def sort_grid(sort):
+                # the rows are in index order, unless sorted on their value
+                with suspend_grid_updates(grid):
+                    grid.options['columnDefs'][-1]['sort'] = sort
+                grid.run_grid_method('applyColumnState', {
+                    'state': [{'colId': 'value', 'sort': sort}]
+                })
 
             async def get_selected_ids():
                 selection = await grid.get_selected_rows()
@@ -141,27 +243,10 @@ def show_output(output_container, get_input_values: callable):
                 return sorted(selected_ids)
 
             async def sort_grid_kclv():
-                nonlocal grid
-                selected_ids = await get_selected_ids()
-                grid.options['rowData'] = [
-                    {'index': i, 'sequence': targets[i], 'p_clv': to_sci_html(values[i])}
-                    for i in reversed(np.argsort(values))
-                ]
-                for i in range(len(values)):
-                    if np.argsort(values)[::-1][i] in selected_ids:
-                        grid.run_row_method(i, 'setSelected', True)
-                grid.update()
+                sort_grid('desc')
 
             async def sort_grid_index():
-                nonlocal grid
-                selected_ids = await get_selected_ids()
-                grid.options['rowData'] = [
-                    {'index': i, 'sequence': targets[i], 'p_clv': to_sci_html(values[i])}
-                    for i in range(len(targets))
-                ]
-                for i in selected_ids:
-                    grid.run_row_method(i, 'setSelected', True)
-                grid.update()
+                sort_grid(None)
 
             with ui.row(align_items='center').classes('w-full'):
                 show_button = ui.button("SHOW").classes('w-[100px]')
@@ -175,92 +260,125 @@ def show_output(output_container, get_input_values: callable):
                 sort_button = ui.button().props('no-caps').classes("w-[120px]")
                 with sort_button:
                     ui.html("sort by <i>p<sub>clv</sub></i>")
+                uncertainty_button = ui.button().props('icon=ssid_chart no-caps outline').classes('w-[1em] h-[1em]')
+                with uncertainty_button:
+                    ui.tooltip('Confidence intervals under parameter uncertainty')
                 download_button = ui.button().props('icon=download no-caps outline').classes('w-[1em] h-[1em]')
 
 
         ui.element().classes('w-[15px]')
 
         # Plot
-        with ui.column(align_items='center').classes('gap-0 p-0'):
-            dpi = plt.rcParams['figure.dpi']  # pixel in inches
-
-            # title
-            with ui.matplotlib(figsize=(365 / dpi, 25 / dpi)).classes('w-[365px] h-[25px]').figure as tfig:
-                t_ax = tfig.gca()
-                t_ax.text(.5, .5, r"cleavage probability $p_{clv}$",
-                          va='center', ha='center', fontsize='large')
-                t_ax.set_axis_off()
-
-            with ui.row().classes('gap-0 p-0'):
-
-                # y axis
-                fig0 = ui.matplotlib(figsize=(40 / dpi, 250 / dpi)).classes('w-[40px] h-[250px]').figure
-
-                ui.add_css('''
-                    .nicegui-scroll-area .q-scrollarea__content {
-                        padding: 0;
-                    }
-                    ''')
-
-                # plot contents
-                plotwidth = max(325, 25 * len(targets))
-                with ui.scroll_area().classes(f'w-[325px] h-[250px]'):
-                    with ui.matplotlib(figsize=(plotwidth / dpi, 250 / dpi)).classes(f'w-[{plotwidth}px] h-[250px]').figure as fig:
-                        ax = fig.gca()
-                        ax.bar(indices, values, width=.8, align='center',
-                               color="#5898d4", alpha=.8)
-                        ax.set_yscale('log')
-                        ax.set_facecolor('#ECF0F1')
-                        ax.grid(axis='x')
-                        ax.set_xticks(indices)
-                        x_margin = (min(15, len(targets)) - 1) / 15  # margin of 0-1
-                        ax.set_xlim(-.5 - x_margin, indices[-1] + .5 + x_margin)
-                        ax.get_yaxis().set_ticklabels([])
-                        fig.subplots_adjust(left=0., right=1., bottom=.15, top=.95)
-
-                with fig0:
-                    ax0 = fig0.gca()
-                    ax0.set_facecolor('None')
-                    ax0.set_yscale('log')
-                    ax0.set_yticks(ax.get_yticks())
-                    ax0.set_ylim(*ax.get_ylim())
-                    ax0.get_xaxis().set_visible(False)
-                    fig0.subplots_adjust(left=.99, right=1., bottom=.15, top=.95)
-
-            async def grid_selection_handler():
-                selected_ids = await get_selected_ids()
-                if not selected_ids and showing_selection:
-                    show_button.set_text("clear")
+        plot_column = ui.column(align_items='center').classes('gap-0 p-0')
+
+    # rows are shown as soon as all preceding targets are scored
+    shown = 0
+
+    def show_scored_rows():
+        nonlocal values, shown
+        values = get_values()
+        unscored = np.flatnonzero(np.isnan(values))
+        ready = unscored[0] if unscored.size else len(targets)
+        if ready > shown:
+            grid.options['rowData'] += [make_row(i) for i in range(shown, ready)]
+            grid.update()
+            shown = ready
+
+    show_scored_rows()
+    await score_new_targets(show_scored_rows)
+    if progress_row.is_deleted:
+        return
+
+    progress_row.delete()
+    if shown < len(targets):
+        ui.notify(f"Scoring cancelled after {shown} of {len(targets)} targets.", type='warning')
+        targets = targets[:shown]
+        values = values[:shown]
+    indices = np.arange(len(targets))
+
+    with plot_column:
+        dpi = plt.rcParams['figure.dpi']  # pixel in inches
+
+        # title
+        with ui.matplotlib(figsize=(365 / dpi, 25 / dpi)).classes('w-[365px] h-[25px]').figure as tfig:
+            t_ax = tfig.gca()
+            t_ax.text(.5, .5, r"cleavage probability $p_{clv}$",
+                      va='center', ha='center', fontsize='large')
+            t_ax.set_axis_off()
+
+        with ui.row().classes('gap-0 p-0'):
+
+            # y axis
+            fig0 = ui.matplotlib(figsize=(40 / dpi, 250 / dpi)).classes('w-[40px] h-[250px]').figure
+
+            ui.add_css('''
+                .nicegui-scroll-area .q-scrollarea__content {
+                    padding: 0;
+                }
+                ''')
+
+            # plot contents
+            plotwidth = max(325, min(25 * len(targets), 20000))
+            tick_step = int(np.ceil(25 * len(targets) / plotwidth))
+            with ui.scroll_area().classes(f'w-[325px] h-[250px]'):
+                fig_element = ui.matplotlib(figsize=(plotwidth / dpi, 250 / dpi)).classes(f'w-[{plotwidth}px] h-[250px]')
+                with fig_element.figure as fig:
+                    ax = fig.gca()
+                    ax.bar(indices, values, width=.8, align='center',
+                           color="#5898d4", alpha=.8)
+                    ax.set_yscale('log')
+                    ax.set_facecolor('#ECF0F1')
+                    ax.grid(axis='x')
+                    ax.set_xticks(indices[::tick_step])
+                    x_margin = (min(15, len(targets)) - 1) / 15  # margin of 0-1
+                    ax.set_xlim(-.5 - x_margin, indices[-1] + .5 + x_margin)
+                    ax.get_yaxis().set_ticklabels([])
+                    fig.subplots_adjust(left=0., right=1., bottom=.15, top=.95)
+
+            with fig0:
+                ax0 = fig0.gca()
+                ax0.set_facecolor('None')
+                ax0.set_yscale('log')
+                ax0.set_yticks(ax.get_yticks())
+                ax0.set_ylim(*ax.get_ylim())
+                ax0.get_xaxis().set_visible(False)
+                fig0.subplots_adjust(left=.99, right=1., bottom=.15, top=.95)
+
+        async def grid_selection_handler():
+            selected_ids = await get_selected_ids()
+            if not selected_ids and showing_selection:
+                show_button.set_text("clear")
+            else:
+                show_button.set_text("show")
+            await highlight_selected_bars()
+
+        async def highlight_selected_bars():
+            selected_ids = await get_selected_ids()
+            with fig:
+                if selected_ids:
+                    for i, bar in enumerate(ax.patches):
+                        bar.set_alpha(.9 if i in selected_ids else .4)
                 else:
-                    show_button.set_text("show")
-                await highlight_selected_bars()
-
-            async def highlight_selected_bars():
-                selected_ids = await get_selected_ids()
-                with fig:
-                    if selected_ids:
-                        for i, bar in enumerate(ax.patches):
-                            bar.set_alpha(.9 if i in selected_ids else .4)
-                    else:
-                        for i, bar in enumerate(ax.patches):
-                            bar.set_alpha(.6)
-
-            def sort_plot_kclv():
-                sorted_positions = np.argsort(values)[::-1]
-                with fig:
-                    for xpos, i in enumerate(reversed(np.argsort(values))):
-                        bar = ax.patches[i]
-                        bar.set_x(xpos - .4)
-                    ax.set_xticks(indices, indices[sorted_positions])
-
-            def sort_plot_index():
-                with fig:
-                    for i in range(len(values)):
-                        bar = ax.patches[i]
-                        bar.set_x(i - .4)
-                    ax.set_xticks(indices, indices)
-
-            grid.on('selectionChanged', grid_selection_handler)
+                    for i, bar in enumerate(ax.patches):
+                        bar.set_alpha(.6)
+
+        def sort_plot_kclv():
+            sorted_positions = np.argsort(values)[::-1]
+            with fig:
+                for xpos, i in enumerate(sorted_positions):
+                    bar = ax.patches[i]
+                    bar.set_x(xpos - .4)
+                ax.set_xticks(indices[::tick_step],
+                              indices[sorted_positions][::tick_step])
+
+        def sort_plot_index():
+            with fig:
+                for i in range(len(values)):
+                    bar = ax.patches[i]
+                    bar.set_x(i - .4)
+                ax.set_xticks(indices[::tick_step], indices[::tick_step])
+
+        grid.on('selectionChanged', grid_selection_handler)
 
     sorted_kclv = False
 
@@ -287,11 +405,69 @@ def show_output(output_container, get_input_values: callable):
 
     def download_grid():
         df = pd.DataFrame({'sequence': targets, 'k_clv [1/s]': values})
+        if intervals is not None:
+            for metric in ('p_clv', 'du_eff'):
+                for k, bound in enumerate(['low', 'median', 'high']):
+                    df[f'{metric} ({bound})'] = intervals[metric][:len(targets), k]
         csv_string = df.to_csv(index=True)
         ui.download.content(csv_string, 'crisprzip_kclv.csv')
 
     download_button.on_click(download_grid)
 
+    with output_container, ui.dialog() as uncertainty_dialog, ui.card().classes('w-[380px]'):
+        ui.label('Parameter uncertainty').classes('text-lg')
+        ui.label('p_clv and ΔU_eff are evaluated over an ensemble of '
+                 'perturbed parameter sets, and their 95% confidence '
+                 'intervals are added to the table.').classes('text-sm')
+        size_input = ui.number('ensemble size', value=ENSEMBLE_SIZE,
+                               min=10, max=2000, step=10, precision=0)
+        energy_input = ui.number('energy SD (kT)', value=ENERGY_SD,
+                                 min=0, step=.1, format='%.2f')
+        rate_input = ui.number('rate SD (log10)', value=RATE_SD,
+                               min=0, step=.05, format='%.2f')
+        perturb_checks = {group: ui.checkbox(label, value=True)
+                          for group, label in PERTURBATIONS.items()}
+        with ui.row(align_items='center').classes('w-full'):
+            run_button = ui.button('run').props('icon=play_arrow')
+            ensemble_spinner = ui.spinner(size='md')
+            ensemble_spinner.visible = False
+            ui.space()
+            ui.button('close', on_click=uncertainty_dialog.close).props('flat')
+
+    async def run_ensemble():
+        nonlocal intervals
+        run_button.disable()
+        ensemble_spinner.visible = True
+        try:
+            result = await run_scoring(
+                score_ensemble,
+                protospacer=protospacer,
+                off_targets=targets[1:],
+                context=context,
+                parameter_set=parameter_set,
+                size=int(size_input.value or ENSEMBLE_SIZE),
+                energy_sd=energy_input.value or 0.,
+                rate_sd=rate_input.value or 0.,
+                perturb=tuple(group for group, check in perturb_checks.items()
+                              if check.value),
+            )
+        except Exception as e:
+            ui.notify(f'Error evaluating the ensemble: {str(e)}',
+                      type='negative')
+            return
+        finally:
+            run_button.enable()
+            ensemble_spinner.visible = False
+        if result is None or grid.is_deleted:
+            return  # app is shutting down, or output was replaced
+        uncertainty_dialog.close()
+        intervals = result
+        show_interval_columns(True)
+        update_rows()
+
+    run_button.on_click(run_ensemble)
+    uncertainty_button.on_click(uncertainty_dialog.open)
+
     async def handle_show_click():
         nonlocal showing_selection
 
@@ -320,6 +496,20 @@ def show_output(output_container, get_input_values: callable):
             concentration = 100
             binding_rate = k_on_ref * concentration
 
+            selected_off_targets = [i for i in selected_ids if i > 0]
+            protein_sequence_complexes = dict(zip(
+                [0] + selected_off_targets,
+                make_stc_list(
+                    protospacer=protospacer,
+                    off_targets=[targets[i] for i in selected_off_targets],
+                    context=context,
+                    parameter_set=parameter_set,
+                )
+            ))
+            selected_landscapes = get_landscape_matrix(
+                [protein_sequence_complexes[i] for i in selected_ids]
+            )
+
             # Clear previous output content - [IMPORTANT], otherwise plots will stack below on each request
             selection_container.clear()
 
@@ -365,9 +555,12 @@ def show_output(output_container, get_input_values: callable):
                         # FIGURE 1 - Cleaved fraction vs time
                         ax1 = fig1.add_subplot(spec0[1, 0])
                         dt = np.logspace(-1, 6)
-                        for i in selected_ids:
-                            stc = protein_sequence_complexes[i]
-                            f_clv = stc.get_cleaved_fraction(dt, binding_rate)
+                        f_clv_values = get_cleaved_fractions(
+                            selected_landscapes,
+                            protein_sequence_complexes[0].internal_rates,
+                            binding_rate, dt
+                        )
+                        for i, f_clv in zip(selected_ids, f_clv_values):
                             ax1.plot(
                                 dt, f_clv,
                                 label=('target (#0)' if i == 0 else f'off-target #{i}'),
@@ -391,17 +584,25 @@ def show_output(output_container, get_input_values: callable):
                         conc_logmax = 3  # nM
                         dc = np.logspace(conc_logmin, conc_logmax)
 
-                        for i in selected_ids:
-                            stc = protein_sequence_complexes[i]
-                            k_fit = [get_cleavage_rate(stc, k_on_ref * c)
-                                     for c in dc]
+                        k_fit_values = get_cleavage_rate_sweep(
+                            selected_landscapes,
+                            protein_sequence_complexes[0].internal_rates,
+                            k_on_ref * dc
+                        )
+                        k_ref_values = get_cleavage_rates(
+                            selected_landscapes,
+                            protein_sequence_complexes[0].internal_rates,
+                            binding_rate
+                        )
+                        for i, k_fit, k_ref in zip(selected_ids, k_fit_values,
+                                                   k_ref_values):
                             ax2.plot(
                                 dc, k_fit,
                                 label=f'{"on" if i==0 else "off"}-target #{i}',
                                 zorder=5 - .1* i
                             )
                             ax2.plot(
-                                concentration, get_cleavage_rate(stc, k_on_ref * concentration),
+                                concentration, k_ref,
                                 marker='o',
                                 zorder=5 - .1 * i,
                                 color=ax2.lines[-1].get_color()
@@ -416,11 +617,96 @@ def show_output(output_container, get_input_values: callable):
                         ax2.set_facecolor('#ECF0F1')
                         ax2.set_title("cleavage vs concentration")
 
+                    # FIGURE 3 - Cleaved fraction vs concentration and time
+                    dc_grid = np.logspace(conc_logmin, conc_logmax, 41)
+                    f_clv_grid = get_cleaved_fraction_sweep(
+                        selected_landscapes,
+                        protein_sequence_complexes[0].internal_rates,
+                        k_on_ref * dc_grid, dt
+                    )
+                    ncols = 3
+                    nrows = -(-len(selected_ids) // ncols)
+                    with ui.matplotlib(figsize=(750 / dpi, 250 * nrows / dpi)).classes(
+                            f'w-[750px] h-[{250 * nrows}px]').figure as fig2:
+                        axs = fig2.subplots(nrows, ncols, squeeze=False)
+                        for ax, i, f_clv in zip(axs.flat, selected_ids, f_clv_grid):
+                            mesh = ax.pcolormesh(dt, dc_grid, f_clv,
+                                                 vmin=0, vmax=1, shading='auto')
+                            ax.set_xscale('log')
+                            ax.set_yscale('log')
+                            ax.set_xlabel('time $t$ (s)')
+                            ax.set_ylabel('$c$ (nM)')
+                            ax.set_title('target (#0)' if i == 0 else f'off-target #{i}')
+                        for ax in axs.flat[len(selected_ids):]:
+                            ax.set_axis_off()
+                        fig2.subplots_adjust(left=.1, right=.85,
+                                             bottom=.2 / nrows,
+                                             top=1 - .25 / nrows,
+                                             wspace=.9, hspace=.9)
+                        fig2.colorbar(mesh, ax=axs, label=r"fraction cleaved $f_{clv}$")
+                        fig2.suptitle("cleavage vs concentration and time")
+
         except Exception as e:
             ui.notify(f'Error: {str(e)}', type='negative')
 
     show_button.on_click(handle_show_click)
 
+    async def update_output(new_targets, new_values):
+        """Show new values in the existing grid and plot, instead of
+        building the output again."""
+        nonlocal targets, values, indices, plotwidth, tick_step
+        nonlocal showing_selection, intervals
+        old_length = len(targets)
+        targets, values = new_targets, new_values
+        indices = np.arange(len(targets))
+
+        if intervals is not None:  # computed for the previous targets
+            intervals = None
+            show_interval_columns(False)
+        update_rows()
+
+        selection_container.clear()
+        showing_selection = False
+        show_button.set_text("show")
+
+        old_plotwidth = plotwidth
+        plotwidth = max(325, min(25 * len(targets), 20000))
+        tick_step = int(np.ceil(25 * len(targets) / plotwidth))
+        with fig:
+            for bar in ax.patches[len(targets):]:
+                bar.remove()
+            for i, bar in enumerate(ax.patches):
+                bar.set_x(i - .4)
+                bar.set_height(values[i])
+                bar.set_alpha(.8)
+            if len(targets) > old_length:
+                ax.bar(indices[old_length:], values[old_length:], width=.8,
+                       align='center', color="#5898d4", alpha=.8)
+            fig.set_size_inches(plotwidth / dpi, 250 / dpi)
+            ax.set_xticks(indices[::tick_step], indices[::tick_step])
+            x_margin = (min(15, len(targets)) - 1) / 15  # margin of 0-1
+            ax.set_xlim(-.5 - x_margin, indices[-1] + .5 + x_margin)
+            # data limits of the bars, without going over all patches
+            ax.ignore_existing_data_limits = True
+            ax.update_datalim(np.column_stack([
+                np.concatenate([indices - .4, indices + .4]),
+                np.concatenate([values, values])
+            ]))
+            old_ylim = ax.get_ylim()
+            ax.autoscale_view(scalex=False)
+        if plotwidth != old_plotwidth:
+            fig_element.classes(remove=f'w-[{old_plotwidth}px]',
+                                add=f'w-[{plotwidth}px]')
+        if ax.get_ylim() != old_ylim:
+            with fig0:
+                ax0.set_yticks(ax.get_yticks())
+                ax0.set_ylim(*ax.get_ylim())
+        if sorted_kclv:
+            sort_plot_kclv()
+        await highlight_selected_bars()
+
+    session['update_output'] = update_output
+    session['output_key'] = output_key
 
 
 def show_contents():
@@ -432,7 +718,10 @@ def show_contents():
 
         # OUTPUT
         output_container = ui.column().classes('w-full h-full no-wrap m-2')
+        session = {'results': {}}  # scored values of this session
+        # released when the client disconnects (rescored on a reconnect)
+        ui.context.client.on_disconnect(lambda: session['results'].clear())
         submit_button.on_click(
-            lambda: show_output(output_container, get_input_values)
+            lambda: show_output(output_container, get_input_values, session)
         )
 
@@ -0,0 +1,173 @@
+"""Score off-target files with CRISPRzip from the command line.
+
+Example:
+    python crisprzip_cli.py GACGCATAAAGATGAGACGCTGG off_targets.csv \\
+        --context mammal --metrics p_clv u_eff -o scores.csv
+
+Off-targets are read from a CSV-file (first column) or a FASTA-file, or
+searched in a genome with --genome, and scored chunk by chunk, in the same
+way as in the GUI. Results are written to CSV (or Parquet, which requires
+pyarrow) as soon as a chunk is done.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from content.scoring import chunk_size, workers, _init_worker
+from content.batch import (CONTEXTS, PARAMETER_SETS, SCORE_FUNCS,
+                           score_chunk)
+from content.sequences import get_sequence_error, find_sequence_error
+from content.genome import read_fasta, load_pam_index
+
+
+def read_off_targets(path):
+    """Read off-targets from a CSV-file (first column) or a FASTA-file.
+    Returns the off-target names (None for CSV) and sequences."""
+    if path.lower().endswith(('.fa', '.fasta', '.fna')):
+        return read_fasta(path)
+    sequences = pd.read_csv(path).iloc[:, 0].astype(str).str.strip().tolist()
+    return None, sequences
+
+
+class ParquetWriter:
+    """Minimal streaming Parquet writer, based on pyarrow."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet-files requires pyarrow "
+                              "(pip install pyarrow).") from None
+        self._pyarrow = pyarrow
+        self._path = path
+        self._writer = None
+
+    def write(self, df):
+        table = self._pyarrow.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = self._pyarrow.parquet.ParquetWriter(self._path,
+                                                               table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def get_chunks(protospacer, names, off_targets, args):
+    """Generate data frames with the scores of consecutive chunks."""
+    starts = range(0, len(off_targets), chunk_size)
+    jobs = [(protospacer, off_targets[start:start + chunk_size],
+             args.context, args.parameter_set, args.metrics)
+            for start in starts]
+
+    if args.workers == 0:
+        results = (score_chunk(*job) for job in jobs)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=args.workers,
+                                   initializer=_init_worker)
+        results = pool.map(score_chunk, *zip(*jobs)) if jobs else ()
+
+    try:
+        for start, values in zip(starts, results):
+            df = pd.DataFrame({'sequence': off_targets[start:start + chunk_size],
+                               **values})
+            if names is not None:
+                df.insert(0, 'name', names[start:start + chunk_size])
+            yield df
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Score off-targets with CRISPRzip, without the GUI.'
+    )
+    parser.add_argument('protospacer',
+                        help='on-target protospacer, including the PAM '
+                             '(5\'-to-3\', 23 nt)')
+    parser.add_argument('off_targets', nargs='?',
+                        help='CSV-file (first column) or FASTA-file '
+                             '(.fa/.fasta/.fna) with off-target sequences')
+    parser.add_argument('--genome',
+                        help='FASTA-file (genome or plasmid) in which all '
+                             'sites with an NGG PAM are searched, instead '
+                             'of reading an off-target file')
+    parser.add_argument('--max-mismatches', type=int, default=3,
+                        help='maximum number of mismatches of the sites '
+                             'found with --genome (default: 3)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file; .parquet for Parquet, CSV '
+                             'otherwise (default: CSV to stdout)')
+    parser.add_argument('--context', choices=CONTEXTS, default='invitro',
+                        help='application context (default: invitro)')
+    parser.add_argument('--parameter-set', choices=PARAMETER_SETS,
+                        default='sequence_params',
+                        help='landscape parameters (default: sequence_params)')
+    parser.add_argument('--metrics', nargs='+', choices=tuple(SCORE_FUNCS),
+                        default=['p_clv', 'u_eff'],
+                        help='metrics to calculate (default: p_clv u_eff)')
+    parser.add_argument('--workers', type=int, default=workers,
+                        help='number of worker processes; 0 scores in the '
+                             'main process (default: CRISPRZIP_WORKERS, or '
+                             'the number of CPU cores minus one, at most 4)')
+    args = parser.parse_args(argv)
+
+    protospacer = args.protospacer.strip().upper()
+    err_msg = get_sequence_error(protospacer)
+    if err_msg:
+        parser.error(f"target sequence error: {err_msg}")
+    if args.genome:
+        hits = (load_pam_index(args.genome)
+                .search(protospacer, args.max_mismatches))
+        names = [f"{record}:{start}:{strand}" for record, start, strand
+                 in zip(hits['record'], hits['start'], hits['strand'])]
+        off_targets = hits['sequence'].tolist()
+    elif args.off_targets:
+        names, off_targets = read_off_targets(args.off_targets)
+    else:
+        parser.error("provide an off-target file or a --genome")
+    off_targets = [seq.strip().upper() for seq in off_targets]
+    error = find_sequence_error(off_targets)
+    if error:
+        i, err_msg = error
+        parser.error(f"off-target sequence error: {err_msg} "
+                     f"(target #{i + 1})")
+
+    if args.output.lower().endswith('.parquet'):
+        writer = ParquetWriter(args.output)
+        write = writer.write
+    else:
+        writer = (sys.stdout if args.output == '-' else
+                  open(args.output, 'w', newline=''))
+        header = [True]
+
+        def write(df):
+            df.to_csv(writer, index=False, header=header[0])
+            header[0] = False
+            writer.flush()
+
+    chunks = get_chunks(protospacer, names, off_targets, args)
+    try:
+        for df in chunks:
+            write(df)
+    except BrokenPipeError:
+        # the reader of the output has exited (e.g. `| head`): stop the
+        # workers and exit quietly, without flushing into the closed pipe
+        chunks.close()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if writer is not sys.stdout:
+            writer.close()
+
+
+if __name__ == '__main__':
+    main()
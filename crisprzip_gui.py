@@ -1,10 +1,15 @@
 from nicegui import native,ui
 import content.vitro_cleavage
 import content.vitro_binding
+import content.design
+import content.compare
+import content.scan
+import content.api  # scoring API at /api/score
+from content.input import cache_path
 
-# macOS packaging support
-#from multiprocessing import freeze_support
-#freeze_support()
+# packaging support (the off-targets are scored in worker processes)
+from multiprocessing import freeze_support
+freeze_support()
 
 
 @ui.page('/')
@@ -17,6 +22,9 @@ def index():
             with ui.tabs().style('color: gray') as tabs:
                 one = ui.tab('cleavage', icon='content_cut')
                 two = ui.tab('binding', icon='link')
+                three = ui.tab('design', icon='design_services')
+                four = ui.tab('compare', icon='grid_on')
+                five = ui.tab('scan', icon='blur_linear')
 
         ui.space()
         ui.space()
@@ -43,7 +51,10 @@ def index():
 
     # FOOTER
     with ui.footer(elevated=True).classes('py-1 h-6 bg-[#F5FAF4] flex items-center'):
-        (ui.markdown('CRISPRzip tool is created with [NiceGUI](https://nicegui.io). Licensed under MIT.')
+        footer_text = 'CRISPRzip tool is created with [NiceGUI](https://nicegui.io). Licensed under MIT.'
+        if cache_path:
+            footer_text += f' Scores are cached in `{cache_path}`.'
+        (ui.markdown(footer_text)
          .style('color: gray; font-size: 10px;')
          .classes('leading-[0.0]'))
 
@@ -57,6 +68,18 @@ def index():
         with ui.tab_panel(two):
             content.vitro_binding.show_contents()  # content/vitro_binding.py
 
+        # TAB 3 - GUIDE DESIGN
+        with ui.tab_panel(three):
+            content.design.show_contents()  # content/design.py
+
+        # TAB 4 - GUIDE COMPARISON
+        with ui.tab_panel(four):
+            content.compare.show_contents()  # content/compare.py
+
+        # TAB 5 - MISMATCH SCAN
+        with ui.tab_panel(five):
+            content.scan.show_contents()  # content/scan.py
+
 ui.run(
     # Uncomment the next two lines if you want to build an executable, or to run in a contained window
     native=True,
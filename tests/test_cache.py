@@ -0,0 +1,116 @@
+"""Storage, eviction and entry count of the result cache
+(content/cache.py)."""
+
+import itertools
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from content import cache
+from content.cache import ResultCache, score_with_cache
+
+PROTOSPACER = 'GACGCATAAAGATGAGACGCTGG'
+TARGETS = [PROTOSPACER[:i] + 'T' + PROTOSPACER[i + 1:] for i in range(20)
+           if PROTOSPACER[i] != 'T']
+ARGS = 'invitro', 'sequence_params'
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Strictly increasing timestamps, so that the LRU order is exact."""
+    ticks = itertools.count()
+    monkeypatch.setattr(cache, 'time',
+                        SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def get_rows(result_cache):
+    with sqlite3.connect(result_cache.path) as connection:
+        count = connection.execute('SELECT count FROM entries').fetchone()[0]
+        targets = [row[0] for row in connection.execute(
+            'SELECT target FROM results ORDER BY last_used')]
+    assert count == len(targets)
+    return targets
+
+
+def test_store_and_lookup(tmp_path):
+    result_cache = ResultCache(tmp_path / 'cache.sqlite')
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[:4], [.1, .2, .3, .4],
+                       *ARGS)
+    # another metric updates the same rows
+    result_cache.store('kd', PROTOSPACER, TARGETS[2:6], [1., 2., 3., 4.],
+                       *ARGS)
+    assert len(get_rows(result_cache)) == 6
+    np.testing.assert_array_equal(
+        result_cache.lookup('p_clv', PROTOSPACER, TARGETS[:6], *ARGS),
+        [.1, .2, .3, .4, np.nan, np.nan]
+    )
+    np.testing.assert_array_equal(
+        result_cache.lookup('kd', PROTOSPACER, TARGETS[:6], *ARGS),
+        [np.nan, np.nan, 1., 2., 3., 4.]
+    )
+    # other contexts and parameter sets are not shared
+    assert np.all(np.isnan(result_cache.lookup(
+        'p_clv', PROTOSPACER, TARGETS[:4], 'mammal', 'sequence_params')))
+    with pytest.raises(ValueError):
+        result_cache.lookup('k_on', PROTOSPACER, TARGETS, *ARGS)
+
+
+def test_entry_count(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    result_cache = ResultCache(path, max_entries=10)
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[:8], np.zeros(8), *ARGS)
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[4:8], np.ones(4), *ARGS)
+    assert len(get_rows(result_cache)) == 8  # updates are not counted
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[8:12], np.ones(4),
+                       *ARGS)
+    assert len(get_rows(result_cache)) == 10
+    # the count is kept by another connection, and a reopened cache
+    ResultCache(path, max_entries=10).store('u_eff', PROTOSPACER,
+                                            TARGETS[12:14], np.ones(2), *ARGS)
+    assert len(get_rows(result_cache)) == 10
+    with sqlite3.connect(path) as connection:
+        connection.execute('DELETE FROM results WHERE target = ?',
+                           (TARGETS[12],))
+    assert len(get_rows(result_cache)) == 9
+
+
+def test_eviction(tmp_path):
+    result_cache = ResultCache(tmp_path / 'cache.sqlite', max_entries=6)
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[:6], np.zeros(6), *ARGS)
+    # looking up targets 0 and 1 makes 2 and 3 the least recently used
+    result_cache.lookup('p_clv', PROTOSPACER, TARGETS[:2], *ARGS)
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[6:8], np.ones(2), *ARGS)
+    assert get_rows(result_cache) == TARGETS[4:6] + TARGETS[:2] + TARGETS[6:8]
+    values = result_cache.lookup('p_clv', PROTOSPACER, TARGETS[:8], *ARGS)
+    np.testing.assert_array_equal(np.isnan(values), [0, 0, 1, 1, 0, 0, 0, 0])
+
+
+def test_batched_timestamps(tmp_path):
+    result_cache = ResultCache(tmp_path / 'cache.sqlite', max_pending=4)
+    result_cache.store('p_clv', PROTOSPACER, TARGETS[:6], np.zeros(6), *ARGS)
+    # lookups do not write to the database until enough are pending
+    result_cache.lookup('p_clv', PROTOSPACER, TARGETS[:3], *ARGS)
+    assert get_rows(result_cache) == TARGETS[:6]
+    result_cache.lookup('p_clv', PROTOSPACER, TARGETS[:3], *ARGS)
+    assert get_rows(result_cache) == TARGETS[:6]
+    result_cache.lookup('p_clv', PROTOSPACER, TARGETS[3:4], *ARGS)
+    assert get_rows(result_cache) == TARGETS[4:6] + TARGETS[:4]
+
+
+def test_score_with_cache(tmp_path):
+    result_cache = ResultCache(tmp_path / 'cache.sqlite')
+    scored = []
+
+    def score_func(protospacer, off_targets, context, parameter_set):
+        scored.append(off_targets)
+        return [0.] + [TARGETS.index(seq) for seq in off_targets]
+
+    values = score_with_cache(result_cache, 'k_clv', score_func, PROTOSPACER,
+                              TARGETS[:4], *ARGS)
+    np.testing.assert_array_equal(values, [0, 0, 1, 2, 3])
+    values = score_with_cache(result_cache, 'k_clv', score_func, PROTOSPACER,
+                              TARGETS[2:6], *ARGS)
+    np.testing.assert_array_equal(values, [0, 2, 3, 4, 5])
+    assert scored == [TARGETS[:4], TARGETS[4:6]]
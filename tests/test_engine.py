@@ -0,0 +1,159 @@
+"""Regression tests of the batched engine (content/engine.py) against
+crisprzip's per-complex calculations: the cleavage rate from the mean
+first-passage time, the time courses from one decomposition of the
+generator per complex, and the dissociation constant from the partition
+function (or by bisection)."""
+
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from content.engine import (get_landscape_matrix, get_rate_arrays,
+                            get_cleavage_rates, get_cleavage_rate_sweep,
+                            get_bound_fractions, get_cleaved_fractions,
+                            get_bound_fraction_sweep,
+                            get_cleaved_fraction_sweep, get_binding_consts,
+                            _get_relaxation_modes)
+from content.scoring import get_k_on_off, make_stc_list
+from content.vitro_binding import get_binding_const
+
+PROTOSPACER = 'GACGCATAAAGATGAGACGCTGG'
+TIMES = np.logspace(-2, 5, 15)
+
+
+def mutate(positions):
+    target = list(PROTOSPACER)
+    for i in positions:
+        target[i] = 'ACGT'[('ACGT'.index(target[i]) + 1) % 4]
+    return ''.join(target)
+
+
+# mismatches from PAM-distal (cleaved) to PAM-proximal (barely bound)
+OFF_TARGETS = [mutate(positions) for positions in
+               ([0], [10], [19], [2, 3], [5, 12], [15, 16, 17], [18, 19],
+                [16, 17, 18, 19])]
+
+
+@pytest.fixture(scope='module',
+                params=[('invitro', 'sequence_params'),
+                        ('invitro', 'average_params'),
+                        ('mammal', 'sequence_params'),
+                        ('ecoli', 'average_params_legacy')])
+def model(request):
+    context, parameter_set = request.param
+    complexes = make_stc_list(PROTOSPACER, OFF_TARGETS, context,
+                              parameter_set)
+    k_on, _ = get_k_on_off(context)
+    return complexes, get_landscape_matrix(complexes), k_on
+
+
+def get_passage_time(stc, binding_rate):
+    """Exact mean first-passage time to cleavage from solution, solving
+    the master equation of the rate arrays of a complex in rationals
+    (in floating point, the round-off on the diagonal of the rate matrix
+    exceeds the cleavage flux of deep off-targets)."""
+    forward = [Fraction(k) for k in stc.get_forward_rate_array(binding_rate)]
+    backward = [Fraction(k) for k in stc.backward_rate_array]
+    n = len(forward) - 1  # transient states
+    # Thomas algorithm on the tridiagonal system -M t = e_0 (columns j
+    # of M hold the rates out of state j)
+    diagonal = [forward[j] + backward[j] for j in range(n)]
+    upper = [-backward[j + 1] for j in range(n - 1)]
+    lower = [-forward[j] for j in range(n - 1)]
+    rhs = [Fraction(1)] + [Fraction(0)] * (n - 1)
+    for j in range(1, n):
+        factor = lower[j - 1] / diagonal[j - 1]
+        diagonal[j] -= factor * upper[j - 1]
+        rhs[j] -= factor * rhs[j - 1]
+    occupancy = [Fraction(0)] * n
+    occupancy[-1] = rhs[-1] / diagonal[-1]
+    for j in range(n - 2, -1, -1):
+        occupancy[j] = (rhs[j] - upper[j] * occupancy[j + 1]) / diagonal[j]
+    return sum(occupancy)
+
+
+def test_cleavage_rates(model):
+    complexes, landscapes, _ = model
+    rates = get_cleavage_rates(landscapes, complexes[0].internal_rates, 1.)
+    expected = [1 / float(get_passage_time(stc, 1.)) for stc in complexes]
+    np.testing.assert_allclose(rates, expected, rtol=1e-10)
+
+
+def test_cleavage_rate_sweep(model):
+    complexes, landscapes, _ = model
+    binding_rates = np.logspace(-3, 3, 4)
+    internal_rates = complexes[0].internal_rates
+    np.testing.assert_allclose(
+        get_cleavage_rate_sweep(landscapes, internal_rates, binding_rates),
+        np.transpose([get_cleavage_rates(landscapes, internal_rates, k)
+                      for k in binding_rates]),
+        rtol=1e-12
+    )
+
+
+@pytest.mark.parametrize('binding_rate', [1e-2, 1.])
+def test_time_courses(model, binding_rate):
+    complexes, landscapes, _ = model
+    internal_rates = complexes[0].internal_rates
+    np.testing.assert_allclose(
+        get_cleaved_fractions(landscapes, internal_rates, binding_rate,
+                              TIMES),
+        [stc.get_cleaved_fraction(TIMES, binding_rate) for stc in complexes],
+        atol=1e-5
+    )
+    np.testing.assert_allclose(
+        get_bound_fractions(landscapes, internal_rates, binding_rate, TIMES),
+        [stc.get_bound_fraction(time=TIMES, on_rate=binding_rate)
+         for stc in complexes],
+        atol=1e-5
+    )
+
+
+def test_time_course_sweeps(model):
+    complexes, landscapes, _ = model
+    internal_rates = complexes[0].internal_rates
+    binding_rates = np.array([1e-2, 1.])
+    np.testing.assert_allclose(
+        get_cleaved_fraction_sweep(landscapes, internal_rates, binding_rates,
+                                   TIMES),
+        np.stack([get_cleaved_fractions(landscapes, internal_rates, k, TIMES)
+                  for k in binding_rates], axis=1),
+        atol=1e-12
+    )
+    np.testing.assert_allclose(
+        get_bound_fraction_sweep(landscapes, internal_rates, binding_rates,
+                                 TIMES),
+        np.stack([get_bound_fractions(landscapes, internal_rates, k, TIMES)
+                  for k in binding_rates], axis=1),
+        atol=1e-12
+    )
+
+
+def test_binding_consts(model):
+    complexes, landscapes, k_on = model
+    internal_rates = complexes[0].internal_rates
+    kd = get_binding_consts(landscapes, internal_rates, k_on)
+
+    # both the equilibrium and the bisection branch are covered
+    eigenvalues, _, _ = _get_relaxation_modes(*get_rate_arrays(
+        landscapes, internal_rates, binding_rate=k_on * kd, dead=True
+    ))
+    slow = -eigenvalues[..., -2] * 3600. < 10.
+    assert slow.any() and not slow.all()
+
+    # half of the targets are bound after an hour at c = Kd
+    np.testing.assert_allclose(
+        [stc.get_bound_fraction(time=3600., on_rate=k_on * c)
+         for stc, c in zip(complexes, kd)],
+        .5, atol=1e-3
+    )
+    # and the binding isotherm fits of equilibrated targets agree within
+    # the fitted range
+    fitted = (kd > .1) & ~slow
+    np.testing.assert_allclose(
+        kd[fitted],
+        [get_binding_const(stc, k_on, mode='fit')
+         for stc, fit in zip(complexes, fitted) if fit],
+        rtol=.05
+    )
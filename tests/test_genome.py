@@ -0,0 +1,248 @@
+"""Search of PAM sites (content/genome.py) against a brute-force scan of
+the FASTA-file."""
+
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from content import genome
+from content.genome import (PamIndex, find_pam_sites, get_index_dir,
+                            load_pam_index, TARGET_LENGTH)
+from content.sequences import count_mismatches
+
+PROTOSPACER = 'GACGCATAAAGATGAGACGCTGG'
+COMPLEMENT = str.maketrans('ACGTN', 'TGCAN')
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def mutate(seq, n, rng):
+    seq = list(seq)
+    for i in rng.sample(range(20), n):
+        seq[i] = rng.choice('ACGT'.replace(seq[i], ''))
+    return ''.join(seq)
+
+
+def get_records(seed=0):
+    """Random records with Ns, in which mutants of the protospacer (with
+    0-5 mismatches) are planted on both strands."""
+    rng = random.Random(seed)
+    records = {}
+    for name, length in (('chr1', 3000), ('chr2', 1200), ('plasmid', 40)):
+        seq = [rng.choice('ACGT') for _ in range(length)]
+        for start in rng.sample(range(length - 30), length // 60):
+            site = mutate(PROTOSPACER, rng.randint(0, 5), rng)
+            if rng.random() < .5:
+                site = reverse_complement(site)
+            seq[start:start + TARGET_LENGTH] = site
+        for start in rng.sample(range(length), 3):
+            seq[start] = 'N'
+        records[name] = ''.join(seq)
+    return records
+
+
+def write_fasta(path, records, width=60):
+    with open(path, 'w') as f:
+        for name, seq in records.items():
+            f.write(f'>{name} random record\n')
+            for i in range(0, len(seq), width):
+                f.write(seq[i:i + width].lower() + '\n')
+    return path
+
+
+def scan_records(records, protospacer, max_mismatches):
+    """Compare the guide with every window of every record on both
+    strands."""
+    hits = []
+    for name, seq in records.items():
+        for start in range(len(seq) - TARGET_LENGTH + 1):
+            window = seq[start:start + TARGET_LENGTH]
+            for strand, target in (('+', window),
+                                   ('-', reverse_complement(window))):
+                if not target.endswith('GG') or 'N' in target:
+                    continue
+                mismatches = sum(a != b for a, b in
+                                 zip(target[:20], protospacer[:20]))
+                if mismatches <= max_mismatches:
+                    hits.append((name, start, strand, target, mismatches))
+    return sorted(hits, key=lambda hit: (hit[4], hit[0], hit[1], hit[2]))
+
+
+def get_hits(df):
+    return sorted(df.itertuples(index=False, name=None),
+                  key=lambda hit: (hit[4], hit[0], hit[1], hit[2]))
+
+
+@pytest.fixture(scope='module')
+def records():
+    return get_records()
+
+
+@pytest.fixture(scope='module')
+def fasta_path(records, tmp_path_factory):
+    return write_fasta(tmp_path_factory.mktemp('fasta') / 'genome.fa',
+                       records)
+
+
+@pytest.mark.parametrize('max_mismatches', [0, 2, 3, 4, 6])
+def test_search(records, fasta_path, max_mismatches):
+    index = PamIndex.from_fasta(fasta_path)
+    expected = scan_records(records, PROTOSPACER, max_mismatches)
+    assert {hit[2] for hit in expected} == {'+', '-'}
+    hits = index.search(PROTOSPACER, max_mismatches)
+    assert list(hits.columns) == ['record', 'start', 'strand', 'sequence',
+                                  'mismatches']
+    assert hits['mismatches'].is_monotonic_increasing
+    assert get_hits(hits) == expected
+
+
+def test_find_sites(records, fasta_path):
+    index = PamIndex.from_fasta(fasta_path)
+    # with SEED_NUM or more mismatches, every site is compared
+    sites, keys = index.find_sites(PROTOSPACER, max_mismatches=20)
+    assert len(sites) == len(index)
+    assert len(index) == len(scan_records(records, PROTOSPACER, 20))
+    sites, keys = index.find_sites(PROTOSPACER, max_mismatches=3)
+    expected = scan_records(records, PROTOSPACER, 3)
+    assert len(sites) == len(expected)
+    assert sorted(count_mismatches(keys).tolist()) == \
+        sorted(hit[4] for hit in expected)
+
+
+def test_block_boundaries(records, tmp_path, monkeypatch):
+    """Sites are found once, including those whose PAM spans the border
+    of two blocks."""
+    block_size = 64
+    seq = list(records['chr1'])
+    # the NGG of a forward site (positions 21-22) and the CCN of a
+    # reverse site (positions 0-1) on either side of a border
+    for border in range(block_size, 1000, 2 * block_size):
+        seq[border - 22:border + 1] = PROTOSPACER
+        seq[border + block_size - 1:border + block_size + 22] = \
+            reverse_complement(PROTOSPACER)
+    records = {'chr1': ''.join(seq)}
+    seq = records['chr1'].encode()
+    starts, strands, targets = find_pam_sites(seq)
+    monkeypatch.setattr(genome, 'BLOCK_SIZE', block_size)
+    block_starts, block_strands, block_targets = find_pam_sites(seq)
+
+    order = np.lexsort((strands, starts))
+    block_order = np.lexsort((block_strands, block_starts))
+    np.testing.assert_array_equal(block_starts[block_order], starts[order])
+    np.testing.assert_array_equal(block_strands[block_order], strands[order])
+    np.testing.assert_array_equal(block_targets[block_order], targets[order])
+
+    offsets = block_starts % block_size
+    assert np.any((block_strands == 1) & (offsets == block_size - 22))
+    assert np.any((block_strands == -1) & (offsets == block_size - 1))
+
+    index = PamIndex.from_fasta(write_fasta(tmp_path / 'chr1.fa', records))
+    assert get_hits(index.search(PROTOSPACER, 4)) == \
+        scan_records(records, PROTOSPACER, 4)
+
+
+def test_short_records(tmp_path):
+    records = {'empty': '', 'short': PROTOSPACER[:-1], 'site': PROTOSPACER,
+               'reverse': reverse_complement(PROTOSPACER)}
+    index = PamIndex.from_fasta(write_fasta(tmp_path / 'short.fa', records))
+    assert get_hits(index.search(PROTOSPACER, 0)) == [
+        ('reverse', 0, '-', PROTOSPACER, 0),
+        ('site', 0, '+', PROTOSPACER, 0),
+    ]
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    directory = tmp_path / 'genomes'
+    monkeypatch.setattr(genome, 'index_dir', directory)
+    return directory
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Count the FASTA-files that are scanned and checksummed."""
+    counts = {'scans': 0, 'checksums': 0}
+    from_fasta = PamIndex.from_fasta.__func__
+    get_file_checksum = genome.get_file_checksum
+
+    def count_scans(cls, path):
+        counts['scans'] += 1
+        return from_fasta(cls, path)
+
+    def count_checksums(path):
+        counts['checksums'] += 1
+        return get_file_checksum(path)
+
+    monkeypatch.setattr(PamIndex, 'from_fasta', classmethod(count_scans))
+    monkeypatch.setattr(genome, 'get_file_checksum', count_checksums)
+    return counts
+
+
+def test_rebuild_while_loaded(tmp_path, index_dir, builds):
+    path = tmp_path / 'genome.fa'
+    records = get_records(seed=1)
+    index = load_pam_index(write_fasta(path, records))
+    expected = scan_records(records, PROTOSPACER, 3)
+    assert get_hits(index.search(PROTOSPACER, 3)) == expected
+
+    new_records = get_records(seed=2)
+    new_index = load_pam_index(write_fasta(path, new_records))
+    assert builds['scans'] == 2
+    assert get_hits(new_index.search(PROTOSPACER, 3)) == \
+        scan_records(new_records, PROTOSPACER, 3)
+    # the memory-mapped arrays of the replaced index remain valid
+    assert get_hits(index.search(PROTOSPACER, 3)) == expected
+    assert list(index_dir.iterdir()) == [get_index_dir(path)]
+
+
+def test_concurrent_rebuilds(tmp_path, index_dir):
+    path = tmp_path / 'genome.fa'
+    load_pam_index(write_fasta(path, get_records(seed=1)))
+    records = get_records(seed=2)
+    write_fasta(path, records)
+    with ThreadPoolExecutor(8) as executor:
+        indices = list(executor.map(load_pam_index, [path] * 16))
+    expected = scan_records(records, PROTOSPACER, 3)
+    for index in indices:
+        assert get_hits(index.search(PROTOSPACER, 3)) == expected
+    assert list(index_dir.iterdir()) == [get_index_dir(path)]
+
+
+def test_stale_manifest(tmp_path, index_dir, builds):
+    path = tmp_path / 'genome.fa'
+    records = get_records(seed=1)
+    load_pam_index(write_fasta(path, records))
+    manifest_path = get_index_dir(path) / 'manifest.json'
+    assert builds == {'scans': 1, 'checksums': 1}
+
+    # size and modification time match
+    load_pam_index(path)
+    assert builds == {'scans': 1, 'checksums': 1}
+
+    # touched: the checksum matches, and only the manifest is updated
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    index = load_pam_index(path)
+    assert builds == {'scans': 1, 'checksums': 2}
+    with open(manifest_path) as f:
+        assert json.load(f)['source']['mtime_ns'] == path.stat().st_mtime_ns
+    load_pam_index(path)
+    assert builds == {'scans': 1, 'checksums': 2}
+    assert get_hits(index.search(PROTOSPACER, 3)) == \
+        scan_records(records, PROTOSPACER, 3)
+
+    # changed at the same size: the index is rebuilt
+    seq = records['chr2']
+    records['chr2'] = seq[:100] + PROTOSPACER + seq[100 + TARGET_LENGTH:]
+    write_fasta(path, records)
+    assert path.stat().st_size == stat.st_size
+    index = load_pam_index(path)
+    assert builds == {'scans': 2, 'checksums': 3}
+    assert get_hits(index.search(PROTOSPACER, 3)) == \
+        scan_records(records, PROTOSPACER, 3)
@@ -0,0 +1,107 @@
+"""Parity of the metric kernels (content/kernels.py) with crisprzip.
+
+Both backends are compared with the per-complex calculations on the
+SearcherTargetComplexes of every parameter set, on stacks that are
+evaluated by the Numba loops (up to max_loop_rows targets) and on larger
+stacks that are evaluated by NumPy.
+"""
+
+import importlib
+import random
+
+import numpy as np
+import pytest
+
+from content import kernels
+from content.engine import get_landscape_matrix
+from content.scoring import make_stc_list
+from content.vitro_cleavage import get_cleavage_prob
+
+PROTOSPACER = 'GACGCATAAAGATGAGACGCTGG'
+PARAMETER_SETS = ('sequence_params', 'average_params', 'average_params_legacy')
+
+
+def get_off_targets(n, seed=0):
+    """Mutants of the protospacer with up to 6 mismatches."""
+    rng = random.Random(seed)
+    off_targets = []
+    for _ in range(n):
+        target = list(PROTOSPACER)
+        for i in rng.sample(range(20), rng.randint(1, 6)):
+            target[i] = rng.choice('ACGT'.replace(target[i], ''))
+        off_targets.append(''.join(target))
+    return off_targets
+
+
+def get_effective_stab(stc):
+    """Boltzmann-weighted average of the R-loop states of a complex."""
+    landscape = stc.off_target_landscape
+    boltzmann = np.exp(-landscape)
+    return np.sum(landscape * boltzmann) / np.sum(boltzmann)
+
+
+@pytest.fixture(params=['numpy', 'numba'])
+def backend(request, monkeypatch):
+    """Reload the kernels with CRISPRZIP_KERNELS set to the backend."""
+    monkeypatch.setenv('CRISPRZIP_KERNELS', request.param)
+    importlib.reload(kernels)
+    if request.param == 'numba' and kernels.numba is None:
+        # without Numba, the loops run as plain Python
+        monkeypatch.setattr(kernels, 'backend', 'numba')
+    yield request.param
+    monkeypatch.delenv('CRISPRZIP_KERNELS')
+    importlib.reload(kernels)
+
+
+@pytest.fixture(scope='module', params=PARAMETER_SETS)
+def complexes(request):
+    return make_stc_list(PROTOSPACER, get_off_targets(200), 'invitro',
+                         request.param)
+
+
+@pytest.mark.parametrize('n', [1, 20, kernels.max_loop_rows,
+                               kernels.max_loop_rows + 1, 201])
+def test_cleavage_probs(backend, complexes, n):
+    complexes = complexes[:n]  # the on-target and n - 1 off-targets
+    assert kernels._use_loop(get_landscape_matrix(complexes)) == (
+        backend == 'numba' and n <= kernels.max_loop_rows)
+    rates = complexes[0].internal_rates
+    probs = kernels.cleavage_probs(get_landscape_matrix(complexes),
+                                   rates['k_off'], rates['k_f'],
+                                   rates['k_clv'])
+    expected = [get_cleavage_prob(stc) for stc in complexes]
+    np.testing.assert_allclose(probs, expected, rtol=1e-10, atol=1e-300)
+
+
+@pytest.mark.parametrize('n', [1, 20, kernels.max_loop_rows,
+                               kernels.max_loop_rows + 1, 201])
+def test_effective_stabs(backend, complexes, n):
+    complexes = complexes[:n]
+    stabs = kernels.effective_stabs(get_landscape_matrix(complexes))
+    expected = [get_effective_stab(stc) for stc in complexes]
+    np.testing.assert_allclose(stabs, expected, rtol=1e-10, atol=1e-10)
+
+
+def test_stacked_dimensions(backend, complexes):
+    landscapes = get_landscape_matrix(complexes[:24])
+    rates = complexes[0].internal_rates
+    args = rates['k_off'], rates['k_f'], rates['k_clv']
+    np.testing.assert_allclose(
+        kernels.cleavage_probs(landscapes.reshape(4, 6, -1), *args),
+        kernels.cleavage_probs(landscapes, *args).reshape(4, 6),
+        rtol=1e-12
+    )
+    np.testing.assert_allclose(
+        kernels.effective_stabs(landscapes.reshape(4, 6, -1)),
+        kernels.effective_stabs(landscapes).reshape(4, 6),
+        rtol=1e-12
+    )
+
+
+def test_deep_landscapes(backend, complexes):
+    landscapes = get_landscape_matrix(complexes[:20])
+    with np.errstate(all='raise'):
+        stabs = kernels.effective_stabs(landscapes - 800.)
+    np.testing.assert_allclose(stabs,
+                               kernels.effective_stabs(landscapes) - 800.,
+                               rtol=1e-10)
@@ -0,0 +1,72 @@
+"""Parity of the batch-built sequence landscapes (content/landscapes.py)
+with the off_target_landscape of crisprzip's SearcherSequenceComplexes."""
+
+import random
+
+import numpy as np
+import pytest
+from crisprzip.nucleic_acid import NearestNeighborModel
+
+from content.scoring import load_protein, make_stc_list
+from content.landscapes import (get_sequence_landscapes,
+                                get_nearest_neighbor_tables)
+
+PROTOSPACERS = ('GACGCATAAAGATGAGACGCTGG', 'TTGCACTGGAGGCTATTGAGAGG')
+
+
+def mutate(protospacer, positions, rng):
+    target = list(protospacer)
+    for i in positions:
+        target[i] = rng.choice('ACGT'.replace(target[i], ''))
+    return ''.join(target)
+
+
+def get_off_targets(protospacer, n=100, seed=0):
+    """Targets with mismatches at random positions, in blocks (internal
+    loops of 1-4 nts), at both ends of the R-loop, and everywhere."""
+    rng = random.Random(seed)
+    off_targets = [mutate(protospacer, rng.sample(range(20), rng.randint(1, 8)),
+                          rng) for _ in range(n)]
+    for length in range(1, 5):
+        for start in (0, 3, 10, 20 - length):
+            off_targets.append(mutate(protospacer,
+                                      range(start, start + length), rng))
+    off_targets.append(mutate(protospacer, range(20), rng))
+    # other nucleotides in the N of the PAM
+    off_targets += [protospacer[:20] + n + 'GG' for n in 'ACGT']
+    return off_targets
+
+
+@pytest.mark.parametrize('protospacer', PROTOSPACERS)
+@pytest.mark.parametrize('context', ['invitro', 'mammal'])
+def test_sequence_landscapes(protospacer, context):
+    off_targets = get_off_targets(protospacer)
+    complexes = make_stc_list(protospacer, off_targets, context,
+                              'sequence_params')
+    landscapes = get_sequence_landscapes(
+        load_protein('sequence_params', context, protospacer),
+        protospacer,
+        [protospacer] + off_targets,
+    )
+    assert landscapes.shape == (len(complexes), 21)
+    np.testing.assert_array_equal(landscapes[:, 0], 0.)
+    np.testing.assert_allclose(
+        landscapes[:, 1:],
+        [stc.off_target_landscape for stc in complexes],
+        rtol=1e-10, atol=1e-10
+    )
+
+
+def test_model_settings_unchanged(monkeypatch):
+    monkeypatch.setattr(NearestNeighborModel, 'energy_unit', 'kcalmol')
+    monkeypatch.setattr(NearestNeighborModel, 'temperature', 37)
+    get_nearest_neighbor_tables.cache_clear()
+    try:
+        tables = get_nearest_neighbor_tables()
+        assert NearestNeighborModel.energy_unit == 'kcalmol'
+        assert NearestNeighborModel.temperature == 37
+    finally:
+        get_nearest_neighbor_tables.cache_clear()
+    # energies are still in kBT at 20 deg Celsius
+    np.testing.assert_allclose(tables['loop'],
+                               get_nearest_neighbor_tables()['loop'])
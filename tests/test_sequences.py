@@ -0,0 +1,73 @@
+"""Packed sequences and mismatch keys (content/sequences.py) against
+brute-force comparisons of the sequences."""
+
+import random
+
+import numpy as np
+import pytest
+
+from content.sequences import (encode_sequences, pack_sequences,
+                               unpack_sequences, get_mismatch_keys,
+                               count_mismatches)
+from content.patterns import unpack_patterns
+
+PROTOSPACER = 'GACGCATAAAGATGAGACGCTGG'
+
+
+def get_targets(n, seed=0):
+    """Mutants of the protospacer with 0-20 mismatches in the protospacer
+    and any N of the PAM."""
+    rng = random.Random(seed)
+    targets = []
+    for _ in range(n):
+        target = list(PROTOSPACER)
+        for i in rng.sample(range(20), rng.randint(0, 20)):
+            target[i] = rng.choice('ACGT'.replace(target[i], ''))
+        target[20] = rng.choice('ACGT')
+        targets.append(''.join(target))
+    return targets
+
+
+def get_mismatch_positions(guide, target):
+    """R-loop positions (counted from the PAM) of the mismatches."""
+    return {20 - i for i in range(20) if guide[i] != target[i]}
+
+
+@pytest.fixture(scope='module')
+def targets():
+    return get_targets(500)
+
+
+def test_pack_sequences(targets):
+    codes = encode_sequences(targets)
+    packed = pack_sequences(codes)
+    assert packed.dtype == np.uint64
+    np.testing.assert_array_equal(unpack_sequences(packed), codes)
+    # the PAM is stored above the protospacer, in the order of the R-loop
+    for target, value in zip(targets[:20], packed[:20].tolist()):
+        assert value == sum('ACGT'.index(nt) << 2 * (19 - i if i < 20 else i)
+                            for i, nt in enumerate(target))
+
+
+def test_mismatch_keys(targets):
+    guide = pack_sequences(encode_sequences([PROTOSPACER]))[0]
+    keys = get_mismatch_keys(guide, pack_sequences(encode_sequences(targets)))
+    patterns = unpack_patterns(keys)
+    for target, key, pattern in zip(targets, keys.tolist(), patterns):
+        positions = get_mismatch_positions(PROTOSPACER, target)
+        assert key == sum(1 << (b - 1) for b in positions)
+        assert set(np.flatnonzero(pattern) + 1) == positions
+    np.testing.assert_array_equal(
+        count_mismatches(keys),
+        [len(get_mismatch_positions(PROTOSPACER, t)) for t in targets]
+    )
+
+
+def test_count_mismatches():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 1 << 62, size=(10, 7), dtype=np.int64)
+    keys[0, :3] = 0, 1, (1 << 62) - 1
+    np.testing.assert_array_equal(
+        count_mismatches(keys),
+        np.vectorize(lambda key: bin(key).count('1'))(keys)
+    )